@@ -0,0 +1,186 @@
+"""
+Admission control for the public routes.
+
+Each limited route gets token buckets per client IP and, where the request
+names one, per txn_id. A request that finds its bucket empty is answered
+with 429 and a Retry-After header before the view does any disk I/O, so a
+script hammering /submit_payment or /like costs a few microseconds per hit
+and leaves the workers free for everyone else.
+
+Bodies larger than the route allows are refused with 413 from the
+Content-Length header alone, before the multipart body is parsed or
+spooled to disk.
+
+Routes that hold the connection open (long-poll, SSE) can also cap how
+many of them one IP has open at a time. That count is kept per worker,
+which is what it protects: a client can't park every greenlet of one
+worker. A slot is released when the response is closed (or, if the view
+failed, when the request is torn down).
+
+The buckets live in a small mmap'd file shared by every gunicorn worker
+(like status_cache.Generation): a fixed table of (key hash, tokens, last
+update) slots, updated under an flock. When the table is full the least
+recently used slot in the probe window is reused, which at worst hands an
+old client a fresh bucket.
+"""
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import namedtuple
+
+from flask import jsonify
+
+import forksafe
+import metrics
+
+_SLOT = struct.Struct("<Qdd")   # key hash, tokens, updated_at
+PROBES = 8
+_OPEN_KEY = "admission.open"
+
+# rate = tokens added per second, burst = bucket size
+Limit = namedtuple("Limit", "rate burst")
+
+
+class SharedBuckets:
+    """Token buckets in an mmap'd file, shared across processes."""
+
+    def __init__(self, path, slots=8192):
+        self.path = path
+        self.slots = slots
+        self._lock = threading.Lock()
+        size = slots * _SLOT.size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self._flock = forksafe.FileLock(path)
+
+    @staticmethod
+    def _hash(key):
+        value = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little")
+        return value or 1   # 0 marks an empty slot
+
+    def take(self, key, limit, cost=1.0):
+        """Take `cost` tokens for key. Returns (allowed, seconds until allowed)."""
+        h = self._hash(key)
+        now = time.time()
+        with self._lock, self._flock.held():
+            offset = self._find(h)
+            slot_hash, tokens, updated = _SLOT.unpack_from(self._map, offset)
+            if slot_hash != h:
+                tokens = limit.burst
+            else:
+                tokens = min(limit.burst, tokens + max(0.0, now - updated) * limit.rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            _SLOT.pack_into(self._map, offset, h, tokens, now)
+        if allowed:
+            return True, 0.0
+        return False, (cost - tokens) / limit.rate
+
+    def _find(self, h):
+        # Linear probing over a short window; reuse the stalest slot if it's full
+        start = h % self.slots
+        oldest, oldest_at = None, None
+        for i in range(PROBES):
+            offset = ((start + i) % self.slots) * _SLOT.size
+            slot_hash, _tokens, updated = _SLOT.unpack_from(self._map, offset)
+            if slot_hash == h or slot_hash == 0:
+                return offset
+            if oldest_at is None or updated < oldest_at:
+                oldest, oldest_at = offset, updated
+        return oldest
+
+
+class AdmissionControl:
+    def __init__(self, buckets, proxy_hops=1):
+        self.buckets = buckets
+        self.proxy_hops = proxy_hops
+        self._routes = {}   # endpoint -> (max_bytes, per_ip, per_txn, open_per_ip)
+        self._open = {}     # endpoint|ip -> connections open in this worker
+        self._open_lock = threading.Lock()
+
+    def limit(self, endpoint, max_bytes=None, per_ip=None, per_txn=None, open_per_ip=None):
+        self._routes[endpoint] = (max_bytes, per_ip, per_txn, open_per_ip)
+
+    def client_ip(self, req):
+        # Behind N proxies the client is the Nth address from the right of
+        # X-Forwarded-For; anything further left can be forged by the client
+        route = req.access_route
+        if self.proxy_hops and req.headers.get("X-Forwarded-For") and len(route) >= self.proxy_hops:
+            return route[-self.proxy_hops]
+        return req.remote_addr or "-"
+
+    def check(self, req):
+        """None to let the request through, or the response that refuses it."""
+        rules = self._routes.get(req.endpoint)
+        if rules is None:
+            return None
+        max_bytes, per_ip, per_txn, open_per_ip = rules
+
+        if max_bytes is not None:
+            if req.content_length is None and req.headers.get("Transfer-Encoding"):
+                return self._refuse(req, "length", 411, "⚠️ Upload size unknown, please retry.")
+            if (req.content_length or 0) > max_bytes:
+                return self._refuse(req, "size", 413,
+                                    f"⚠️ File too large (max {max_bytes // (1024 * 1024) or 1} MB).")
+
+        # IP first: it needs nothing from the body
+        if per_ip is not None:
+            allowed, wait = self.buckets.take(f"{req.endpoint}|ip|{self.client_ip(req)}", per_ip)
+            if not allowed:
+                return self._refuse(req, "ip", 429, "⚠️ Too many requests, please wait a moment.", wait)
+
+        if per_txn is not None:
+            txn_id = req.form.get("txn_id") or req.args.get("txn_id")
+            if txn_id:
+                allowed, wait = self.buckets.take(f"{req.endpoint}|txn|{txn_id}", per_txn)
+                if not allowed:
+                    return self._refuse(req, "txn", 429,
+                                        "⚠️ Too many attempts for this transaction, please wait.", wait)
+
+        if open_per_ip is not None:
+            key = f"{req.endpoint}|{self.client_ip(req)}"
+            with self._open_lock:
+                if self._open.get(key, 0) >= open_per_ip:
+                    return self._refuse(req, "open", 429, "⚠️ Too many open connections, please wait.", 5)
+                self._open[key] = self._open.get(key, 0) + 1
+            req.environ[_OPEN_KEY] = key
+        return None
+
+    def hand_off(self, req, response):
+        """after_request: keep the connection slot until the response is closed."""
+        key = req.environ.pop(_OPEN_KEY, None)
+        if key is not None:
+            response.call_on_close(lambda: self._close(key))
+        return response
+
+    def teardown(self, req):
+        """teardown_request: release a slot the response never took over (the view raised)."""
+        key = req.environ.pop(_OPEN_KEY, None)
+        if key is not None:
+            self._close(key)
+
+    def _close(self, key):
+        with self._open_lock:
+            left = self._open.get(key, 0) - 1
+            if left > 0:
+                self._open[key] = left
+            else:
+                self._open.pop(key, None)
+
+    def _refuse(self, req, scope, status, message, retry_after=None):
+        metrics.registry.inc("admission_rejected_total", 1, route=req.url_rule.rule, scope=scope)
+        resp = jsonify({"error": "rate_limited" if status == 429 else "rejected", "message": message})
+        resp.status_code = status
+        if retry_after is not None:
+            resp.headers["Retry-After"] = str(max(1, int(retry_after + 0.999)))
+        return resp
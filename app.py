@@ -1,6 +1,31 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_from_directory
-import requests, json, os
-from datetime import timedelta
+import startup  # first, so the startup report also times the imports below
+
+from flask import Flask, Response, g, render_template, request, jsonify, session, redirect, url_for, send_from_directory
+import json, math, os, time
+from datetime import datetime, timedelta, timezone
+from urllib.parse import quote
+from markupsafe import escape
+from werkzeug.security import safe_join
+
+import admission
+import approval_events
+import assets
+import chunked_upload
+import course_catalog
+import media
+import metrics
+import like_counter
+import page_cache
+import payment_states
+import payment_store
+import profiler
+import screenshots
+import signed_urls
+import status_cache
+import telegram_dispatch
+import transcoder
+
+startup.report.mark("imports")
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024
@@ -9,21 +34,110 @@ app.secret_key = os.getenv("SECRET_KEY", "change_this_secret_key")
 app.permanent_session_lifetime = timedelta(days=7)
 
 DATA_FILE = "payments.json"
+DB_FILE = os.getenv("DB_FILE", "stockboy.db")
+PAYMENT_STORE = os.getenv("PAYMENT_STORE", "sqlite")  # "sqlite", "json" or "log"
+STATUS_GEN_FILE = os.getenv("STATUS_GEN_FILE", "status.gen")
 LIKES_FILE = "likes.json"
 UPLOAD_FOLDER = "static/uploads"  # For course materials (PDFs, videos)
 PAYMENT_SS_FOLDER = "payment_ss"   # For payment screenshots only
+UPLOAD_TMP_FOLDER = "upload_tmp"   # Chunked uploads in progress
+HLS_FOLDER = "static/hls"          # Adaptive renditions of course videos
 
 # Read from environment variables (set in Render dashboard)
 BOT_TOKEN = os.getenv("BOT_TOKEN", "7581428285:AAF6qwxQYniDoZnhiwERUP_k0Vlf-k6MVSQ")
 CHAT_ID = os.getenv("CHAT_ID", "1924050423")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+
+# Hashed CSS/font/image URLs from build_assets.py (CDN Tailwind if not built)
+static_assets = assets.Assets(app, base_url=os.getenv("ASSETS_BASE_URL"))
+startup.report.mark("flask app + assets")
+
+# -------------------------------------------------
+# REQUEST TIMING + METRICS
+# -------------------------------------------------
+# PROFILE_SLOW_MS=500 dumps sampled stacks of requests slower than 500 ms
+slow_profiler = profiler.SlowRequestProfiler(
+    os.getenv("PROFILE_DIR", "profiles"),
+    slow_ms=float(os.getenv("PROFILE_SLOW_MS", "0")),
+    interval_ms=float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+    g.profile_token = slow_profiler.begin()
+
+
+@app.after_request
+def record_timing(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        # The URL rule, not the path, so /media/<filename> is one series
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.observe_request(route, request.method, response.status_code, elapsed)
+        slow_profiler.end(g.pop("profile_token", None), route, elapsed)
+    return response
+
+
+# -------------------------------------------------
+# ADMISSION CONTROL (RATE LIMITS)
+# -------------------------------------------------
+# Token buckets per IP and per txn_id, shared by all workers through an mmap'd file
+gate = admission.AdmissionControl(
+    admission.SharedBuckets(os.getenv("ADMISSION_FILE", "admission.buckets")),
+    # Render puts one proxy in front of the app; 0 = trust the socket address only
+    proxy_hops=int(os.getenv("PROXY_HOPS", "1"))
+)
+ADMISSION_ENABLED = os.getenv("ADMISSION", "on") != "off"
+SCREENSHOT_MAX_BYTES = int(os.getenv("SCREENSHOT_MAX_MB", "15")) * 1024 * 1024
+
+gate.limit("submit_payment", max_bytes=SCREENSHOT_MAX_BYTES,
+           per_ip=admission.Limit(rate=5 / 60, burst=5), per_txn=admission.Limit(rate=1 / 60, burst=3))
+gate.limit("like_site", max_bytes=1024, per_ip=admission.Limit(rate=2, burst=10))
+# Old browsers poll every 8.5 s; leave room for several users behind one NAT
+gate.limit("check_approval", max_bytes=4096,
+           per_ip=admission.Limit(rate=2, burst=30), per_txn=admission.Limit(rate=0.5, burst=10))
+# These hold a greenlet for up to 30 s (long-poll) or 5 min (SSE): cap how many one IP opens
+gate.limit("wait_approval", max_bytes=4096, per_ip=admission.Limit(rate=1, burst=30),
+           per_txn=admission.Limit(rate=0.5, burst=10), open_per_ip=20)
+gate.limit("approval_stream", per_ip=admission.Limit(rate=0.2, burst=20),
+           per_txn=admission.Limit(rate=0.1, burst=5), open_per_ip=20)
+
+
+@app.before_request
+def admit():
+    if ADMISSION_ENABLED:
+        return gate.check(request)
+
+
+@app.after_request
+def admit_done(response):
+    return gate.hand_off(request, response)
+
+
+@app.teardown_request
+def admit_teardown(exc=None):
+    gate.teardown(request)
+
+
+# Outbound calls go through a persistent outbox drained by background threads
+telegram = telegram_dispatch.TelegramDispatcher(
+    BOT_TOKEN,
+    api_url=TELEGRAM_API_URL,
+    db_file=DB_FILE,
+    workers=int(os.getenv("TELEGRAM_WORKERS", "2")),
+    buckets=gate.buckets
+)
+startup.report.mark("admission + telegram outbox")
 
 
 # -------------------------------------------------
 # TELEGRAM SENDER (CLEAN + NO DUPLICATION)
 # -------------------------------------------------
 def send_telegram(message, txn_id=None, parse_mode="Markdown"):
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-
     if txn_id:
         keyboard = {
             "inline_keyboard": [
@@ -46,32 +160,28 @@ def send_telegram(message, txn_id=None, parse_mode="Markdown"):
             "parse_mode": parse_mode
         }
 
-    requests.post(url, json=payload)
+    telegram.send("sendMessage", payload)
 
 def send_telegram_photo(photo_path, caption, txn_id=None):
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendPhoto"
-    
-    with open(photo_path, "rb") as photo_file:
-        files = {"photo": photo_file}
-        data = {
-            "chat_id": CHAT_ID, 
-            "caption": caption,
-            "parse_mode": "Markdown"
-        }
-        
-        # Add inline keyboard buttons if txn_id is provided
-        if txn_id:
-            keyboard = {
-                "inline_keyboard": [
-                    [
-                        {"text": "✅ Approve", "callback_data": f"approve_{txn_id}"},
-                        {"text": "❌ Reject", "callback_data": f"reject_{txn_id}"}
-                    ]
+    data = {
+        "chat_id": CHAT_ID,
+        "caption": caption,
+        "parse_mode": "Markdown"
+    }
+
+    # Add inline keyboard buttons if txn_id is provided
+    if txn_id:
+        keyboard = {
+            "inline_keyboard": [
+                [
+                    {"text": "✅ Approve", "callback_data": f"approve_{txn_id}"},
+                    {"text": "❌ Reject", "callback_data": f"reject_{txn_id}"}
                 ]
-            }
-            data["reply_markup"] = json.dumps(keyboard)
-        
-        requests.post(url, files=files, data=data)
+            ]
+        }
+        data["reply_markup"] = json.dumps(keyboard)
+
+    telegram.send("sendPhoto", data, photo_path=photo_path)
 
 # -------------------------------------------------
 # FOLDER CHECK
@@ -82,70 +192,121 @@ def ensure_folders():
 
 ensure_folders()
 
+catalog = course_catalog.CourseCatalog(UPLOAD_FOLDER)
+uploads = chunked_upload.ChunkedUploads(UPLOAD_TMP_FOLDER, UPLOAD_FOLDER)
+metrics.instrument(catalog, "filesystem", ["rescan", "add_file"])
+metrics.instrument(uploads, "filesystem", ["put_chunk", "finalize"])
+
+# MEDIA_OFFLOAD=nginx|sendfile lets the front proxy carry the bytes
+media_files = media.MediaFiles(
+    UPLOAD_FOLDER,
+    db_file=DB_FILE,
+    offload=os.getenv("MEDIA_OFFLOAD"),
+    accel_prefix=os.getenv("MEDIA_ACCEL_PREFIX", "/protected-uploads/")
+)
+hls_files = media.MediaFiles(
+    HLS_FOLDER,
+    db_file=DB_FILE,
+    offload=os.getenv("MEDIA_OFFLOAD"),
+    accel_prefix=os.getenv("MEDIA_HLS_ACCEL_PREFIX", "/protected-hls/")
+)
+
+# Uploaded videos are transcoded to HLS in a process pool (needs ffmpeg)
+video_jobs = transcoder.Transcoder(
+    UPLOAD_FOLDER,
+    HLS_FOLDER,
+    db_file=DB_FILE,
+    workers=int(os.getenv("TRANSCODE_WORKERS", "1"))
+)
+
+# Media links are minted signed and expiring, so checking one needs no session
+media_urls = signed_urls.UrlSigner(
+    os.getenv("MEDIA_URL_KEY", app.secret_key),
+    ttl=int(os.getenv("MEDIA_URL_TTL", "21600")),
+    step=int(os.getenv("MEDIA_URL_STEP", "3600"))
+)
+startup.report.mark("catalog + media")
+
 
 # -------------------------------------------------
 # PAYMENT SYSTEM
 # -------------------------------------------------
-def load_data():
-    if not os.path.exists(DATA_FILE):
-        with open(DATA_FILE, "w") as f:
-            json.dump([], f)
-    with open(DATA_FILE, "r") as f:
-        return json.load(f)
+# Lookups by txn_id are indexed; the first start imports payments.json
+store = payment_store.open_store(PAYMENT_STORE, db_file=DB_FILE, json_file=DATA_FILE)
+metrics.instrument(store, "storage", ["get", "get_many", "add", "set_status", "set_status_many", "get_by_id",
+                                     "get_by_ids", "page", "all"], prefix="payments")
+
+# /check_approval reads through this; every store write bumps the shared generation
+statuses = status_cache.StatusCache(store, status_cache.Generation(STATUS_GEN_FILE))
+# Every approve/reject goes through the state machine (CAS + dedup + audit log)
+payments = payment_states.PaymentStateMachine(store, db_file=DB_FILE)
+waiters = approval_events.ApprovalWaiters(statuses)
+startup.report.mark("payment store")
 
+APPROVAL_STREAM_SECONDS = int(os.getenv("APPROVAL_STREAM_SECONDS", "300"))
+
+# Rendered pages/fragments, keyed by what they depend on
+pages = page_cache.PageCache(max_entries=int(os.getenv("PAGE_CACHE_ENTRIES", "512")))
 
-def save_data(data):
-    with open(DATA_FILE, "w") as f:
-        json.dump(data, f, indent=4)
 
 @app.route("/")
 def home():
-    return render_template("index.html")
+    # Same page for every visitor until a new build; the like count is filled in per request
+    page = pages.slotted(
+        ("home", static_assets.version),
+        lambda: render_template("index.html", likes=page_cache.SLOT)
+    )
+    return page_cache.respond(page.fill(likes.value()), request)
 
 import os
-from werkzeug.utils import secure_filename
 
 # Ensure payment screenshot folder exists
 if not os.path.exists(PAYMENT_SS_FOLDER):
     os.makedirs(PAYMENT_SS_FOLDER)
 
+# One blob per distinct image, plus compact/thumbnail copies built in a pool
+shots = screenshots.ScreenshotStore(PAYMENT_SS_FOLDER, db_file=DB_FILE)
+metrics.instrument(shots, "filesystem", ["ingest", "process"])
+# Screenshots from before hashing get their hash and reuse count, once;
+# copies of the same image are pointed at one file and deleted
+shots.discard(store.backfill_ss_hashes(shots.adopt))
+startup.report.mark("screenshots")
+
+
+def payment_ss_url(path):
+    if not path:
+        return None
+    return media_urls.sign("/payment_ss/" + os.path.relpath(path, PAYMENT_SS_FOLDER).replace(os.sep, "/"))
+
 @app.route("/submit_payment", methods=["POST"])
 def submit_payment():
     user_name = request.form.get("user_name")
     txn_id = request.form.get("txn_id")
     screenshot = request.files.get("screenshot")
 
-    # Load old data
-    data = load_data()
-
     # 🔥 STOP MULTIPLE SUBMISSIONS (IMPORTANT)
-    for entry in data:
-        if entry["txn_id"] == txn_id:
-            return jsonify({"message": "⚠️ This payment is already submitted!"})
-
-    # Save screenshot to payment_ss folder (NOT in course uploads)
-    filename = secure_filename(f"{txn_id}.png")
-    filepath = os.path.join(PAYMENT_SS_FOLDER, filename)
-    screenshot.save(filepath)
-
-    # Save new data
-    data.append({
-        "user": user_name,
-        "txn_id": txn_id,
-        "status": "pending",
-        "ss_path": filepath
-    })
-    save_data(data)
-
-    # Send Telegram message with inline buttons (use relative path for Telegram)
-    send_telegram_photo(
-        filepath,
-        f"📩 *New Payment Request*\n\n👤 *Name:* {user_name}\n💳 *Txn ID:* `{txn_id}`\n⏳ *Status:* Pending Approval",
+    if store.get(txn_id):
+        return jsonify({"message": "⚠️ This payment is already submitted!"})
+
+    # Save screenshot to payment_ss folder (NOT in course uploads).
+    # It is hashed while saving; a resubmitted image reuses the same blob.
+    ss_hash, filepath, reused_by = shots.ingest(screenshot.stream, txn_id)
+
+    # Save new data (unique txn_id index catches a parallel double submit)
+    if store.add(user_name, txn_id, filepath, ss_hash) is None:
+        return jsonify({"message": "⚠️ This payment is already submitted!"})
+    shots.link(txn_id, ss_hash)
+
+    caption = f"📩 *New Payment Request*\n\n👤 *Name:* {user_name}\n💳 *Txn ID:* `{txn_id}`\n⏳ *Status:* Pending Approval"
+    if reused_by:
+        caption += "\n\n⚠️ *Same screenshot as:* " + ", ".join(f"`{t}`" for t in reused_by[:5])
+
+    # Send Telegram message with inline buttons, using the recompressed copy once it's built
+    shots.process_async(ss_hash, then=lambda info: send_telegram_photo(
+        (info or {}).get("compact_path") or filepath,
+        caption,
         txn_id=txn_id
-    )
-    
-    # Update ss_path to be relative for web access
-    data[-1]["ss_path"] = filepath  # Keep full path for file access
+    ))
 
     return jsonify({"message": "✅ Payment Submitted! Wait for approval."})
 
@@ -154,12 +315,53 @@ def submit_payment():
 def check_approval():
     txn_id = request.form.get("txn_id")
 
-    data = load_data()
-    for x in data:
-        if x["txn_id"] == txn_id:
-            return jsonify({"status": x["status"]})
+    status = statuses.get_status(txn_id)
+    return jsonify({"status": status or "not_found"})
 
-    return jsonify({"status": "not_found"})
+
+# Long-poll: returns as soon as the status differs from `status`, or after `timeout`
+@app.route("/wait_approval", methods=["POST"])
+def wait_approval():
+    txn_id = request.form.get("txn_id")
+    known = request.form.get("status")
+    try:
+        timeout = float(request.form.get("timeout", 25))
+    except ValueError:
+        timeout = 25
+    if not math.isfinite(timeout):
+        timeout = 25
+    timeout = min(max(timeout, 0), 30)
+
+    if known == "not_found":
+        known = None
+    status = waiters.wait(txn_id, known, timeout)
+    return jsonify({"status": status or "not_found"})
+
+
+# Server-Sent Events: pushes every status change until approved/rejected
+@app.route("/approval_stream")
+def approval_stream():
+    txn_id = request.args.get("txn_id")
+
+    def events():
+        deadline = time.monotonic() + APPROVAL_STREAM_SECONDS
+        status = statuses.get_status(txn_id)
+        yield f"event: status\ndata: {json.dumps({'status': status or 'not_found'})}\n\n"
+        while status not in ("approved", "rejected"):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break  # the browser's EventSource reconnects by itself
+            new_status = waiters.wait(txn_id, status, min(15, remaining))
+            if new_status == status:
+                yield ": keep-alive\n\n"
+                continue
+            status = new_status
+            yield f"event: status\ndata: {json.dumps({'status': status or 'not_found'})}\n\n"
+
+    return Response(events(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
 
 
 @app.route("/start_session", methods=["POST"])
@@ -167,8 +369,8 @@ def start_session():
     txn_id = request.form.get("txn_id")
     user_name = request.form.get("user_name", "User")
 
-    data = load_data()
-    approved = any(x["txn_id"] == txn_id and x["status"] == "approved" for x in data)
+    entry = store.get(txn_id)
+    approved = entry is not None and entry["status"] == "approved"
 
     if not approved:
         return jsonify({"ok": False})
@@ -181,30 +383,21 @@ def start_session():
 # -------------------------------------------------
 # LIKES SYSTEM
 # -------------------------------------------------
-def load_likes():
-    if not os.path.exists(LIKES_FILE):
-        with open(LIKES_FILE, "w") as f:
-            json.dump({"likes": 0}, f)
-    with open(LIKES_FILE, "r") as f:
-        return json.load(f)
-
-
-def save_likes(data):
-    with open(LIKES_FILE, "w") as f:
-        json.dump(data, f, indent=4)
+# Clicks are counted in memory and flushed to SQLite every second;
+# the first start imports the count from likes.json
+likes = like_counter.LikeCounter(db_file=DB_FILE, seed_file=LIKES_FILE)
+metrics.instrument(likes, "storage", ["flush"])
+startup.report.mark("likes")
 
 
 @app.route("/like", methods=["POST"])
 def like_site():
-    data = load_likes()
-    data["likes"] += 1
-    save_likes(data)
-    return jsonify(data)
+    return jsonify({"likes": likes.increment()})
 
 
 @app.route("/get_likes")
 def get_likes():
-    return jsonify(load_likes())
+    return jsonify({"likes": likes.value()})
 
 
 # -------------------------------------------------
@@ -224,116 +417,9 @@ def admin_login():
             session["admin"] = True
             return redirect("/admin")
 
-        return """
-        <!DOCTYPE html>
-        <html lang="en">
-        <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1">
-        <title>Admin Login – Stockboy</title>
-        <script src="https://cdn.tailwindcss.com"></script>
-        <link rel="preconnect" href="https://fonts.googleapis.com">
-        <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
-        <link href="https://fonts.googleapis.com/css2?family=Poppins:wght@300;400;500;600;700;800&display=swap" rel="stylesheet">
-        <script>
-          tailwind.config = {
-            theme: {
-              extend: {
-                colors: {
-                  gold: { light: '#f6d67c', DEFAULT: '#d9a520' },
-                  dark: { bg1: '#0f2027', bg2: '#203a43', bg3: '#2c5364' }
-                },
-                fontFamily: { sans: ['Poppins', 'sans-serif'] }
-              }
-            }
-          }
-        </script>
-        <style>
-          .bg-gradient-dark { background: linear-gradient(160deg, #0f2027, #203a43, #2c5364); }
-          .text-gradient-gold {
-            background: linear-gradient(90deg, #f6d67c, #d9a520);
-            -webkit-background-clip: text;
-            -webkit-text-fill-color: transparent;
-            background-clip: text;
-          }
-        </style>
-        </head>
-        <body class="bg-gradient-dark text-white font-sans min-h-screen flex items-center justify-center px-4">
-        <div class="bg-black/40 backdrop-blur-md rounded-2xl p-8 border border-white/10 shadow-2xl max-w-md w-full">
-          <div class="text-center mb-6">
-            <h2 class="text-2xl font-bold text-gradient-gold mb-2">Admin Login</h2>
-            <p class="text-red-400 text-sm">Invalid Credentials</p>
-          </div>
-          <form method="POST" class="space-y-4">
-            <input name='username' placeholder='Username' 
-                   class='w-full px-4 py-3 bg-white/10 backdrop-blur-md border border-white/20 rounded-xl text-white placeholder-gray-400 focus:outline-none focus:ring-2 focus:ring-gold-DEFAULT'>
-            <input name='password' type='password' placeholder='Password' 
-                   class='w-full px-4 py-3 bg-white/10 backdrop-blur-md border border-white/20 rounded-xl text-white placeholder-gray-400 focus:outline-none focus:ring-2 focus:ring-gold-DEFAULT'>
-            <button type='submit' 
-                    class='w-full bg-gradient-to-r from-gold-light to-gold-DEFAULT text-gray-900 font-bold py-3 px-6 rounded-xl shadow-lg shadow-yellow-500/50 hover:shadow-yellow-500/70 transition-all duration-300 active:scale-95'>
-              Login
-            </button>
-          </form>
-        </div>
-        </body>
-        </html>
-        """
-
-    return """
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1">
-    <title>Admin Login – Stockboy</title>
-    <script src="https://cdn.tailwindcss.com"></script>
-    <link rel="preconnect" href="https://fonts.googleapis.com">
-    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
-    <link href="https://fonts.googleapis.com/css2?family=Poppins:wght@300;400;500;600;700;800&display=swap" rel="stylesheet">
-    <script>
-      tailwind.config = {
-        theme: {
-          extend: {
-            colors: {
-              gold: { light: '#f6d67c', DEFAULT: '#d9a520' },
-              dark: { bg1: '#0f2027', bg2: '#203a43', bg3: '#2c5364' }
-            },
-            fontFamily: { sans: ['Poppins', 'sans-serif'] }
-          }
-        }
-      }
-    </script>
-    <style>
-      .bg-gradient-dark { background: linear-gradient(160deg, #0f2027, #203a43, #2c5364); }
-      .text-gradient-gold {
-        background: linear-gradient(90deg, #f6d67c, #d9a520);
-        -webkit-background-clip: text;
-        -webkit-text-fill-color: transparent;
-        background-clip: text;
-      }
-    </style>
-    </head>
-    <body class="bg-gradient-dark text-white font-sans min-h-screen flex items-center justify-center px-4">
-    <div class="bg-black/40 backdrop-blur-md rounded-2xl p-8 border border-white/10 shadow-2xl max-w-md w-full">
-      <div class="text-center mb-6">
-        <img src="/static/logo.png" alt="Logo" class="w-16 h-16 mx-auto mb-4 rounded-full shadow-lg shadow-yellow-500/45">
-        <h2 class="text-2xl font-bold text-gradient-gold mb-2">Admin Login</h2>
-        <p class="text-gray-400 text-sm">Enter your credentials to access the admin panel</p>
-      </div>
-      <form method="POST" class="space-y-4">
-        <input name='username' placeholder='Username' 
-               class='w-full px-4 py-3 bg-white/10 backdrop-blur-md border border-white/20 rounded-xl text-white placeholder-gray-400 focus:outline-none focus:ring-2 focus:ring-gold-DEFAULT'>
-        <input name='password' type='password' placeholder='Password' 
-               class='w-full px-4 py-3 bg-white/10 backdrop-blur-md border border-white/20 rounded-xl text-white placeholder-gray-400 focus:outline-none focus:ring-2 focus:ring-gold-DEFAULT'>
-        <button type='submit' 
-                class='w-full bg-gradient-to-r from-gold-light to-gold-DEFAULT text-gray-900 font-bold py-3 px-6 rounded-xl shadow-lg shadow-yellow-500/50 hover:shadow-yellow-500/70 transition-all duration-300 active:scale-95'>
-          Login
-        </button>
-      </form>
-    </div>
-    </body>
-    </html>
-    """
+        return render_template("admin_login.html", error=True)
+
+    return render_template("admin_login.html")
 
 
 @app.route("/admin")
@@ -341,38 +427,169 @@ def admin_panel():
     if not session.get("admin"):
         return redirect("/admin-login")
 
-    data = load_data()
-    return render_template("admin_panel.html", data=data)
+    # Rows are loaded page by page from /admin/api/payments
+    return render_template("admin_panel.html")
+
+
+def admin_rows(entries):
+    # Thumbnails instead of full screenshots, and flag images used more than once
+    hashes = [entry.get("ss_hash") for entry in entries]
+    infos = shots.info_many(hashes)
+    uses = shots.use_counts(hashes)
+
+    rows = []
+    for entry in entries:
+        info = infos.get(entry.get("ss_hash")) or {}
+        rows.append({
+            "id": entry["id"],
+            "user": entry.get("user"),
+            "txn_id": entry["txn_id"],
+            "status": entry["status"],
+            "created_at": entry.get("created_at"),
+            "ss_url": payment_ss_url(entry.get("ss_path")),
+            "thumb_url": payment_ss_url(info.get("thumb_path")),
+            "ss_reused": uses.get(entry.get("ss_hash"), 0) > 1
+        })
+    return rows
+
+
+def parse_date(value, end_of_day=False):
+    # YYYY-MM-DD from <input type="date">, as a UTC timestamp
+    if not value:
+        return None
+    day = datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    if end_of_day:
+        day += timedelta(days=1)
+    return day.timestamp()
+
 
+@app.route("/admin/api/payments")
+def admin_api_payments():
+    if not session.get("admin"):
+        return jsonify({"error": "Admin login required"}), 403
 
-@app.route("/approve/<int:index>")
-def approve(index):
-    data = load_data()
-    user = data[index]["user"]
-    txn_id = data[index]["txn_id"]
+    try:
+        limit = max(1, min(int(request.args.get("limit", 50)), 200))
+        cursor = request.args.get("cursor")
+        entries = store.page(
+            status=request.args.get("status") or None,
+            user=request.args.get("user") or None,
+            since=parse_date(request.args.get("since")),
+            until=parse_date(request.args.get("until"), end_of_day=True),
+            before_id=int(cursor) if cursor else None,
+            limit=limit
+        )
+    except ValueError:
+        return jsonify({"error": "Invalid filter"}), 400
+
+    # Cursor = id of the last row; ids never shift, unlike list positions
+    next_cursor = entries[-1]["id"] if len(entries) == limit else None
+    return jsonify({"items": admin_rows(entries), "next_cursor": next_cursor})
+
+
+@app.route("/approve/<int:payment_id>")
+def approve(payment_id):
+    if not session.get("admin"):
+        return redirect("/admin-login")
 
-    data[index]["status"] = "approved"
-    save_data(data)
+    entry = store.get_by_id(payment_id)
+    if entry is None:
+        return redirect("/admin")
+    user = entry["user"]
+    txn_id = entry["txn_id"]
+
+    if not payments.allowed(entry["status"], "approved", actor="admin"):
+        return redirect("/admin")
+    result = payments.transition(txn_id, "approved", actor="admin", expected=entry["status"])
+    if result.outcome != payment_states.APPLIED:
+        return redirect("/admin")
 
     send_telegram(f"✅ Payment Approved\n\n👤 {user}\n💳 {txn_id}\n🔓 Dashboard Access Granted")
 
     return redirect("/admin")
 
 
-@app.route("/reject/<int:index>")
-def reject(index):
-    data = load_data()
-    user = data[index]["user"]
-    txn_id = data[index]["txn_id"]
+@app.route("/reject/<int:payment_id>")
+def reject(payment_id):
+    if not session.get("admin"):
+        return redirect("/admin-login")
+
+    entry = store.get_by_id(payment_id)
+    if entry is None:
+        return redirect("/admin")
+    user = entry["user"]
+    txn_id = entry["txn_id"]
 
-    data[index]["status"] = "rejected"
-    save_data(data)
+    if not payments.allowed(entry["status"], "rejected", actor="admin"):
+        return redirect("/admin")
+    result = payments.transition(txn_id, "rejected", actor="admin", expected=entry["status"])
+    if result.outcome != payment_states.APPLIED:
+        return redirect("/admin")
 
     send_telegram(f"❌ Payment Rejected\n\n👤 {user}\n💳 {txn_id}\n🚫 Access Denied")
 
     return redirect("/admin")
 
 
+BATCH_ACTIONS = {"approve": "approved", "reject": "rejected"}
+BATCH_MAX = int(os.getenv("ADMIN_BATCH_MAX", "500"))
+# Telegram caps a message at 4096 characters
+DIGEST_MAX_LINES = 40
+
+
+def send_decision_digest(status, records):
+    """One Telegram message for a whole batch instead of one per payment."""
+    icon, word = ("✅", "Approved") if status == "approved" else ("❌", "Rejected")
+    lines = [f"{icon} <b>{len(records)} Payment{'s' if len(records) != 1 else ''} {word}</b> (batch)", ""]
+    for record in records[:DIGEST_MAX_LINES]:
+        lines.append(f"👤 {escape(record.get('user') or '?')} · 💳 <code>{escape(record['txn_id'])}</code>")
+    if len(records) > DIGEST_MAX_LINES:
+        lines.append(f"… and {len(records) - DIGEST_MAX_LINES} more")
+    # HTML, so underscores in names can't break the formatting of the whole digest
+    send_telegram("\n".join(lines), parse_mode="HTML")
+
+
+@app.route("/admin/api/payments/batch", methods=["POST"])
+def admin_batch():
+    if not session.get("admin"):
+        return jsonify({"error": "Admin login required"}), 403
+
+    data = request.get_json(silent=True) or {}
+    status = BATCH_ACTIONS.get(data.get("action"))
+    ids = data.get("ids")
+    if status is None or not isinstance(ids, list) or not all(isinstance(i, int) for i in ids):
+        return jsonify({"error": "Expected {\"action\": \"approve\"|\"reject\", \"ids\": [...]}"}), 400
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > BATCH_MAX:
+        return jsonify({"error": f"At most {BATCH_MAX} payments per batch"}), 400
+
+    entries = store.get_by_ids(ids)
+    results = {}
+    changes, change_ids = [], []
+    for payment_id in ids:
+        entry = entries.get(payment_id)
+        if entry is None:
+            results[payment_id] = {"id": payment_id, "outcome": "not_found"}
+        elif not payments.allowed(entry["status"], status, actor="admin"):
+            results[payment_id] = {"id": payment_id, "outcome": "invalid", "status": entry["status"]}
+        else:
+            changes.append((entry["txn_id"], status, entry["status"]))
+            change_ids.append(payment_id)
+
+    applied = []
+    for payment_id, result in zip(change_ids, payments.transition_many(changes, actor="admin")):
+        record = result.record or {}
+        results[payment_id] = {"id": payment_id, "outcome": result.outcome, "status": record.get("status")}
+        if result.outcome == payment_states.APPLIED:
+            applied.append(result.record)
+
+    if applied:
+        send_decision_digest(status, applied)
+
+    items = [results[payment_id] for payment_id in ids]
+    return jsonify({"status": status, "applied": len(applied), "items": items})
+
+
 # -------------------------------------------------
 # FILE UPLOAD
 # -------------------------------------------------
@@ -380,13 +597,80 @@ def reject(index):
 def upload_file():
     if request.method == "POST":
         f = request.files["file"]
-        f.save(os.path.join(UPLOAD_FOLDER, f.filename))
+        # Write then rename, so the folder mtime changes for every worker's catalog
+        path = os.path.join(UPLOAD_FOLDER, f.filename)
+        with metrics.span("filesystem", "save_upload"):
+            f.save(path + ".part")
+            os.replace(path + ".part", path)
+        catalog.add_file(f.filename)
+        media_files.hash_later(f.filename)
+        video_jobs.submit(f.filename)
         return redirect("/upload")
 
-    files = os.listdir(UPLOAD_FOLDER)
+    with metrics.span("filesystem", "listdir_uploads"):
+        files = os.listdir(UPLOAD_FOLDER)
     return render_template("upload.html", files=files)
 
 
+# Resumable chunked upload for large videos (init -> chunks -> finalize)
+@app.errorhandler(chunked_upload.UploadError)
+def upload_error(e):
+    return jsonify({"error": str(e)}), e.status
+
+
+@app.route("/upload/chunked", methods=["POST"])
+def chunked_init():
+    if not session.get("admin"):
+        return jsonify({"error": "Admin login required"}), 403
+
+    body = request.get_json(silent=True) or {}
+    info = uploads.init(
+        body.get("filename"),
+        body.get("size"),
+        sha256=body.get("sha256"),
+        chunk_size=body.get("chunk_size", chunked_upload.DEFAULT_CHUNK_SIZE)
+    )
+    return jsonify(info), 201
+
+
+@app.route("/upload/chunked/<upload_id>", methods=["GET", "PUT"])
+def chunked_chunk(upload_id):
+    if not session.get("admin"):
+        return jsonify({"error": "Admin login required"}), 403
+
+    if request.method == "GET":
+        return jsonify(uploads.status(upload_id))
+
+    # Body is streamed straight to disk, never parsed as a form
+    result = uploads.put_chunk(
+        upload_id,
+        request.args.get("offset", -1, type=int),
+        request.stream,
+        request.content_length or 0,
+        sha256=request.headers.get("X-Chunk-SHA256")
+    )
+    return jsonify(result)
+
+
+@app.route("/upload/chunked/<upload_id>/finalize", methods=["POST"])
+def chunked_finalize(upload_id):
+    if not session.get("admin"):
+        return jsonify({"error": "Admin login required"}), 403
+
+    result = uploads.finalize(upload_id)
+    catalog.add_file(result["filename"])
+    media_files.record_hash(result["filename"], result["sha256"])
+    video_jobs.submit(result["filename"])
+    return jsonify(result)
+
+
+@app.route("/transcode_status/<filename>")
+def transcode_status(filename):
+    if not session.get("admin"):
+        return jsonify({"error": "Admin login required"}), 403
+    return jsonify(video_jobs.job(filename) or {"status": "none"})
+
+
 # -------------------------------------------------
 # DASHBOARD
 # -------------------------------------------------
@@ -395,130 +679,91 @@ def dashboard():
     if not session.get("approved"):
         return redirect(url_for("home"))
 
-    # Only get course materials from uploads folder
-    files = os.listdir(UPLOAD_FOLDER)
-    modules = {}
-
-    # Allowed course file extensions
-    COURSE_EXTENSIONS = {
-        "pdf": "PDF",
-        "mp4": "Video",
-        "mkv": "Video",
-        "webm": "Video",
-        "avi": "Video",
-        "mov": "Video",
-        "mp3": "Audio",
-        "wav": "Audio"
-    }
+    # Module grouping, sort order and kinds are precomputed in the catalog;
+    # the module list is rendered once per catalog version, the page once per name.
+    # Links are signed; all of them expire together, so that is part of the key too.
+    snapshot = catalog.snapshot()
+    name = session.get("user_name")
+    exp = media_urls.expiry()
+    page = pages.page(
+        ("dashboard", static_assets.version, snapshot.version, exp, name),
+        lambda: render_template("dashboard.html", name=name, modules_html=modules_fragment(snapshot, exp))
+    )
+    return page_cache.respond(page, request, cache_control="private, no-cache")
 
-    for f in files:
-        # Skip payment screenshots and non-course files
-        ext = f.lower().split('.')[-1]
-        
-        # Only include course materials (PDFs, videos, audio)
-        if ext not in COURSE_EXTENSIONS:
-            continue
-        
-        # Skip PNG/JPG files (these are payment screenshots, not course materials)
-        if ext in ["png", "jpg", "jpeg", "gif", "webp"]:
-            continue
-        
-        kind = COURSE_EXTENSIONS.get(ext, "File")
-
-        # Extract module number from filename (e.g., M1_filename.pdf)
-        mod = "M1"  # Default module
-        if "_" in f:
-            tag = f.split("_")[0]
-            if tag.lower().startswith("m") and tag[1:].isdigit():
-                mod = tag.upper()
-
-        modules.setdefault(mod, []).append({
-            "name": f,
-            "url": f"/static/uploads/{f}",
-            "kind": kind
-        })
 
-    return render_template("dashboard.html", name=session.get("user_name"), modules=modules)
+def modules_fragment(snapshot, exp):
+    return pages.fragment(
+        ("modules", snapshot.version, exp),
+        lambda: render_template("_modules.html", modules=snapshot.modules,
+                                sign=lambda path: media_urls.sign(path, exp))
+    )
 
 
 # -------------------------------------------------
 # TELEGRAM CALLBACK (APPROVE/REJECT) - OPTIMIZED
 # -------------------------------------------------
+DECISION_CAPTIONS = {
+    "approved": "✅ *Payment Approved*\n\n👤 *Name:* {user}\n💳 *Txn ID:* `{txn_id}`\n🔓 *Status:* Dashboard Unlocked",
+    "rejected": "❌ *Payment Rejected*\n\n👤 *Name:* {user}\n💳 *Txn ID:* `{txn_id}`\n🚫 *Status:* Access Denied"
+}
+DECISION_MESSAGES = {
+    "approved": "✅ *Approved*\n\n👤 {user}\n💳 `{txn_id}`\n🔓 Dashboard Unlocked",
+    "rejected": "❌ *Rejected*\n\n👤 {user}\n💳 `{txn_id}`\n🚫 Access Denied"
+}
+
+
+def handle_telegram_update(data):
+    """Apply one Telegram update. Used by the webhook and by bot_listener's in-process mode."""
+    if not data or "callback_query" not in data:
+        return
+
+    cb = data["callback_query"]
+    action = cb["data"]
+    callback_id = cb["id"]
+    message_id = cb["message"]["message_id"]
+    chat_id = cb["message"]["chat"]["id"]
+
+    verb, _, txn_id = action.partition("_")
+    status = {"approve": "approved", "reject": "rejected"}.get(verb)
+    if status is None:
+        return
+
+    # The callback id makes webhook retries and listener replays no-ops
+    result = payments.transition(txn_id, status, actor="telegram", event_id=callback_id)
+    if result.outcome == payment_states.DUPLICATE:
+        return
+
+    # Side effects are queued in the outbox and sent by its worker threads
+    if result.outcome == payment_states.STALE:
+        # Second tap, or the admin panel got there first
+        telegram.send("answerCallbackQuery", {
+            "callback_query_id": callback_id,
+            "text": "This payment has already been processed",
+            "show_alert": False
+        })
+        return
+
+    entry = result.record
+    # Answer callback first to stop the button's loading spinner
+    telegram.send("answerCallbackQuery", {"callback_query_id": callback_id})
+    telegram.send("editMessageCaption", {
+        "chat_id": chat_id,
+        "message_id": message_id,
+        "caption": DECISION_CAPTIONS[status].format(user=entry["user"], txn_id=txn_id),
+        "parse_mode": "Markdown"
+    })
+    send_telegram(DECISION_MESSAGES[status].format(user=entry["user"], txn_id=txn_id))
+
+
 @app.route("/telegram-update", methods=["POST"])
 def telegram_update():
     try:
-        data = request.get_json()
-        if not data or "callback_query" not in data:
-            return "OK", 200
-
-        cb = data["callback_query"]
-        action = cb["data"]
-        callback_id = cb["id"]
-        message_id = cb["message"]["message_id"]
-        chat_id = cb["message"]["chat"]["id"]
-
-        # Answer callback immediately to show button was clicked
-        answer_url = f"https://api.telegram.org/bot{BOT_TOKEN}/answerCallbackQuery"
-        requests.post(answer_url, json={"callback_query_id": callback_id})
-
-        payments = load_data()
-        processed = False
-
-        if action.startswith("approve_"):
-            txn_id = action.replace("approve_", "")
-            for i, entry in enumerate(payments):
-                if entry["txn_id"] == txn_id and entry["status"] == "pending":
-                    payments[i]["status"] = "approved"
-                    save_data(payments)
-                    
-                    # Update message with approved status
-                    edit_url = f"https://api.telegram.org/bot{BOT_TOKEN}/editMessageCaption"
-                    new_caption = f"✅ *Payment Approved*\n\n👤 *Name:* {entry['user']}\n💳 *Txn ID:* `{txn_id}`\n🔓 *Status:* Dashboard Unlocked"
-                    requests.post(edit_url, json={
-                        "chat_id": chat_id,
-                        "message_id": message_id,
-                        "caption": new_caption,
-                        "parse_mode": "Markdown"
-                    })
-                    
-                    # Send confirmation
-                    send_telegram(f"✅ *Approved*\n\n👤 {entry['user']}\n💳 `{txn_id}`\n🔓 Dashboard Unlocked")
-                    processed = True
-                    break
-
-        elif action.startswith("reject_"):
-            txn_id = action.replace("reject_", "")
-            for i, entry in enumerate(payments):
-                if entry["txn_id"] == txn_id and entry["status"] == "pending":
-                    payments[i]["status"] = "rejected"
-                    save_data(payments)
-                    
-                    # Update message with rejected status
-                    edit_url = f"https://api.telegram.org/bot{BOT_TOKEN}/editMessageCaption"
-                    new_caption = f"❌ *Payment Rejected*\n\n👤 *Name:* {entry['user']}\n💳 *Txn ID:* `{txn_id}`\n🚫 *Status:* Access Denied"
-                    requests.post(edit_url, json={
-                        "chat_id": chat_id,
-                        "message_id": message_id,
-                        "caption": new_caption,
-                        "parse_mode": "Markdown"
-                    })
-                    
-                    # Send confirmation
-                    send_telegram(f"❌ *Rejected*\n\n👤 {entry['user']}\n💳 `{txn_id}`\n🚫 Access Denied")
-                    processed = True
-                    break
-
-        if not processed:
-            # If already processed, show alert
-            requests.post(answer_url, json={
-                "callback_query_id": callback_id,
-                "text": "This payment has already been processed",
-                "show_alert": False
-            })
-
+        handle_telegram_update(request.get_json())
     except Exception as e:
         print(f"Telegram update error: {e}")
-        return "OK", 200
+        # Not applied: make the sender retry (callback ids make a retry a no-op if it was)
+        return "Update not applied", 500
 
     return "OK", 200
 
@@ -526,21 +771,154 @@ def telegram_update():
 # -------------------------------------------------
 # VIEW PDF AND VIDEO
 # -------------------------------------------------
+# Viewer pages opened from a signed link may be cached for a few minutes;
+# longer would pin a stale HLS state
+VIEW_PAGE_MAX_AGE = 300
+
+
 @app.route("/view_pdf/<filename>")
 def view_pdf(filename):
-    return render_template("view_pdf.html", filename=filename)
+    remaining = signed_access()
+    if not remaining and not has_media_access():
+        return "Forbidden", 403
+    media_url = media_urls.sign(f"/media/{filename}", request.args["exp"] if remaining else None)
+    return view_page(render_template("view_pdf.html", filename=filename, media_url=media_url), remaining)
 
 @app.route("/view_video/<filename>")
 def view_video(filename):
-    return render_template("view_video.html", filename=filename)
+    remaining = signed_access()
+    if not remaining and not has_media_access():
+        return "Forbidden", 403
+    media_url = media_urls.sign(f"/media/{filename}", request.args["exp"] if remaining else None)
+    # Adaptive HLS once the transcode has finished, the original until then
+    hls_url = None
+    playlist = video_jobs.hls_playlist(filename)
+    if playlist:
+        # exp and sig are path segments, so the playlists' relative links carry them too
+        exp, sig = media_urls.sign_prefix(f"/hls/{filename}/", request.args["exp"] if remaining else None)
+        hls_url = f"/hls/{exp}/{sig}/{quote(playlist)}"
+    html = render_template("view_video.html", filename=filename, media_url=media_url, hls_url=hls_url)
+    return view_page(html, remaining)
+
+
+def view_page(html, remaining):
+    resp = Response(html, mimetype="text/html")
+    if remaining:
+        resp.headers["Cache-Control"] = f"public, max-age={min(remaining, VIEW_PAGE_MAX_AGE)}"
+    return resp
+
+# -------------------------------------------------
+# COURSE MEDIA (RANGE + CONDITIONAL GET)
+# -------------------------------------------------
+def has_media_access():
+    return bool(session.get("approved") or session.get("admin"))
+
+
+def signed_access():
+    """Seconds left on this request's URL signature; 0 if it has no valid one.
+
+    Checked before the session: a signed request never reads the cookie, so
+    its response carries no Vary: Cookie and a shared cache can keep it.
+    """
+    return media_urls.verify(request.path, request.args.get("exp"), request.args.get("sig"))
+
+
+@app.before_request
+def protect_uploads():
+    # Course files are only reachable through /media for logged-in users
+    protected = request.path.startswith(("/static/uploads/", "/static/hls/"))
+    if protected and not has_media_access():
+        return "Forbidden", 403
+
+
+@app.route("/media/<filename>")
+def serve_media(filename):
+    remaining = signed_access()
+    if remaining:
+        # The URL is the credential, so any cache may keep the bytes until it expires
+        return media_files.response(filename, request, cache_control=f"public, max-age={remaining}")
+    if not has_media_access():
+        return "Forbidden", 403
+    return media_files.response(filename, request)
+
+
+@app.route("/hls/<exp>/<sig>/<video>/<path:rest>")
+def serve_hls(exp, sig, video, rest):
+    # One signature covers the video's playlists and segments
+    remaining = media_urls.verify(f"/hls/{video}/", exp, sig)
+    if not remaining:
+        return "Forbidden", 403
+    name = safe_join(video, rest)
+    if name is None:
+        return "Not found", 404
+    return hls_files.response(name, request, cache_control=f"public, max-age={remaining}")
+
 
 # -------------------------------------------------
 # SERVE PAYMENT SCREENSHOTS
 # -------------------------------------------------
-@app.route("/payment_ss/<filename>")
+@app.route("/payment_ss/<path:filename>")
 def serve_payment_ss(filename):
-    """Serve payment screenshots from payment_ss folder"""
-    return send_from_directory(PAYMENT_SS_FOLDER, filename)
+    """Serve payment screenshots from payment_ss folder (signed link or admin only)"""
+    remaining = signed_access()
+    if remaining:
+        return send_from_directory(PAYMENT_SS_FOLDER, filename, max_age=remaining)
+    if not session.get("admin"):
+        return "Forbidden", 403
+    resp = send_from_directory(PAYMENT_SS_FOLDER, filename)
+    resp.cache_control.private = True
+    return resp
+
+
+# -------------------------------------------------
+# PROMETHEUS METRICS
+# -------------------------------------------------
+@app.route("/metrics")
+def prometheus_metrics():
+    # METRICS_TOKEN=... requires "Authorization: Bearer ..." from the scraper
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return "Forbidden", 403
+
+    queued, dead = telegram.backlog()
+    body = metrics.registry.render(gauges={
+        "telegram_outbox_queued": ("Telegram calls waiting to be sent.", queued),
+        "telegram_outbox_dead": ("Telegram calls that gave up after retries.", dead),
+        "likes": ("Current like count.", likes.value())
+    })
+    return Response(body, mimetype="text/plain; version=0.0.4")
+
+
+# -------------------------------------------------
+# WARM-UP (called from gunicorn.conf.py)
+# -------------------------------------------------
+startup.report.mark("routes")
+
+
+def warm_up():
+    """What the first requests would otherwise pay for, done ahead of time.
+
+    Under `gunicorn --preload` this runs once in the master and the workers
+    inherit the result through fork: compiled templates, the catalog
+    snapshot, rendered pages and a warm OS cache for the payment indexes.
+    Nothing here may open a socket or start a thread.
+    """
+    with startup.report.phase("compile templates"):
+        for name in app.jinja_env.list_templates():
+            app.jinja_env.get_template(name)
+    with startup.report.phase("catalog index"):
+        snapshot = catalog.snapshot()
+    with startup.report.phase("payment index"):
+        store.warm()
+    with startup.report.phase("render pages"):
+        with app.test_request_context("/"):
+            home()
+            modules_fragment(snapshot, media_urls.expiry())
+
+
+def warm_worker():
+    """Per-process connections, opened after the fork so no worker shares one."""
+    with startup.report.phase("telegram connection"):
+        telegram.connect()
 
 
 # -------------------------------------------------
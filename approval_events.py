@@ -0,0 +1,95 @@
+"""
+Wakes requests that are waiting for a payment's status to change.
+
+Waiters are kept per txn_id. A write in this worker wakes the waiters of
+that txn_id straight from the store listener, with the new status. Writes
+in other workers are picked up by one watcher thread per worker: when the
+shared status generation moves, it reads the status of every txn_id being
+waited on in one query and wakes only those whose status changed. So a
+write costs at most one batched read per worker, however many requests
+are waiting, and waiting costs nothing beyond a sleeping greenlet/thread.
+"""
+import threading
+import time
+
+import forksafe
+
+
+class _Waiter:
+    __slots__ = ("known", "status", "event")
+
+    def __init__(self, known):
+        self.known = known
+        self.status = known
+        self.event = threading.Event()
+
+
+class ApprovalWaiters:
+    def __init__(self, statuses, poll_interval=0.25):
+        self.statuses = statuses
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._waiting = {}   # txn_id -> set of _Waiter
+        self._watcher = forksafe.PerProcess(self._start_watcher)
+        statuses.store.listeners.append(self._changed)
+
+    def _changed(self, record):
+        self._notify({record["txn_id"]: record["status"]})
+
+    def _notify(self, current):
+        """Wake the waiters whose txn_id now has a status other than the one they know."""
+        with self._lock:
+            for txn_id, status in current.items():
+                for waiter in self._waiting.get(txn_id, ()):
+                    if status != waiter.known:
+                        waiter.status = status
+                        waiter.event.set()
+
+    def _start_watcher(self):
+        thread = threading.Thread(target=self._watch, name="approval-watcher", daemon=True)
+        thread.start()
+        return thread
+
+    def _watch(self):
+        seen = self.statuses.generation.value()
+        while True:
+            time.sleep(self.poll_interval)
+            gen = self.statuses.generation.value()
+            if gen == seen:
+                continue
+            seen = gen
+            with self._lock:
+                txn_ids = list(self._waiting)
+            if not txn_ids:
+                continue
+            try:
+                self._notify(self.statuses.get_statuses(txn_ids))
+            except Exception as e:
+                print(f"Approval watcher error: {e}")
+
+    def wait(self, txn_id, known, timeout):
+        """Block until txn_id's status differs from `known` or timeout runs out.
+
+        Returns the current status (None if there is no such payment).
+        """
+        status = self.statuses.get_status(txn_id)
+        if status != known or timeout <= 0:
+            return status
+
+        self._watcher.get()
+        waiter = _Waiter(known)
+        with self._lock:
+            self._waiting.setdefault(txn_id, set()).add(waiter)
+        try:
+            # A change between the first read and registering would wake nobody
+            status = self.statuses.get_status(txn_id)
+            if status != known:
+                return status
+            waiter.event.wait(timeout)
+            return waiter.status
+        finally:
+            with self._lock:
+                waiters = self._waiting.get(txn_id)
+                waiters.discard(waiter)
+                if not waiters:
+                    del self._waiting[txn_id]
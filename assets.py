@@ -0,0 +1,95 @@
+"""
+Hashed static assets for the templates.
+
+Reads static/dist/manifest.json written by build_assets.py and exposes an
+`assets` object to every template:
+
+    {% include "_assets_head.html" %}                    CSS bundle + font preloads
+    {{ assets.picture("logo.png", alt="logo", sizes="40px", class="...") }}
+    {{ assets.image_set("bg_trading.png") }}             for CSS backgrounds
+
+Built files are served from /assets/ with a one-year immutable
+Cache-Control: their names change whenever their content does.
+ASSETS_BASE_URL can point those URLs at a CDN in front of /assets/.
+
+When no build exists (local dev without node), `assets.built` is False and
+_assets_head.html falls back to the Tailwind CDN and Google Fonts.
+"""
+import json
+import os
+
+from flask import send_from_directory, url_for
+from markupsafe import Markup, escape
+
+IMMUTABLE_MAX_AGE = 365 * 86400
+
+
+class Assets:
+    def __init__(self, app, folder="static/dist", url_prefix="/assets", base_url=None):
+        self.folder = os.path.join(app.root_path, folder)
+        self.base_url = (base_url or url_prefix).rstrip("/")
+        self.manifest = self._load()
+        if not self.built:
+            print(f"No asset build in {self.folder}; serving Tailwind from the CDN. "
+                  "Run `python build_assets.py` in the deploy's build command.")
+
+        app.add_url_rule(f"{url_prefix}/<path:filename>", "assets", self.serve)
+        app.context_processor(lambda: {"assets": self})
+
+    def _load(self):
+        try:
+            with open(os.path.join(self.folder, "manifest.json"), "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    @property
+    def built(self):
+        return bool(self.manifest.get("css"))
+
+    @property
+    def version(self):
+        """Changes with every build; part of page cache keys."""
+        return self.manifest.get("css", "cdn")
+
+    def url(self, path):
+        return f"{self.base_url}/{path}"
+
+    def serve(self, filename):
+        response = send_from_directory(self.folder, filename, max_age=IMMUTABLE_MAX_AGE)
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+    # -------------------------------------------------
+    # IMAGES
+    # -------------------------------------------------
+    def srcset(self, name, fmt):
+        variants = self.manifest.get("images", {}).get(name, {}).get(fmt, [])
+        return ", ".join(f"{self.url(path)} {width}w" for width, path in variants)
+
+    def picture(self, name, alt="", sizes="100vw", **attrs):
+        """<picture> with AVIF/WebP sources and the original file as fallback."""
+        img_attrs = "".join(f' {k}="{escape(v)}"' for k, v in attrs.items())
+        image = self.manifest.get("images", {}).get(name)
+        fallback = url_for("static", filename=name)
+        if not image:
+            return Markup(f'<img src="{fallback}" alt="{escape(alt)}"{img_attrs}>')
+
+        sources = ""
+        for fmt in ("avif", "webp"):
+            if image.get(fmt):
+                sources += f'<source type="image/{fmt}" srcset="{self.srcset(name, fmt)}" sizes="{escape(sizes)}">'
+        return Markup(
+            f'<picture>{sources}<img src="{fallback}" alt="{escape(alt)}" width="{image["width"]}" '
+            f'height="{image["height"]}" decoding="async"{img_attrs}></picture>'
+        )
+
+    def image_set(self, name):
+        """CSS image-set() of the largest variant per format, or None without a build."""
+        image = self.manifest.get("images", {}).get(name)
+        if not image:
+            return None
+        parts = [f'url("{self.url(image[fmt][-1][1])}") type("image/{fmt}")'
+                 for fmt in ("avif", "webp") if image.get(fmt)]
+        return Markup(f"image-set({', '.join(parts)})")
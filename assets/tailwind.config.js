@@ -0,0 +1,23 @@
+// Same theme the pages used to set inline for the Tailwind CDN script
+module.exports = {
+  content: ["./templates/**/*.html"],
+  theme: {
+    extend: {
+      colors: {
+        gold: {
+          light: '#f6d67c',
+          DEFAULT: '#d9a520',
+          dark: '#c4941a'
+        },
+        dark: {
+          bg1: '#0f2027',
+          bg2: '#203a43',
+          bg3: '#2c5364'
+        }
+      },
+      fontFamily: {
+        sans: ['Poppins', 'sans-serif']
+      }
+    }
+  }
+}
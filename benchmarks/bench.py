@@ -0,0 +1,404 @@
+"""
+Load benchmark for the payment and dashboard hot paths.
+
+For every scenario (payment store x history size x upload folder size x
+worker count) this builds a scratch working directory with a synthetic
+payments.json and static/uploads, starts gunicorn on it the way the Procfile
+does, with Telegram pointed at a local fake, and then drives each endpoint
+with concurrent clients for a fixed time:
+
+    check_approval   POST /check_approval for random existing txn_ids
+    dashboard        GET /dashboard with an approved session
+    like             POST /like
+    submit_payment   POST /submit_payment with a fresh screenshot each time
+
+After a graceful shutdown it counts lost writes: accepted submissions that
+are missing from the store, and accepted likes missing from the counter.
+
+Results are printed and saved as JSON under benchmarks/results/; pass
+--compare with an older file to see the change per scenario and endpoint.
+
+    python -m benchmarks.bench
+    python -m benchmarks.bench --payments 100000 --uploads 2000 --workers 1,2,4
+    python -m benchmarks.bench --compare benchmarks/results/20260101-120000.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import signal
+import socket
+import sqlite3
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+import requests
+
+from benchmarks.fake_telegram import FakeTelegram
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import payment_store  # noqa: E402
+
+ENDPOINTS = ["check_approval", "dashboard", "like", "submit_payment"]
+COURSE_EXTS = ["pdf", "mp4", "pdf", "mp3", "mkv"]
+APPROVED_TXN = "bench-approved"
+
+
+# -------------------------------------------------
+# SYNTHETIC DATA
+# -------------------------------------------------
+def tiny_png(seed):
+    """An 8x8 PNG whose pixels depend on `seed`, so every upload is a new image."""
+    rnd = random.Random(seed)
+    raw = b"".join(b"\x00" + bytes(rnd.getrandbits(8) for _ in range(8 * 3)) for _ in range(8))
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", 8, 8, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b""))
+
+
+def build_workdir(path, n_payments, n_uploads, seed=1):
+    rnd = random.Random(seed)
+    statuses = ["approved"] * 6 + ["rejected"] * 2 + ["pending"] * 2
+    start = time.time() - 365 * 86400
+    records = [{"user": "bench", "txn_id": APPROVED_TXN, "status": "approved"}]
+    for i in range(n_payments - 1):
+        records.append({
+            "user": f"student {rnd.randrange(n_payments)}",
+            "txn_id": f"{rnd.randrange(10 ** 11, 10 ** 12)}{i}",
+            "status": rnd.choice(statuses),
+            "ss_path": f"payment_ss/{i}.png",
+            "created_at": start + i * (365 * 86400 / max(n_payments, 1))
+        })
+    with open(os.path.join(path, "payments.json"), "w") as f:
+        json.dump(records, f, indent=4)
+    with open(os.path.join(path, "likes.json"), "w") as f:
+        json.dump({"likes": 0}, f)
+
+    uploads = os.path.join(path, "static", "uploads")
+    os.makedirs(uploads)
+    for i in range(n_uploads):
+        name = f"M{i % 12 + 1}_lesson_{i}.{COURSE_EXTS[i % len(COURSE_EXTS)]}"
+        with open(os.path.join(uploads, name), "wb") as f:
+            f.write(b"\0" * 1024)
+    return [r["txn_id"] for r in records]
+
+
+# -------------------------------------------------
+# SERVER
+# -------------------------------------------------
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Server:
+    def __init__(self, workdir, store, workers, worker_class, telegram_url):
+        self.workdir = workdir
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        env = dict(os.environ)
+        env.update({
+            "PYTHONPATH": REPO + os.pathsep + env.get("PYTHONPATH", ""),
+            "PAYMENT_STORE": store,
+            "DB_FILE": os.path.join(workdir, "bench.db"),
+            "STATUS_GEN_FILE": os.path.join(workdir, "status.gen"),
+            # Measure capacity, not the rate limits
+            "ADMISSION": "off",
+            "ADMISSION_FILE": os.path.join(workdir, "admission.buckets"),
+            "TELEGRAM_API_URL": telegram_url,
+            "BOT_TOKEN": "bench",
+            "SECRET_KEY": "bench"
+        })
+        cmd = [sys.executable, "-m", "gunicorn", "-k", worker_class, "-w", str(workers),
+               "-b", f"127.0.0.1:{self.port}", "--log-level", "warning", "app:app"]
+        if worker_class == "gevent":
+            cmd[5:5] = ["--worker-connections", "2000"]
+        self.log = open(os.path.join(workdir, "gunicorn.log"), "w")
+        started = time.monotonic()
+        self.proc = subprocess.Popen(cmd, cwd=workdir, env=env, stdout=self.log, stderr=subprocess.STDOUT)
+        self._wait_ready()
+        self.startup_seconds = time.monotonic() - started
+
+    def _wait_ready(self, timeout=120):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"gunicorn exited, see {self.log.name}")
+            try:
+                if requests.get(self.url + "/get_likes", timeout=2).ok:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError("gunicorn did not become ready")
+
+    def stop(self):
+        # SIGTERM = graceful: workers finish requests and run their atexit flushes
+        self.proc.send_signal(signal.SIGTERM)
+        try:
+            self.proc.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+        self.log.close()
+
+
+# -------------------------------------------------
+# LOAD
+# -------------------------------------------------
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(round(p * (len(sorted_values) - 1))))]
+
+
+class Load:
+    """Per-endpoint request functions. Each returns True if the request succeeded."""
+
+    def __init__(self, base, txn_ids, label):
+        self.base = base
+        self.txn_ids = txn_ids
+        self.label = label
+        self.accepted_txns = []
+        self.accepted_likes = 0
+        self._lock = threading.Lock()
+
+    def setup(self, endpoint, http):
+        if endpoint == "dashboard":
+            http.post(self.base + "/start_session", data={"txn_id": APPROVED_TXN, "user_name": "bench"})
+
+    def check_approval(self, http, worker, n):
+        r = http.post(self.base + "/check_approval", data={"txn_id": random.choice(self.txn_ids)})
+        return r.ok and r.json()["status"] != "not_found"
+
+    def dashboard(self, http, worker, n):
+        r = http.get(self.base + "/dashboard", allow_redirects=False)
+        return r.status_code == 200
+
+    def like(self, http, worker, n):
+        r = http.post(self.base + "/like")
+        if r.ok:
+            with self._lock:
+                self.accepted_likes += 1
+        return r.ok
+
+    def submit_payment(self, http, worker, n):
+        txn_id = f"bench-{self.label}-{worker}-{n}"
+        r = http.post(
+            self.base + "/submit_payment",
+            data={"user_name": "bench", "txn_id": txn_id},
+            files={"screenshot": ("ss.png", tiny_png(txn_id), "image/png")},
+        )
+        ok = r.ok and "Submitted" in r.json().get("message", "")
+        if ok:
+            with self._lock:
+                self.accepted_txns.append(txn_id)
+        return ok
+
+    def run(self, endpoint, concurrency, duration, warmup):
+        request = getattr(self, endpoint)
+        latencies = [[] for _ in range(concurrency)]
+        errors = [0] * concurrency
+        start_at = time.monotonic() + warmup
+        stop_at = start_at + duration
+
+        def worker(i):
+            http = requests.Session()
+            self.setup(endpoint, http)
+            n = 0
+            while True:
+                t0 = time.monotonic()
+                if t0 >= stop_at:
+                    break
+                try:
+                    ok = request(http, i, n)
+                except (requests.RequestException, ValueError):
+                    ok = False
+                elapsed = time.monotonic() - t0
+                n += 1
+                if t0 < start_at:
+                    continue
+                if ok:
+                    latencies[i].append(elapsed)
+                else:
+                    errors[i] += 1
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        values = sorted(v for per_thread in latencies for v in per_thread)
+        ms = lambda v: round(v * 1000, 2) if v is not None else None  # noqa: E731
+        return {
+            "requests": len(values),
+            "errors": sum(errors),
+            "throughput_rps": round(len(values) / duration, 1),
+            "p50_ms": ms(percentile(values, 0.50)),
+            "p99_ms": ms(percentile(values, 0.99)),
+            "max_ms": ms(values[-1] if values else None)
+        }
+
+
+def count_lost_writes(workdir, store_kind, load, likes_seed=0):
+    store = payment_store.open_store(
+        store_kind, db_file=os.path.join(workdir, "bench.db"), json_file=os.path.join(workdir, "payments.json")
+    )
+    lost_payments = sum(1 for txn_id in load.accepted_txns if store.get(txn_id) is None)
+
+    conn = sqlite3.connect(os.path.join(workdir, "bench.db"))
+    row = conn.execute("SELECT value FROM counters WHERE name = 'likes'").fetchone()
+    conn.close()
+    stored_likes = (row[0] if row else 0) - likes_seed
+    return {
+        "accepted_payments": len(load.accepted_txns),
+        "lost_payments": lost_payments,
+        "accepted_likes": load.accepted_likes,
+        "lost_likes": max(0, load.accepted_likes - stored_likes)
+    }
+
+
+# -------------------------------------------------
+# DRIVER
+# -------------------------------------------------
+def run_scenario(args, store_kind, n_payments, n_uploads, workers, telegram):
+    label = f"{store_kind}-p{n_payments}-u{n_uploads}-w{workers}"
+    workdir = tempfile.mkdtemp(prefix=f"stockboy-bench-{label}-")
+    print(f"\n== {label}")
+    try:
+        txn_ids = build_workdir(workdir, n_payments, n_uploads)
+        calls_before = telegram.total()
+        server = Server(workdir, store_kind, workers, args.worker_class, telegram.url)
+        print(f"   started in {server.startup_seconds:.2f}s")
+
+        load = Load(server.url, txn_ids, label)
+        endpoints = {}
+        try:
+            for endpoint in args.endpoints:
+                endpoints[endpoint] = load.run(endpoint, args.concurrency, args.duration, args.warmup)
+                print(f"   {endpoint:<15} " + format_row(endpoints[endpoint]))
+            # Let the outbox drain before shutting down
+            time.sleep(args.drain)
+        finally:
+            server.stop()
+
+        writes = count_lost_writes(workdir, store_kind, load)
+        writes["telegram_calls"] = telegram.total() - calls_before
+        print("   writes          " + ", ".join(f"{k}={v}" for k, v in writes.items()))
+        return label, {
+            "store": store_kind,
+            "payments": n_payments,
+            "uploads": n_uploads,
+            "workers": workers,
+            "startup_seconds": round(server.startup_seconds, 3),
+            "endpoints": endpoints,
+            "writes": writes
+        }
+    finally:
+        if args.keep:
+            print(f"   kept {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def format_row(result):
+    return (f"{result['throughput_rps']:>8} req/s  p50 {result['p50_ms']} ms  "
+            f"p99 {result['p99_ms']} ms  errors {result['errors']}")
+
+
+def compare(old_file, new_results):
+    with open(old_file, "r") as f:
+        old = json.load(f)["scenarios"]
+
+    print(f"\n== compared with {old_file}")
+    for label, scenario in new_results.items():
+        if label not in old:
+            continue
+        for endpoint, new in scenario["endpoints"].items():
+            prev = old[label]["endpoints"].get(endpoint)
+            if not prev:
+                continue
+            parts = []
+            for key in ("throughput_rps", "p50_ms", "p99_ms"):
+                if prev[key] and new[key] is not None:
+                    parts.append(f"{key} {prev[key]} -> {new[key]} ({(new[key] / prev[key] - 1) * 100:+.0f}%)")
+            print(f"   {label} {endpoint}: " + ", ".join(parts))
+
+
+def int_list(value):
+    return [int(v) for v in value.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--payments", type=int_list, default=[1000, 10000, 100000],
+                        help="payment history sizes (default 1000,10000,100000)")
+    parser.add_argument("--uploads", type=int_list, default=[10, 1000],
+                        help="course files in static/uploads (default 10,1000)")
+    parser.add_argument("--workers", type=int_list, default=[2], help="gunicorn worker counts (default 2)")
+    parser.add_argument("--store", default="sqlite", help="payment stores to test: sqlite,json,log")
+    parser.add_argument("--worker-class", default="gevent", help="gunicorn worker class (default gevent, as in the Procfile)")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), type=lambda v: v.split(","))
+    parser.add_argument("--concurrency", type=int, default=32, help="concurrent clients per endpoint")
+    parser.add_argument("--duration", type=float, default=5.0, help="measured seconds per endpoint")
+    parser.add_argument("--warmup", type=float, default=1.0, help="unmeasured seconds before each endpoint")
+    parser.add_argument("--drain", type=float, default=2.0, help="seconds to let background work finish")
+    parser.add_argument("--telegram-latency-ms", type=float, default=50.0)
+    parser.add_argument("--out", default=os.path.join(REPO, "benchmarks", "results"))
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directories")
+    args = parser.parse_args()
+
+    unknown = set(args.endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+
+    telegram = FakeTelegram(latency_ms=args.telegram_latency_ms).start()
+    results = {}
+    try:
+        for store_kind in args.store.split(","):
+            for workers in args.workers:
+                for n_payments in args.payments:
+                    for n_uploads in args.uploads:
+                        label, result = run_scenario(args, store_kind, n_payments, n_uploads, workers, telegram)
+                        results[label] = result
+    finally:
+        telegram.stop()
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO,
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    os.makedirs(args.out, exist_ok=True)
+    out_file = os.path.join(args.out, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    with open(out_file, "w") as f:
+        json.dump({
+            "created_at": time.time(),
+            "commit": commit,
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "settings": {k: v for k, v in vars(args).items() if k not in ("out", "compare", "keep")},
+            "scenarios": results
+        }, f, indent=2)
+    print(f"\nSaved {out_file}")
+
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
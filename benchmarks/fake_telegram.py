@@ -0,0 +1,88 @@
+"""
+Stand-in for api.telegram.org during benchmarks.
+
+Accepts any /bot<token>/<method> call, answers {"ok": true} after an
+optional delay, and counts calls per method. Point the app at it with
+TELEGRAM_API_URL=http://127.0.0.1:<port>.
+
+    python -m benchmarks.fake_telegram --port 8790 --latency-ms 80
+"""
+import argparse
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeTelegram:
+    def __init__(self, port=0, latency_ms=0):
+        self.latency = latency_ms / 1000
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._message_id = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.url = f"http://127.0.0.1:{self.port}"
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    self.rfile.read(length)
+                method = self.path.rstrip("/").rsplit("/", 1)[-1].split("?")[0]
+                with fake._lock:
+                    fake.calls[method] += 1
+                    fake._message_id += 1
+                    message_id = fake._message_id
+                if fake.latency:
+                    time.sleep(fake.latency)
+                result = [] if method == "getUpdates" else {"message_id": message_id}
+                body = json.dumps({"ok": True, "result": result}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = _reply
+            do_POST = _reply
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="fake-telegram", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def total(self):
+        with self._lock:
+            return sum(self.calls.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    args = parser.parse_args()
+
+    fake = FakeTelegram(args.port, args.latency_ms)
+    print(f"Fake Telegram API on {fake.url}")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        print(dict(fake.calls))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,44 +1,251 @@
-import requests
-import time
+import asyncio
+import json
 import os
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
 
 # Read bot token from environment variable
 BOT_TOKEN = os.getenv("BOT_TOKEN", "7581428285:AAF6qwxQYniDoZnhiwERUP_k0Vlf-k6MVSQ")
 
-API_URL = f"https://api.telegram.org/bot{BOT_TOKEN}"
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+API_URL = f"{TELEGRAM_API_URL}/bot{BOT_TOKEN}"
 # For production, use your Render URL. For local dev, use localhost
 FLASK_URL = os.getenv("FLASK_URL", "http://127.0.0.1:5000/telegram-update")
 
-def main():
-    last_update_id = None
+# "http" forwards to FLASK_URL; "inprocess" imports app.py and applies updates directly
+FORWARD_MODE = os.getenv("FORWARD_MODE", "http")
+CONCURRENCY = int(os.getenv("FORWARD_CONCURRENCY", "8"))
+OFFSET_FILE = os.getenv("OFFSET_FILE", "bot_offset.json")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 = no metrics endpoint
+POLL_TIMEOUT = 25
+MAX_ATTEMPTS = 10
+MAX_POLL_BACKOFF = 60
 
 
-    while True:
+class PollError(Exception):
+    """getUpdates answered ok=false (webhook set, bad token, flood limit, ...)."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def redact(error):
+    # requests puts the whole URL, bot token included, in its messages
+    return str(error).replace(f"bot{BOT_TOKEN}", "bot<token>")
+
+
+# -------------------------------------------------
+# OFFSET (only advanced past delivered updates)
+# -------------------------------------------------
+def load_offset():
+    try:
+        with open(OFFSET_FILE, "r") as f:
+            return json.load(f).get("offset")
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def save_offset(offset):
+    tmp = OFFSET_FILE + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"offset": offset}, f)
+    os.replace(tmp, OFFSET_FILE)
+
+
+class Metrics:
+    def __init__(self):
+        self.started = time.time()
+        self.received = 0
+        self.forwarded = 0
+        self.failed_attempts = 0
+        self.dropped = 0
+        self.last_latency = 0.0
+        self.latest_update_id = None
+        self.committed_offset = None
+        self.in_flight = 0
+
+    def snapshot(self):
+        uptime = max(time.time() - self.started, 1e-9)
+        lag = 0
+        if self.latest_update_id is not None and self.committed_offset is not None:
+            lag = max(0, self.latest_update_id + 1 - self.committed_offset)
+        return {
+            "uptime_seconds": round(uptime, 1),
+            "received": self.received,
+            "forwarded": self.forwarded,
+            "forwarded_per_second": round(self.forwarded / uptime, 3),
+            "failed_attempts": self.failed_attempts,
+            "dropped": self.dropped,
+            "in_flight": self.in_flight,
+            "lag_updates": lag,
+            "last_delivery_seconds": round(self.last_latency, 3),
+            "committed_offset": self.committed_offset
+        }
+
+
+# -------------------------------------------------
+# FORWARDER
+# -------------------------------------------------
+class Forwarder:
+    def __init__(self):
+        self.metrics = Metrics()
+        self.offset = load_offset()
+        self.metrics.committed_offset = self.offset
+        self.pending = set()   # update_ids fetched but not yet delivered
+        self.done = set()      # delivered, waiting for lower ids to finish
+        self.tasks = set()     # running forward() tasks; asyncio only keeps weak references
+        self.changed = asyncio.Event()
+        self.limit = asyncio.Semaphore(CONCURRENCY)
+
+        # One keep-alive pool shared by polling and forwarding
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=CONCURRENCY + 1)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.handle = None
+        if FORWARD_MODE == "inprocess":
+            import app
+            self.handle = app.handle_telegram_update
+
+    async def poll(self):
+        params = {"timeout": POLL_TIMEOUT, "allowed_updates": json.dumps(["callback_query"])}
+        if self.offset is not None:
+            params["offset"] = self.offset
+        response = await asyncio.to_thread(
+            self.session.get, f"{API_URL}/getUpdates", params=params, timeout=POLL_TIMEOUT + 10
+        )
         try:
-            # get updates safely
-            response = requests.get(
-                f"{API_URL}/getUpdates",
-                params={"offset": last_update_id, "timeout": 10}
-            ).json()
-
-            # no updates found
-            if "result" not in response:
-                time.sleep(1)
+            body = response.json()
+        except ValueError:
+            raise PollError(f"HTTP {response.status_code}: not JSON")
+        if not body.get("ok"):
+            raise PollError(f"HTTP {response.status_code}: {body.get('description')}",
+                            (body.get("parameters") or {}).get("retry_after"))
+        return body.get("result", [])
+
+    def deliver(self, update):
+        if self.handle:
+            self.handle(update)
+            return
+        response = self.session.post(FLASK_URL, json=update, timeout=(5, 30))
+        response.raise_for_status()
+
+    async def forward(self, update):
+        update_id = update["update_id"]
+        started = time.monotonic()
+        try:
+            if "callback_query" in update:
+                async with self.limit:
+                    for attempt in range(MAX_ATTEMPTS):
+                        try:
+                            await asyncio.to_thread(self.deliver, update)
+                            self.metrics.forwarded += 1
+                            break
+                        except Exception as e:
+                            self.metrics.failed_attempts += 1
+                            print(f"Forward of update {update_id} failed ({attempt + 1}/{MAX_ATTEMPTS}): {e}")
+                            await asyncio.sleep(min(60, 2 ** attempt))
+                    else:
+                        # Don't block every later update on one poison update
+                        self.metrics.dropped += 1
+                        print(f"Dropping update {update_id} after {MAX_ATTEMPTS} attempts")
+            self.metrics.last_latency = time.monotonic() - started
+        finally:
+            self.done.add(update_id)
+            self.commit()
+            self.changed.set()
+
+    def commit(self):
+        # Advance the offset over the delivered prefix only
+        while self.pending:
+            lowest = min(self.pending)
+            if lowest not in self.done:
+                break
+            self.pending.discard(lowest)
+            self.done.discard(lowest)
+            self.offset = lowest + 1
+        self.metrics.in_flight = len(self.pending)
+        if self.offset != self.metrics.committed_offset:
+            self.metrics.committed_offset = self.offset
+            save_offset(self.offset)
+
+    async def run(self):
+        print(f"Listening for Telegram callbacks ({FORWARD_MODE} mode, {CONCURRENCY} concurrent)")
+        failures = 0
+        while True:
+            try:
+                updates = await self.poll()
+            except Exception as e:
+                # Back off: an error answer (409 webhook set, 401) comes back instantly
+                failures += 1
+                delay = getattr(e, "retry_after", None) or min(MAX_POLL_BACKOFF, 2 ** failures)
+                print(f"Listener Error: {redact(e)} (retrying in {delay}s)")
+                await asyncio.sleep(delay)
                 continue
+            failures = 0
+
+            # The poll may have started before the offset last moved
+            fresh = [u for u in updates
+                     if u["update_id"] not in self.pending
+                     and (self.offset is None or u["update_id"] >= self.offset)]
+            for update in fresh:
+                # Telegram keeps re-sending unconfirmed updates; each is forwarded once
+                self.pending.add(update["update_id"])
+                self.metrics.received += 1
+                self.metrics.latest_update_id = max(self.metrics.latest_update_id or 0, update["update_id"])
+                task = asyncio.create_task(self.forward(update))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+            self.metrics.in_flight = len(self.pending)
 
-            for update in response["result"]:
+            if updates and not fresh:
+                # Only in-flight updates came back; wait for one to finish instead of spinning
+                self.changed.clear()
+                try:
+                    await asyncio.wait_for(self.changed.wait(), timeout=5)
+                except asyncio.TimeoutError:
+                    pass
 
-                # update pointer (VERY important to stop duplicates)
-                last_update_id = update["update_id"] + 1
 
-                # Only send CALLBACK events
-                if "callback_query" in update:
-                    print("Forwarding callback → Flask...")
-                    requests.post(FLASK_URL, json=update)
+# -------------------------------------------------
+# METRICS (JSON over plain HTTP)
+# -------------------------------------------------
+async def serve_metrics(forwarder):
+    async def handle(reader, writer):
+        await reader.read(1024)
+        body = json.dumps(forwarder.metrics.snapshot()).encode()
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                     b"Content-Length: " + str(len(body)).encode() + b"\r\nConnection: close\r\n\r\n" + body)
+        await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", METRICS_PORT)
+    print(f"Listener metrics on http://127.0.0.1:{METRICS_PORT}/")
+    async with server:
+        await server.serve_forever()
+
+
+async def log_metrics(forwarder):
+    while True:
+        await asyncio.sleep(60)
+        print("Listener metrics:", json.dumps(forwarder.metrics.snapshot()))
+
+
+async def main_async():
+    forwarder = Forwarder()
+    tasks = [forwarder.run(), log_metrics(forwarder)]
+    if METRICS_PORT:
+        tasks.append(serve_metrics(forwarder))
+    await asyncio.gather(*tasks)
+
+
+def main():
+    asyncio.run(main_async())
 
-        except Exception as e:
-            print("Listener Error:", e)
-            time.sleep(2)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,206 @@
+"""
+Build the static assets the templates use instead of the Tailwind CDN.
+
+    python build_assets.py
+
+- CSS: the Tailwind CLI compiles assets/app.css against the classes used in
+  templates/ (assets/tailwind.config.js) into one minified bundle, with the
+  self-hosted Poppins @font-face rules in front.
+- Fonts: the Poppins woff2 files are downloaded from Google Fonts once and
+  kept in assets/fonts/; with that folder present the build works offline.
+- Images: bg_trading.png, logo.png and qr.png are written at a few widths as
+  WebP, plus AVIF when Pillow can encode it.
+
+Everything goes to static/dist/ under content-hashed names listed in
+static/dist/manifest.json, which assets.py reads. Files from older builds
+are removed. Without a build the pages fall back to the CDN as before.
+
+TAILWIND_BIN picks the CLI; by default the standalone `tailwindcss` binary
+if it is on the PATH, else `npx --yes tailwindcss@3`.
+
+Deploying: the build has to run on every deploy, before gunicorn starts.
+The Procfile only starts the app, so on Render set the service's Build
+Command to
+
+    pip install -r requirements.txt && python build_assets.py
+
+static/dist/ is not committed, and a release/pre-deploy step runs on a
+throwaway instance whose files never reach the web service. Without the
+build the app logs "No asset build" at startup and serves the CDN.
+"""
+import hashlib
+import io
+import json
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.request import Request, urlopen
+
+from PIL import Image, features
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DIST = os.path.join(ROOT, "static", "dist")
+FONT_CACHE = os.path.join(ROOT, "assets", "fonts")
+
+FONT_CSS_URL = "https://fonts.googleapis.com/css2?family=Poppins:wght@300;400;500;600;700;800&display=swap"
+# Google only serves woff2 to browsers it recognises
+FONT_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"
+PRELOAD_FONTS = [("400", "latin"), ("600", "latin")]
+
+# source image -> (widths, lossless)
+IMAGES = {
+    "bg_trading.png": ([640, 1024, 1280, 1920], False),
+    "logo.png": ([64, 128, 256], False),
+    "qr.png": ([224, 448], True),
+}
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+def write_hashed(rel_dir, stem, ext, data, outputs):
+    name = f"{stem}.{content_hash(data)}.{ext}"
+    rel = f"{rel_dir}/{name}" if rel_dir else name
+    path = os.path.join(DIST, rel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    outputs.add(rel)
+    return rel
+
+
+# -------------------------------------------------
+# FONTS
+# -------------------------------------------------
+def fetch(url, user_agent=FONT_USER_AGENT):
+    with urlopen(Request(url, headers={"User-Agent": user_agent}), timeout=30) as resp:
+        return resp.read()
+
+
+def build_fonts(outputs):
+    """Returns (@font-face css, preload paths)."""
+    os.makedirs(FONT_CACHE, exist_ok=True)
+    css_cache = os.path.join(FONT_CACHE, "poppins.css")
+    if not os.path.exists(css_cache):
+        with open(css_cache, "wb") as f:
+            f.write(fetch(FONT_CSS_URL))
+    with open(css_cache, "r") as f:
+        source = f.read()
+
+    faces, preload = [], []
+    # Google's css2 output: "/* subset */ @font-face { ... }" per weight and subset
+    for subset, body in re.findall(r"/\*\s*([\w-]+)\s*\*/\s*@font-face\s*\{([^}]*)\}", source):
+        weight = re.search(r"font-weight:\s*(\d+)", body).group(1)
+        url = re.search(r"url\((https://[^)]+)\)", body).group(1)
+        unicode_range = re.search(r"unicode-range:\s*([^;]+);", body).group(1).strip()
+
+        local = os.path.join(FONT_CACHE, f"poppins-{weight}-{subset}.woff2")
+        if not os.path.exists(local):
+            with open(local, "wb") as f:
+                f.write(fetch(url))
+        with open(local, "rb") as f:
+            rel = write_hashed("fonts", f"poppins-{weight}-{subset}", "woff2", f.read(), outputs)
+
+        # Relative to the CSS file, so it works from any prefix or CDN host
+        faces.append(
+            "@font-face{font-family:'Poppins';font-style:normal;font-weight:%s;font-display:swap;"
+            "src:url(%s) format('woff2');unicode-range:%s}" % (weight, rel, unicode_range)
+        )
+        if (weight, subset) in PRELOAD_FONTS:
+            preload.append(rel)
+    return "".join(faces), preload
+
+
+# -------------------------------------------------
+# CSS
+# -------------------------------------------------
+def tailwind_command():
+    if os.getenv("TAILWIND_BIN"):
+        return shlex.split(os.getenv("TAILWIND_BIN"))
+    if shutil.which("tailwindcss"):
+        return ["tailwindcss"]
+    return ["npx", "--yes", "tailwindcss@3"]
+
+
+def build_css(font_css, outputs):
+    with tempfile.TemporaryDirectory() as tmp:
+        out = os.path.join(tmp, "tailwind.css")
+        subprocess.run(
+            tailwind_command() + ["-c", "assets/tailwind.config.js", "-i", "assets/app.css", "-o", out, "--minify"],
+            cwd=ROOT, check=True,
+        )
+        with open(out, "rb") as f:
+            tailwind = f.read()
+    return write_hashed("", "app", "css", font_css.encode() + tailwind, outputs)
+
+
+# -------------------------------------------------
+# IMAGES
+# -------------------------------------------------
+def build_images(outputs):
+    formats = ["webp"] + (["avif"] if "avif" in features.get_supported_modules() else [])
+    manifest = {}
+    for name, (widths, lossless) in IMAGES.items():
+        source = os.path.join(ROOT, "static", name)
+        stem = name.rsplit(".", 1)[0]
+        with Image.open(source) as im:
+            im.load()
+            entry = {"width": im.width, "height": im.height}
+            for fmt in formats:
+                variants = []
+                for width in sorted({min(w, im.width) for w in widths}):
+                    copy = im.copy()
+                    copy.thumbnail((width, round(im.height * width / im.width)), Image.LANCZOS)
+                    options = {"lossless": True} if lossless else {"quality": 80 if fmt == "webp" else 60}
+                    if fmt == "webp":
+                        options["method"] = 6
+                    out = io.BytesIO()
+                    copy.save(out, fmt.upper(), **options)
+                    variants.append([width, write_hashed("img", f"{stem}-{width}", fmt, out.getvalue(), outputs)])
+                entry[fmt] = variants
+        manifest[name] = entry
+    return manifest
+
+
+def clean(outputs):
+    """Drop files left from older builds."""
+    for folder, _dirs, files in os.walk(DIST):
+        for file_name in files:
+            rel = os.path.relpath(os.path.join(folder, file_name), DIST).replace(os.sep, "/")
+            if rel != "manifest.json" and rel not in outputs:
+                os.remove(os.path.join(folder, file_name))
+
+
+def main():
+    started = time.monotonic()
+    outputs = set()
+
+    font_css, preload = build_fonts(outputs)
+    css = build_css(font_css, outputs)
+    images = build_images(outputs)
+
+    manifest = {"css": css, "preload_fonts": preload, "images": images}
+    os.makedirs(DIST, exist_ok=True)
+    with open(os.path.join(DIST, "manifest.json.tmp"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(os.path.join(DIST, "manifest.json.tmp"), os.path.join(DIST, "manifest.json"))
+    clean(outputs)
+
+    print(f"Built {len(outputs)} files into {os.path.relpath(DIST, ROOT)} in {time.monotonic() - started:.1f}s")
+    print(f"  css: {css}")
+    for name, entry in images.items():
+        formats = [k for k in entry if isinstance(entry[k], list)]
+        print(f"  {name}: {', '.join(formats)} x {len(entry['webp'])} widths")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except (OSError, subprocess.CalledProcessError) as e:
+        sys.exit(f"Asset build failed: {e}")
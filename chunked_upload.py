@@ -0,0 +1,273 @@
+"""
+Resumable chunked uploads for large course files.
+
+    init      -> reserve an upload id and a sparse file of the final size
+    put_chunk -> stream one chunk from the request body to its offset
+    status    -> which chunks are still missing (for resuming)
+    finalize  -> check every chunk arrived, verify the SHA-256, move into place
+
+Chunks are written with pwrite at their own offset, so they can arrive in
+any order and in parallel, from any worker. Each finished chunk leaves a
+marker file; memory use per request is one read buffer.
+
+A chunk being written has a file in writing/, touched as the bytes arrive.
+finalize() first renames the upload away (so no new chunk can start), then
+refuses with 409 while any of those files is fresh; a writer that finds its
+file gone stops before its next pwrite. So no byte lands in the data file
+after it has been checksummed.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+from werkzeug.utils import secure_filename
+
+import cooperative
+from media import file_sha256
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+READ_SIZE = 1024 * 1024
+STALE_SECONDS = 24 * 3600
+# A chunk write that hasn't made progress for this long belongs to a dead request
+WRITE_STALL_SECONDS = 120
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _int(value, what):
+    """A JSON/query integer from the client, or UploadError."""
+    if isinstance(value, bool):
+        raise UploadError(f"Invalid {what}")
+    try:
+        return int(value)
+    except (TypeError, ValueError, OverflowError):
+        raise UploadError(f"Invalid {what}") from None
+
+
+class ChunkedUploads:
+    def __init__(self, tmp_folder, dest_folder):
+        self.tmp_folder = tmp_folder
+        self.dest_folder = dest_folder
+        os.makedirs(tmp_folder, exist_ok=True)
+
+    def _path(self, upload_id):
+        # ids are uuid4 hex; anything else can't name a real upload
+        if not upload_id or not all(c in "0123456789abcdef" for c in upload_id):
+            raise UploadError("Unknown upload", 404)
+        return os.path.join(self.tmp_folder, upload_id)
+
+    def _dir(self, upload_id):
+        path = self._path(upload_id)
+        if not os.path.isdir(path):
+            if os.path.isdir(path + ".finalizing"):
+                raise UploadError("Upload is already being finalized", 409)
+            raise UploadError("Unknown upload", 404)
+        return path
+
+    @staticmethod
+    def _read_meta(path):
+        with open(os.path.join(path, "meta.json"), "r") as f:
+            return json.load(f)
+
+    def _meta(self, upload_id):
+        return self._read_meta(self._dir(upload_id))
+
+    @staticmethod
+    def _missing(path, meta):
+        have = set(os.listdir(os.path.join(path, "chunks")))
+        return [i for i in range(meta["chunks"]) if str(i) not in have]
+
+    def init(self, filename, size, sha256=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        filename = secure_filename(filename or "")
+        if not filename:
+            raise UploadError("Invalid filename")
+        size = _int(size, "size")
+        if size <= 0:
+            raise UploadError("Invalid size")
+        chunk_size = max(READ_SIZE, min(_int(chunk_size, "chunk_size"), MAX_CHUNK_SIZE))
+
+        self.cleanup_stale()
+        upload_id = uuid.uuid4().hex
+        path = os.path.join(self.tmp_folder, upload_id)
+        os.makedirs(os.path.join(path, "chunks"))
+        os.makedirs(os.path.join(path, "writing"))
+
+        # Sparse file of the final size; chunks fill it in place
+        with open(os.path.join(path, "data"), "wb") as f:
+            f.truncate(size)
+
+        meta = {
+            "filename": filename,
+            "size": size,
+            "sha256": sha256.lower() if sha256 else None,
+            "chunk_size": chunk_size,
+            "chunks": (size + chunk_size - 1) // chunk_size,
+            "created_at": time.time()
+        }
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        return dict(meta, upload_id=upload_id)
+
+    def put_chunk(self, upload_id, offset, stream, length, sha256=None):
+        meta = self._meta(upload_id)
+        chunk_size = meta["chunk_size"]
+        if offset < 0 or offset % chunk_size or offset >= meta["size"]:
+            raise UploadError("Offset must be a chunk boundary inside the file")
+        expected = min(chunk_size, meta["size"] - offset)
+        if length != expected:
+            raise UploadError(f"Chunk at {offset} must be {expected} bytes")
+
+        path = self._dir(upload_id)
+        writing = self._start_write(path)
+        try:
+            digest = hashlib.sha256()
+            written = 0
+            fd = os.open(os.path.join(path, "data"), os.O_WRONLY)
+            try:
+                while written < expected:
+                    buf = stream.read(min(READ_SIZE, expected - written))
+                    if not buf:
+                        break
+                    self._still_writing(writing)
+                    os.pwrite(fd, buf, offset + written)
+                    digest.update(buf)
+                    written += len(buf)
+            finally:
+                os.close(fd)
+
+            if written != expected:
+                raise UploadError("Chunk body ended early")
+            if sha256 and digest.hexdigest() != sha256.lower():
+                raise UploadError("Chunk checksum mismatch", 422)
+
+            # The marker is what counts as "received"
+            index = offset // chunk_size
+            try:
+                open(os.path.join(path, "chunks", str(index)), "w").close()
+            except FileNotFoundError:
+                raise UploadError("Upload is being finalized", 409) from None
+        finally:
+            try:
+                os.remove(writing)
+            except FileNotFoundError:
+                pass
+        return {"chunk": index, "sha256": digest.hexdigest()}
+
+    @staticmethod
+    def _start_write(path):
+        """Mark a chunk write as in progress; finalize() waits for it."""
+        folder = os.path.join(path, "writing")
+        try:
+            os.mkdir(folder)   # uploads started before writing/ existed
+        except FileExistsError:
+            pass
+        except FileNotFoundError:
+            raise UploadError("Upload is being finalized", 409) from None
+        writing = os.path.join(folder, uuid.uuid4().hex)
+        try:
+            open(writing, "x").close()
+        except FileNotFoundError:
+            raise UploadError("Upload is being finalized", 409) from None
+        return writing
+
+    @staticmethod
+    def _still_writing(writing):
+        # Gone once finalize() has claimed the upload or given up on this write
+        try:
+            os.utime(writing)
+        except FileNotFoundError:
+            raise UploadError("Upload is being finalized", 409) from None
+
+    @staticmethod
+    def _writes_in_progress(path):
+        """Chunk writes still running in path; stalled ones are cleared away."""
+        folder = os.path.join(path, "writing")
+        try:
+            entries = list(os.scandir(folder))
+        except FileNotFoundError:
+            return 0
+        cutoff = time.time() - WRITE_STALL_SECONDS
+        active = 0
+        for entry in entries:
+            try:
+                if entry.stat().st_mtime >= cutoff:
+                    active += 1
+                else:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+        return active
+
+    def status(self, upload_id):
+        path = self._dir(upload_id)
+        meta = self._read_meta(path)
+        return dict(meta, upload_id=upload_id, missing=self._missing(path, meta))
+
+    def finalize(self, upload_id):
+        """Verify and move the file into the course folder. Returns its final name and hash."""
+        path = self._dir(upload_id)
+        # Claim the upload with an atomic rename; a concurrent finalize loses the race here
+        claimed = path + ".finalizing"
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            raise UploadError("Upload is already being finalized", 409) from None
+
+        try:
+            if self._writes_in_progress(claimed):
+                raise UploadError("A chunk is still being written", 409)
+            meta = self._read_meta(claimed)
+            missing = self._missing(claimed, meta)
+            if missing:
+                raise UploadError(f"{len(missing)} chunk(s) missing", 409)
+            data_path = os.path.join(claimed, "data")
+            # Hashing a multi-GB video takes seconds; keep it off the event loop
+            sha256 = cooperative.run_blocking(file_sha256, data_path)
+            if meta["sha256"] and sha256 != meta["sha256"]:
+                raise UploadError("File checksum mismatch", 422)
+        except BaseException:
+            # Still resumable: give the upload its id back
+            os.rename(claimed, path)
+            raise
+
+        os.replace(data_path, os.path.join(self.dest_folder, meta["filename"]))
+        shutil.rmtree(claimed, ignore_errors=True)
+        return {"filename": meta["filename"], "size": meta["size"], "sha256": sha256}
+
+    @staticmethod
+    def _last_activity(path):
+        """Newest mtime among the upload's meta, data, chunk and in-progress markers."""
+        newest = os.path.getmtime(path)
+        for name in ("meta.json", "data"):
+            try:
+                newest = max(newest, os.path.getmtime(os.path.join(path, name)))
+            except FileNotFoundError:
+                pass
+        for folder in ("chunks", "writing"):
+            try:
+                with os.scandir(os.path.join(path, folder)) as markers:
+                    for marker in markers:
+                        newest = max(newest, marker.stat().st_mtime)
+            except FileNotFoundError:
+                pass
+        return newest
+
+    def cleanup_stale(self):
+        # The directory's own mtime stops moving once its entries exist,
+        # so an upload still receiving chunks would look abandoned
+        cutoff = time.time() - STALE_SECONDS
+        for name in os.listdir(self.tmp_folder):
+            path = os.path.join(self.tmp_folder, name)
+            try:
+                if os.path.isdir(path) and self._last_activity(path) < cutoff:
+                    shutil.rmtree(path, ignore_errors=True)
+            except FileNotFoundError:
+                continue
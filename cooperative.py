@@ -0,0 +1,48 @@
+"""
+Helpers for running under gevent workers.
+
+With gevent's monkey patching, `threading.Thread` and thread pools become
+greenlets on the worker's single OS thread. That is what lets one process
+hold thousands of waiting connections, but CPU-heavy work (hashing a
+multi-GB upload, resizing a screenshot) then freezes every other request
+in the worker until it finishes.
+
+`run_blocking(fn, ...)` sends such work to gevent's pool of real OS threads
+and parks only the calling greenlet. Without gevent (gthread workers, the
+dev server, scripts) it simply calls fn.
+
+Not everything that can block goes through it. SQLite statements run
+inline: they are short under WAL, but a statement that finds the database
+locked by another process waits inside the C library (busy_timeout, up to
+30 s) and holds up the whole worker meanwhile. File locks
+(forksafe.FileLock) are tried without blocking first and only a contended
+one is waited for in a native thread.
+"""
+try:
+    import gevent
+    from gevent import monkey
+except ImportError:
+    gevent = None
+    monkey = None
+
+
+def patched():
+    return monkey is not None and monkey.is_module_patched("threading")
+
+
+def mode():
+    return "gevent" if patched() else "threads"
+
+
+def run_blocking(fn, *args, **kwargs):
+    """Run CPU-bound or blocking C code without stalling the event loop."""
+    if not patched():
+        return fn(*args, **kwargs)
+    return gevent.get_hub().threadpool.apply(fn, args, kwargs)
+
+
+def original(module, name, default):
+    """The unpatched version of module.name, e.g. a real start_new_thread."""
+    if monkey is not None and monkey.is_module_patched(module):
+        return monkey.get_original(module, name)
+    return default
@@ -0,0 +1,124 @@
+"""
+In-memory index of the course files in static/uploads.
+
+The dashboard renders from an immutable snapshot instead of listing and
+parsing the folder on every hit. A snapshot is rebuilt only when the
+folder's mtime changes (checked at most every `check_interval` seconds) or
+when /upload reports a new file; unchanged files keep their parsed entry.
+"""
+import hashlib
+import os
+import threading
+import time
+
+# Allowed course file extensions
+COURSE_EXTENSIONS = {
+    "pdf": "PDF",
+    "mp4": "Video",
+    "mkv": "Video",
+    "webm": "Video",
+    "avi": "Video",
+    "mov": "Video",
+    "mp3": "Audio",
+    "wav": "Audio"
+}
+
+
+def parse_entry(name, size, mtime_ns):
+    """Course entry for a file name, or None for non-course files."""
+    ext = name.lower().split('.')[-1]
+    if ext not in COURSE_EXTENSIONS:
+        return None
+
+    # Extract module number from filename (e.g., M1_filename.pdf)
+    mod = "M1"  # Default module
+    if "_" in name:
+        tag = name.split("_")[0]
+        if tag.lower().startswith("m") and tag[1:].isdigit():
+            mod = tag.upper()
+
+    return {
+        "name": name,
+        "url": f"/media/{name}",
+        "kind": COURSE_EXTENSIONS[ext],
+        "ext": ext,
+        "module": mod,
+        "size": size,
+        "mtime_ns": mtime_ns
+    }
+
+
+def _module_key(mod):
+    return int(mod[1:])
+
+
+class Snapshot:
+    def __init__(self, entries):
+        self.entries = entries
+        modules = {}
+        for entry in sorted(entries.values(), key=lambda e: e["name"].lower()):
+            modules.setdefault(entry["module"], []).append(entry)
+        # M2 before M10
+        self.modules = {mod: modules[mod] for mod in sorted(modules, key=_module_key)}
+
+        # Same files -> same version in every worker
+        digest = hashlib.sha1()
+        for name in sorted(entries):
+            digest.update(f"{name}\0{entries[name]['size']}\0{entries[name]['mtime_ns']}\n".encode())
+        self.version = digest.hexdigest()[:16]
+
+
+class CourseCatalog:
+    def __init__(self, folder, check_interval=2.0):
+        self.folder = folder
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._dir_mtime = None
+        self._checked_at = 0.0
+
+    def snapshot(self):
+        now = time.monotonic()
+        if self._snapshot is None or now - self._checked_at > self.check_interval:
+            self._checked_at = now
+            try:
+                mtime = os.stat(self.folder).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if self._snapshot is None or mtime != self._dir_mtime:
+                self.rescan()
+        return self._snapshot
+
+    def rescan(self):
+        with self._lock:
+            old = self._snapshot.entries if self._snapshot else {}
+            entries = {}
+            try:
+                self._dir_mtime = os.stat(self.folder).st_mtime_ns
+                scanned = list(os.scandir(self.folder))
+            except FileNotFoundError:
+                scanned = []
+            for item in scanned:
+                if not item.is_file():
+                    continue
+                st = item.stat()
+                prev = old.get(item.name)
+                if prev and prev["size"] == st.st_size and prev["mtime_ns"] == st.st_mtime_ns:
+                    entries[item.name] = prev
+                    continue
+                entry = parse_entry(item.name, st.st_size, st.st_mtime_ns)
+                if entry:
+                    entries[item.name] = entry
+            self._snapshot = Snapshot(entries)
+
+    def add_file(self, name):
+        """Register a file that was just written to the folder."""
+        path = os.path.join(self.folder, name)
+        st = os.stat(path)
+        entry = parse_entry(name, st.st_size, st.st_mtime_ns)
+        if entry is None:
+            return
+        with self._lock:
+            entries = dict(self._snapshot.entries) if self._snapshot else {}
+            entries[name] = entry
+            self._snapshot = Snapshot(entries)
@@ -0,0 +1,53 @@
+"""
+Small SQLite helper shared by everything that keeps local state
+(payments, likes, outbox, ...).
+
+Connections are cached per process and per OS thread, so the same module
+can be used from request threads, background workers and forked gunicorn
+workers without sharing a handle across a fork or a thread.
+
+Under gevent every greenlet of a worker runs on the same OS thread and so
+shares its connection (threading.local would be per greenlet: one
+connection, and three PRAGMAs, per request or parked waiter). That is safe
+because sqlite3 calls never yield to another greenlet; keep it that way by
+doing no network I/O or run_blocking() inside a transaction() block.
+"""
+import _thread
+import os
+import sqlite3
+from contextlib import contextmanager
+
+import cooperative
+import forksafe
+
+DB_FILE = os.getenv("DB_FILE", "stockboy.db")
+
+_conns = forksafe.PerProcess(dict)   # (path, OS thread id) -> connection
+_thread_id = cooperative.original("_thread", "get_ident", _thread.get_ident)
+
+
+def get_connection(path=None):
+    path = path or DB_FILE
+    conns = _conns.get()
+    key = (path, _thread_id())
+    conn = conns.get(key)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        conns[key] = conn
+    return conn
+
+
+@contextmanager
+def transaction(conn):
+    """BEGIN IMMEDIATE ... COMMIT, so writers serialize instead of deadlocking."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
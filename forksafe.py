@@ -0,0 +1,87 @@
+"""
+Per-process state for code that runs in forked gunicorn workers.
+
+With --preload the app is built in the master and workers inherit it
+through fork. Two kinds of state must not be inherited:
+
+- threads and pools: they don't exist in the child, only their objects do;
+- flock handles: a lock taken through an inherited file is shared with
+  the parent and every sibling, so it excludes nobody.
+
+`PerProcess(factory)` calls factory once in each process that asks for
+the value, and `FileLock(path)` is an flock with its own handle per
+process.
+"""
+import os
+import threading
+from contextlib import contextmanager
+
+import cooperative
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines
+    fcntl = None
+
+
+class PerProcess:
+    """factory() run lazily, once per process; get() returns its result."""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._pid = None
+        self._value = None
+
+    def get(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._value = self._factory()
+                    self._pid = os.getpid()
+        return self._value
+
+    def started(self):
+        """True if get() has already run in this process."""
+        return self._pid == os.getpid()
+
+
+class _Handle:
+    def __init__(self, path):
+        self.file = open(path, "a+b")
+        self.depth = 0
+
+
+class FileLock:
+    """Cross-process exclusive/shared lock on path.
+
+    Re-entrant within a process; callers serialize their own threads.
+    A contended lock is waited for in a native thread, so under gevent it
+    parks the caller's greenlet instead of the whole worker.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._handle = PerProcess(lambda: _Handle(path))
+
+    @contextmanager
+    def held(self, exclusive=True):
+        handle = self._handle.get()
+        if handle.depth or not fcntl:
+            handle.depth += 1
+            try:
+                yield
+            finally:
+                handle.depth -= 1
+            return
+        mode = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        try:
+            fcntl.flock(handle.file, mode | fcntl.LOCK_NB)
+        except BlockingIOError:
+            cooperative.run_blocking(fcntl.flock, handle.file, mode)
+        handle.depth = 1
+        try:
+            yield
+        finally:
+            handle.depth = 0
+            fcntl.flock(handle.file, fcntl.LOCK_UN)
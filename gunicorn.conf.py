@@ -0,0 +1,75 @@
+"""
+Gunicorn settings (Procfile: gunicorn -c gunicorn.conf.py app:app).
+
+WEB_WORKER_CLASS=gevent (default): each worker is one process with an
+event loop, so it can hold thousands of idle, long-polling
+(/wait_approval) and streaming (/approval_stream, /media) connections.
+Sockets (clients, Telegram), sleeps and contended file locks yield to
+other requests; CPU-heavy work (file hashing, screenshot resizing) goes
+to native threads via cooperative.run_blocking. SQLite statements run
+inline on one connection per worker thread: they are short, but a write
+that has to wait for another process's write stalls the worker for that
+long (see cooperative.py).
+
+WEB_WORKER_CLASS=gthread: plain OS threads, for hosts without gevent.
+Capacity is then workers x WEB_THREADS concurrent requests.
+
+WEB_PRELOAD=1 (default) imports the app once in the master and warms it
+(templates compiled, catalog scanned, pages rendered, payment indexes
+read) before forking, so workers start with all of that in place.
+Sockets and threads are opened per worker after the fork. WEB_PRELOAD=0
+loads and warms the app in every worker instead. Either way each process
+logs where its startup time went.
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+worker_class = os.getenv("WEB_WORKER_CLASS", "gevent")
+if worker_class == "gevent":
+    try:
+        from gevent import monkey
+    except ImportError:
+        print("gevent is not installed, falling back to gthread workers")
+        worker_class = "gthread"
+
+preload_app = os.getenv("WEB_PRELOAD", "1") != "0"
+if preload_app and worker_class == "gevent":
+    # The master imports the app before any gevent worker exists to patch
+    # the stdlib; patch here so the locks, queues and threads it creates
+    # are gevent-aware in the workers
+    monkey.patch_all()
+
+workers = int(os.getenv("WEB_CONCURRENCY", min(multiprocessing.cpu_count(), 4)))
+worker_connections = int(os.getenv("WORKER_CONNECTIONS", "2000"))  # gevent
+threads = int(os.getenv("WEB_THREADS", "64"))                      # gthread
+
+# SSE streams send a keep-alive every 15 s; uploads can be slow
+timeout = int(os.getenv("WEB_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+
+
+# -------------------------------------------------
+# WARM-UP HOOKS
+# -------------------------------------------------
+# app and startup are imported inside the hooks: importing them here would
+# load the app before gunicorn decides where (master or worker) it belongs
+def when_ready(server):
+    # Master, listening, right before the first fork
+    if not preload_app:
+        return
+    import app
+    import startup
+    app.warm_up()
+    server.log.info(startup.report.render(f"Preloaded app ({worker_class})"))
+
+
+def post_worker_init(worker):
+    import app
+    import startup
+    if not preload_app:
+        app.warm_up()
+    app.warm_worker()
+    worker.log.info(startup.report.render(f"Worker ready ({worker_class})"))
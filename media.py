@@ -0,0 +1,271 @@
+"""
+Byte-range and conditional-GET serving for course media.
+
+- Strong ETag from the file's SHA-256, kept in SQLite per (name, size,
+  mtime) so it is computed once per file version, not per request. Until a
+  hash exists the ETag is derived from size and mtime, and hashing runs in
+  the background.
+- If-Match / If-Unmodified-Since -> 412, If-None-Match / If-Modified-Since
+  -> 304, If-Range, single and multiple ranges (multipart/byteranges), 416
+  for unsatisfiable ranges.
+- Full bodies and single ranges go through wsgi.file_wrapper, so gunicorn
+  can use sendfile.
+- MEDIA_OFFLOAD=nginx|sendfile hands the bytes to the front proxy with
+  X-Accel-Redirect / X-Sendfile instead.
+"""
+import hashlib
+import mimetypes
+import os
+import stat
+import threading
+import uuid
+from urllib.parse import quote
+
+from flask import Response
+from werkzeug.http import http_date, parse_range_header
+
+import cooperative
+import db
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS media_hashes (
+    name TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT NOT NULL
+);
+"""
+
+MAX_RANGES = 16
+READ_SIZE = 256 * 1024
+
+mimetypes.add_type("video/x-matroska", ".mkv")
+mimetypes.add_type("video/webm", ".webm")
+mimetypes.add_type("application/vnd.apple.mpegurl", ".m3u8")
+mimetypes.add_type("video/mp2t", ".ts")
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for buf in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(buf)
+    return digest.hexdigest()
+
+
+def _read_range(f, start, length):
+    f.seek(start)
+    while length > 0:
+        buf = f.read(min(READ_SIZE, length))
+        if not buf:
+            break
+        length -= len(buf)
+        yield buf
+
+
+class MediaFiles:
+    def __init__(self, folder, db_file=None, offload=None, accel_prefix="/protected-uploads/",
+                 max_age=86400):
+        self.folder = folder
+        self.db_file = db_file
+        self.offload = offload
+        self.accel_prefix = accel_prefix
+        self.max_age = max_age
+        self._hashes = {}
+        self._hashing = set()
+        self._lock = threading.Lock()
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        return db.get_connection(self.db_file)
+
+    # -------------------------------------------------
+    # CONTENT HASHES
+    # -------------------------------------------------
+    def record_hash(self, name, sha256=None):
+        """Store the hash of a file that was just written (computed if not given)."""
+        path = os.path.join(self.folder, name)
+        st = os.stat(path)
+        sha256 = sha256 or file_sha256(path)
+        self._conn().execute(
+            "INSERT OR REPLACE INTO media_hashes (name, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)",
+            (name, st.st_size, st.st_mtime_ns, sha256),
+        )
+        self._hashes[name] = (st.st_size, st.st_mtime_ns, sha256)
+        return sha256
+
+    def _cached_hash(self, name, st):
+        key = (st.st_size, st.st_mtime_ns)
+        hit = self._hashes.get(name)
+        if hit and hit[:2] == key:
+            return hit[2]
+        row = self._conn().execute(
+            "SELECT size, mtime_ns, sha256 FROM media_hashes WHERE name = ?", (name,)
+        ).fetchone()
+        if row and (row["size"], row["mtime_ns"]) == key:
+            self._hashes[name] = (row["size"], row["mtime_ns"], row["sha256"])
+            return row["sha256"]
+        return None
+
+    def hash_later(self, name):
+        with self._lock:
+            if name in self._hashing:
+                return
+            self._hashing.add(name)
+
+        def run():
+            try:
+                sha256 = cooperative.run_blocking(file_sha256, os.path.join(self.folder, name))
+                self.record_hash(name, sha256)
+            except OSError:
+                pass
+            finally:
+                with self._lock:
+                    self._hashing.discard(name)
+
+        threading.Thread(target=run, name="media-hash", daemon=True).start()
+
+    def etag(self, name, st):
+        sha256 = self._cached_hash(name, st)
+        if sha256:
+            return sha256[:32]
+        self.hash_later(name)
+        return f"{st.st_size:x}-{st.st_mtime_ns:x}"
+
+    # -------------------------------------------------
+    # RESPONSES
+    # -------------------------------------------------
+    def response(self, name, req, cache_control=None):
+        path = os.path.join(self.folder, name)
+        try:
+            st = os.stat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            return Response("Not found", 404)
+        if not stat.S_ISREG(st.st_mode):
+            return Response("Not found", 404)
+
+        size = st.st_size
+        mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        etag = self.etag(name, st)
+        headers = {
+            "ETag": f'"{etag}"',
+            "Last-Modified": http_date(st.st_mtime),
+            "Accept-Ranges": "bytes",
+            "Cache-Control": cache_control or f"private, max-age={self.max_age}"
+        }
+
+        # A download resumed against a file that has since changed must not be spliced
+        if (req.if_match and not req.if_match.contains(etag)) or (
+            not req.if_match and req.if_unmodified_since
+            and int(st.st_mtime) > req.if_unmodified_since.timestamp()
+        ):
+            return Response(status=412, headers=headers)
+
+        if req.if_none_match.contains(etag) or (
+            not req.if_none_match and req.if_modified_since
+            and int(st.st_mtime) <= req.if_modified_since.timestamp()
+        ):
+            return Response(status=304, headers=headers)
+
+        if self.offload == "nginx":
+            headers["X-Accel-Redirect"] = self.accel_prefix + quote(name)
+            return Response(status=200, headers=headers, mimetype=mimetype)
+        if self.offload == "sendfile":
+            headers["X-Sendfile"] = os.path.abspath(path)
+            return Response(status=200, headers=headers, mimetype=mimetype)
+
+        ranges = self._ranges(req, etag, st, size)
+        if ranges == "unsatisfiable":
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status=416, headers=headers)
+
+        f = open(path, "rb")
+        if not ranges:
+            return self._file_response(req, f, 0, size, 200, headers, mimetype)
+
+        if len(ranges) == 1:
+            start, stop = ranges[0]
+            headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+            return self._file_response(req, f, start, stop - start, 206, headers, mimetype)
+
+        return self._multipart_response(f, ranges, size, headers, mimetype)
+
+    def _ranges(self, req, etag, st, size):
+        header = req.headers.get("Range")
+        if not header or size == 0:
+            return None
+
+        # If-Range: only honour Range if the client's copy is still current
+        if_range = req.headers.get("If-Range")
+        if if_range:
+            if if_range.strip('"') != etag and if_range != http_date(st.st_mtime):
+                return None
+
+        parsed = parse_range_header(header)
+        if parsed is None or parsed.units != "bytes":
+            return None
+
+        spans = []
+        for start, stop in parsed.ranges[:MAX_RANGES]:
+            if start < 0:
+                start, stop = max(size + start, 0), size
+            else:
+                stop = min(stop or size, size)
+            if start < stop:
+                spans.append([start, stop])
+        if not spans:
+            return "unsatisfiable"
+
+        # Merge overlapping / adjacent spans
+        spans.sort()
+        merged = [spans[0]]
+        for start, stop in spans[1:]:
+            if start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], stop)
+            else:
+                merged.append([start, stop])
+        return [tuple(s) for s in merged]
+
+    @staticmethod
+    def _file_response(req, f, start, length, status, headers, mimetype):
+        file_wrapper = req.environ.get("wsgi.file_wrapper")
+        if file_wrapper:
+            # gunicorn sendfiles from the current offset up to Content-Length
+            f.seek(start)
+            body = file_wrapper(f, READ_SIZE)
+        else:
+            def body_iter():
+                with f:
+                    yield from _read_range(f, start, length)
+            body = body_iter()
+        resp = Response(body, status=status, headers=headers, mimetype=mimetype, direct_passthrough=True)
+        resp.content_length = length
+        return resp
+
+    @staticmethod
+    def _multipart_response(f, ranges, size, headers, mimetype):
+        boundary = uuid.uuid4().hex
+        parts = []
+        length = 0
+        for start, stop in ranges:
+            head = (
+                f"\r\n--{boundary}\r\n"
+                f"Content-Type: {mimetype}\r\n"
+                f"Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n"
+            ).encode()
+            parts.append((head, start, stop))
+            length += len(head) + stop - start
+        tail = f"\r\n--{boundary}--\r\n".encode()
+        length += len(tail)
+
+        def body():
+            with f:
+                for head, start, stop in parts:
+                    yield head
+                    yield from _read_range(f, start, stop - start)
+                yield tail
+
+        resp = Response(body(), status=206, headers=headers,
+                        content_type=f"multipart/byteranges; boundary={boundary}", direct_passthrough=True)
+        resp.content_length = length
+        return resp
@@ -0,0 +1,246 @@
+"""
+Request timing and Prometheus metrics.
+
+- Every request is timed into a per-route histogram (the route is the URL
+  rule, e.g. /media/<filename>, so labels don't grow with file names).
+- `span(kind, name)` times a block of storage, filesystem or Telegram work;
+  `instrument(obj, kind, methods)` wraps an object's methods in spans.
+- /metrics renders everything in Prometheus text format.
+
+Each gunicorn worker keeps its numbers in memory and writes them to
+METRICS_DIR/<pid>.json about once a second (tmp file + rename). The
+writer thread starts with the first request a process serves, so a
+preloading master, which only imports and warms the app, never writes
+a file of its own; forked workers start counting from zero. A scrape,
+whichever worker gets it, adds up the files of every worker, so counters
+don't jump around depending on who answered. Files of workers that have
+been gone for an hour are removed.
+"""
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import forksafe
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FLUSH_INTERVAL = 1.0
+DEAD_WORKER_RETENTION = 3600
+PREFIX = "stockboy_"
+
+HELP = {
+    "http_request_duration_seconds": "Time spent handling a request, by route.",
+    "span_duration_seconds": "Time spent in storage, filesystem and Telegram calls.",
+    "span_errors_total": "Spans that raised an exception.",
+    "page_cache_lookups_total": "Rendered page and fragment cache lookups.",
+    "admission_rejected_total": "Requests refused by rate limits or size caps."
+}
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Registry:
+    def __init__(self, folder):
+        self.folder = folder
+        self._lock = threading.Lock()
+        self._histograms = {}   # (name, labels) -> [bucket counts..., sum, count]
+        self._counters = {}     # (name, labels) -> value
+        self._dirty = False
+        self._flusher = forksafe.PerProcess(self._start_flusher)
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._forget)
+
+    # -------------------------------------------------
+    # RECORDING
+    # -------------------------------------------------
+    def observe(self, metric, seconds, /, **labels):
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [0] * (len(BUCKETS) + 2)
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    hist[i] += 1
+                    break
+            hist[-2] += seconds
+            hist[-1] += 1
+            self._dirty = True
+
+    def inc(self, metric, amount=1, /, **labels):
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+            self._dirty = True
+
+    # -------------------------------------------------
+    # SHARING ACROSS WORKERS
+    # -------------------------------------------------
+    def _forget(self):
+        # A forked worker starts from zero; the parent's numbers are not its own
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._dirty = False
+
+    def start(self):
+        """Start writing this process's numbers; called once it serves requests."""
+        self._flusher.get()
+
+    def _start_flusher(self):
+        thread = threading.Thread(target=self._flush_loop, name="metrics-flusher", daemon=True)
+        thread.start()
+        atexit.register(self.flush)
+        return thread
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"Metrics flush error: {e}")
+
+    def flush(self):
+        with self._lock:
+            if not self._dirty or not self._flusher.started():
+                return
+            data = {
+                "histograms": [[n, list(l), v[:]] for (n, l), v in self._histograms.items()],
+                "counters": [[n, list(l), v] for (n, l), v in self._counters.items()]
+            }
+            self._dirty = False
+        os.makedirs(self.folder, exist_ok=True)
+        path = os.path.join(self.folder, f"{os.getpid()}.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(data, f)
+        os.replace(path + ".tmp", path)
+
+    def collect(self):
+        """Sum of every worker's numbers."""
+        self.start()
+        self.flush()
+        histograms, counters = {}, {}
+        try:
+            names = os.listdir(self.folder)
+        except FileNotFoundError:
+            names = []
+        now = time.time()
+        for file_name in names:
+            pid, ext = os.path.splitext(file_name)
+            if ext != ".json" or not pid.isdigit():
+                continue
+            path = os.path.join(self.folder, file_name)
+            try:
+                if not _pid_alive(int(pid)) and now - os.stat(path).st_mtime > DEAD_WORKER_RETENTION:
+                    os.remove(path)
+                    continue
+                with open(path, "r") as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, labels, values in data["histograms"]:
+                key = (name, tuple(tuple(pair) for pair in labels))
+                total = histograms.setdefault(key, [0] * len(values))
+                for i, v in enumerate(values):
+                    total[i] += v
+            for name, labels, value in data["counters"]:
+                key = (name, tuple(tuple(pair) for pair in labels))
+                counters[key] = counters.get(key, 0) + value
+        return histograms, counters
+
+    # -------------------------------------------------
+    # PROMETHEUS TEXT FORMAT
+    # -------------------------------------------------
+    def render(self, gauges=None):
+        histograms, counters = self.collect()
+        lines = []
+
+        for name in sorted({n for n, _ in histograms}):
+            lines.append(f"# HELP {PREFIX}{name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {PREFIX}{name} histogram")
+            for (n, labels), values in sorted(histograms.items()):
+                if n != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(BUCKETS, values):
+                    cumulative += count
+                    lines.append(f"{PREFIX}{name}_bucket{_labels(labels, le=repr(bound))} {cumulative}")
+                lines.append(f"{PREFIX}{name}_bucket{_labels(labels, le='+Inf')} {values[-1]}")
+                lines.append(f"{PREFIX}{name}_sum{_labels(labels)} {values[-2]:.6f}")
+                lines.append(f"{PREFIX}{name}_count{_labels(labels)} {values[-1]}")
+
+        for name in sorted({n for n, _ in counters}):
+            lines.append(f"# HELP {PREFIX}{name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {PREFIX}{name} counter")
+            for (n, labels), value in sorted(counters.items()):
+                if n == name:
+                    lines.append(f"{PREFIX}{name}{_labels(labels)} {value}")
+
+        for name, (help_text, value) in sorted((gauges or {}).items()):
+            lines.append(f"# HELP {PREFIX}{name} {help_text}")
+            lines.append(f"# TYPE {PREFIX}{name} gauge")
+            lines.append(f"{PREFIX}{name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+registry = Registry(os.getenv("METRICS_DIR", "metrics"))
+
+
+# -------------------------------------------------
+# SPANS
+# -------------------------------------------------
+@contextmanager
+def span(kind, name):
+    """Time a block of storage / filesystem / telegram work."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        registry.inc("span_errors_total", 1, kind=kind, name=name)
+        raise
+    finally:
+        registry.observe("span_duration_seconds", time.perf_counter() - started, kind=kind, name=name)
+
+
+def instrument(obj, kind, methods, prefix=None):
+    """Wrap obj's methods in spans named '<prefix>.<method>'."""
+    prefix = prefix or type(obj).__name__
+    for method in methods:
+        original = getattr(obj, method)
+
+        @functools.wraps(original)
+        def timed(*args, _original=original, _name=f"{prefix}.{method}", **kwargs):
+            with span(kind, _name):
+                return _original(*args, **kwargs)
+
+        setattr(obj, method, timed)
+    return obj
+
+
+def observe_request(route, method, status, seconds):
+    registry.start()
+    registry.observe("http_request_duration_seconds", seconds, route=route, method=method, status=str(status))
@@ -0,0 +1,149 @@
+"""
+In-memory cache for rendered pages and template fragments.
+
+Entries are keyed by whatever the output depends on (asset build, catalog
+version, ...), so nothing is ever invalidated by hand: a new key is simply
+rendered once and the old one ages out of the LRU.
+
+A cached page keeps its body pre-compressed with gzip, and with brotli when
+the optional `brotli` package is installed, plus an ETag. `respond()` picks
+the encoding the client accepts and answers a matching If-None-Match with
+304, so a hit costs a dict lookup and no rendering or compression.
+
+A value that changes all the time (the like count) is left out of the key:
+the template renders SLOT in its place and `slotted()` caches a
+SlottedPage, whose `fill(value)` builds the response around it. Both
+halves of the page are deflated once, each ending on a full flush, so
+filling in the value only deflates the value itself.
+"""
+import gzip
+import hashlib
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+
+from flask import Response
+from markupsafe import Markup
+
+import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BROTLI_QUALITY = 9
+
+# Where a slotted template puts its per-request value
+SLOT = Markup("<!--page-slot-->")
+_GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x02\xff"   # deflate, no name, mtime 0, max compression
+
+
+class CachedPage:
+    __slots__ = ("body", "etag", "gzip", "br")
+
+    def __init__(self, html):
+        self.body = html.encode()
+        self.etag = hashlib.sha1(self.body).hexdigest()[:20]
+        self.gzip = gzip.compress(self.body, 9, mtime=0)
+        self.br = brotli.compress(self.body, quality=BROTLI_QUALITY) if brotli else None
+
+
+def _deflate(data, mode, level=9):
+    # Raw deflate blocks; a full flush ends byte-aligned with a fresh window,
+    # so separately deflated pieces can be concatenated into one stream
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(mode)
+
+
+class _FilledPage:
+    __slots__ = ("body", "etag", "gzip", "br")
+
+    def __init__(self, body, etag, gzip_body):
+        self.body = body
+        self.etag = etag
+        self.gzip = gzip_body
+        self.br = None
+
+
+class SlottedPage:
+    """A page with one small per-request value in it, at SLOT."""
+
+    def __init__(self, html):
+        head, tail = html.encode().split(SLOT.encode(), 1)
+        self.head = head
+        self.tail = tail
+        self.etag = hashlib.sha1(head + SLOT.encode() + tail).hexdigest()[:16]
+        self._gzip_head = _GZIP_HEADER + _deflate(head, zlib.Z_FULL_FLUSH)
+        self._gzip_tail = _deflate(tail, zlib.Z_FINISH)
+        self._crc_head = zlib.crc32(head)
+
+    def fill(self, value):
+        """Page with value (already HTML-safe) at the slot, ready for respond()."""
+        value = str(value).encode()
+        body = self.head + value + self.tail
+        crc = zlib.crc32(self.tail, zlib.crc32(value, self._crc_head))
+        gzip_body = (self._gzip_head + _deflate(value, zlib.Z_FULL_FLUSH, level=1) + self._gzip_tail
+                     + struct.pack("<II", crc, len(body) & 0xFFFFFFFF))
+        etag = f"{self.etag}.{hashlib.sha1(value).hexdigest()[:8]}"
+        return _FilledPage(body, etag, gzip_body)
+
+
+class PageCache:
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, kind, key, build):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+        metrics.registry.inc("page_cache_lookups_total", 1, kind=kind, name=key[0],
+                             result="hit" if value is not None else "miss")
+        if value is not None:
+            return value
+
+        # Rendering twice on a race is harmless; holding the lock while rendering is not
+        value = build()
+        with self._lock:
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def page(self, key, render):
+        """Cached CachedPage for key; render() returns the HTML string."""
+        return self._get("page", key, lambda: CachedPage(render()))
+
+    def slotted(self, key, render):
+        """Cached SlottedPage for key; render() returns HTML containing SLOT once."""
+        return self._get("page", key, lambda: SlottedPage(render()))
+
+    def fragment(self, key, render):
+        """Cached HTML fragment, safe to drop into another template."""
+        return self._get("fragment", key, lambda: Markup(render()))
+
+
+def respond(page, req, cache_control="no-cache"):
+    """Serve a CachedPage in the best encoding the client accepts, or 304."""
+    if page.br is not None and req.accept_encodings["br"]:
+        encoding, body = "br", page.br
+    elif req.accept_encodings["gzip"]:
+        encoding, body = "gzip", page.gzip
+    else:
+        encoding, body = None, page.body
+    # Each encoding is a different representation, so it gets its own tag
+    etag = f"{page.etag}-{encoding}" if encoding else page.etag
+
+    headers = {"Vary": "Accept-Encoding", "Cache-Control": cache_control}
+    if req.if_none_match.contains_weak(etag):
+        resp = Response(status=304, headers=headers)
+    else:
+        resp = Response(body, mimetype="text/html", headers=headers)
+        if encoding:
+            resp.headers["Content-Encoding"] = encoding
+    resp.set_etag(etag)
+    return resp
@@ -0,0 +1,217 @@
+"""
+Payment approval state machine.
+
+    pending -> approved | rejected
+
+Every decision (Telegram button, admin panel) goes through `transition()`:
+
+- The status change is a compare-and-set in the payment store, so a
+  double-tap, a webhook retry and the admin panel racing each other apply
+  at most one transition.
+- Telegram callbacks carry their callback_query id as `event_id`, and a
+  redelivered update is recognised as a duplicate and has no effect at
+  all. With the SQLite store on the same database the event is claimed
+  in the status change's own transaction; otherwise it is claimed first,
+  and a claim that never got an outcome (the process died mid-way) can
+  be taken again after CLAIM_TIMEOUT.
+- Each applied transition is appended to `payment_audit`, which triggers
+  keep append-only. With the SQLite store on the same database the audit
+  row is written in the transaction that changes the status, so neither
+  can be committed without the other.
+- `transition_many()` applies a whole admin batch in one store
+  transaction, with the same compare-and-set per payment.
+
+Readers never take a lock here: status reads keep going through the store
+and the status cache.
+"""
+import time
+from collections import namedtuple
+
+import db
+import payment_store
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS payment_audit (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    txn_id TEXT NOT NULL,
+    from_status TEXT NOT NULL,
+    to_status TEXT NOT NULL,
+    actor TEXT NOT NULL,
+    event_id TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS payment_audit_txn_id ON payment_audit (txn_id, id);
+CREATE TRIGGER IF NOT EXISTS payment_audit_no_update BEFORE UPDATE ON payment_audit
+BEGIN SELECT RAISE(ABORT, 'payment_audit is append-only'); END;
+CREATE TRIGGER IF NOT EXISTS payment_audit_no_delete BEFORE DELETE ON payment_audit
+BEGIN SELECT RAISE(ABORT, 'payment_audit is append-only'); END;
+CREATE TABLE IF NOT EXISTS payment_events (
+    event_id TEXT PRIMARY KEY,
+    txn_id TEXT,
+    outcome TEXT,
+    created_at REAL NOT NULL
+);
+"""
+
+TRANSITIONS = {
+    "pending": {"approved", "rejected"},
+}
+
+# The admin panel may still correct a decision that was already made
+ADMIN_TRANSITIONS = {
+    "approved": {"rejected"},
+    "rejected": {"approved"},
+}
+
+APPLIED = "applied"      # status changed
+STALE = "stale"          # payment missing or no longer in the expected state
+DUPLICATE = "duplicate"  # event_id seen before; nothing was done
+
+# Telegram only redelivers recent updates
+EVENT_RETENTION = 7 * 86400
+# A claim still without an outcome after this long belongs to a dead process
+CLAIM_TIMEOUT = 60
+
+Result = namedtuple("Result", "outcome record")
+
+
+class InvalidTransition(ValueError):
+    pass
+
+
+class _Duplicate(Exception):
+    """Rolls back a status change whose event was already claimed."""
+
+
+class PaymentStateMachine:
+    def __init__(self, store, db_file=None):
+        self.store = store
+        self.db_file = db_file
+        self._claims = 0
+        # Audit rows can share the status change's transaction
+        self._same_db = isinstance(store, payment_store.SqlitePaymentStore) and store.db_file == db_file
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        return db.get_connection(self.db_file)
+
+    @staticmethod
+    def allowed(current, status, actor="telegram"):
+        if status in TRANSITIONS.get(current, ()):
+            return True
+        return actor == "admin" and status in ADMIN_TRANSITIONS.get(current, ())
+
+    def transition(self, txn_id, status, actor, expected="pending", event_id=None):
+        """Move txn_id from `expected` to `status`. Returns Result(outcome, record)."""
+        if not self.allowed(expected, status, actor):
+            raise InvalidTransition(f"{expected} -> {status} is not allowed for {actor}")
+
+        if self._same_db:
+            return self._transition_in_store(txn_id, status, actor, expected, event_id)
+
+        if event_id is not None and not self._claim(event_id, txn_id):
+            return Result(DUPLICATE, self.store.get(txn_id))
+
+        try:
+            record = self.store.set_status(txn_id, status, expected=expected)
+            if record:
+                self._audit(self._conn(), txn_id, expected, status, actor, event_id)
+        except Exception:
+            # Let a retry of the same event try again
+            if event_id is not None:
+                self._conn().execute("DELETE FROM payment_events WHERE event_id = ?", (event_id,))
+            raise
+
+        if event_id is not None:
+            self._conn().execute("UPDATE payment_events SET outcome = ? WHERE event_id = ?",
+                                 (APPLIED if record else STALE, event_id))
+        return Result(APPLIED if record else STALE, record or self.store.get(txn_id))
+
+    def _transition_in_store(self, txn_id, status, actor, expected, event_id):
+        """transition() as one SQLite transaction: event claim, compare-and-set and audit row."""
+        def record_event(conn, record):
+            if event_id is not None:
+                claimed = conn.execute(
+                    "INSERT OR IGNORE INTO payment_events (event_id, txn_id, outcome, created_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (event_id, txn_id, APPLIED if record else STALE, time.time()),
+                ).rowcount
+                if not claimed:
+                    raise _Duplicate()
+                self._claimed(conn)
+            if record:
+                self._audit(conn, txn_id, expected, status, actor, event_id)
+
+        try:
+            record = self.store.set_status(txn_id, status, expected=expected, also=record_event)
+        except _Duplicate:
+            return Result(DUPLICATE, self.store.get(txn_id))
+        return Result(APPLIED if record else STALE, record or self.store.get(txn_id))
+
+    @staticmethod
+    def _audit(conn, txn_id, from_status, to_status, actor, event_id):
+        conn.execute(
+            "INSERT INTO payment_audit (txn_id, from_status, to_status, actor, event_id, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (txn_id, from_status, to_status, actor, event_id, time.time()),
+        )
+
+    def transition_many(self, changes, actor):
+        """transition() for each (txn_id, status, expected), as one store transaction.
+
+        Returns a Result per change, in order.
+        """
+        changes = list(changes)
+        for txn_id, status, expected in changes:
+            if not self.allowed(expected, status, actor):
+                raise InvalidTransition(f"{expected} -> {status} is not allowed for {actor}")
+
+        def audit(conn, records):
+            now = time.time()
+            conn.executemany(
+                "INSERT INTO payment_audit (txn_id, from_status, to_status, actor, event_id, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(txn_id, expected, status, actor, None, now)
+                 for (txn_id, status, expected), record in zip(changes, records) if record],
+            )
+
+        if self._same_db:
+            records = self.store.set_status_many(changes, also=audit)
+        else:
+            records = self.store.set_status_many(changes)
+            if any(records):
+                conn = self._conn()
+                with db.transaction(conn):
+                    audit(conn, records)
+        return [
+            Result(APPLIED, record) if record else Result(STALE, self.store.get(txn_id))
+            for (txn_id, _status, _expected), record in zip(changes, records)
+        ]
+
+    def _claim(self, event_id, txn_id):
+        now = time.time()
+        conn = self._conn()
+        claimed = conn.execute(
+            "INSERT OR IGNORE INTO payment_events (event_id, txn_id, created_at) VALUES (?, ?, ?)",
+            (event_id, txn_id, now),
+        ).rowcount
+        if not claimed:
+            # Taken over from a claimer that died before recording an outcome
+            claimed = conn.execute(
+                "UPDATE payment_events SET created_at = ? "
+                "WHERE event_id = ? AND outcome IS NULL AND created_at < ?",
+                (now, event_id, now - CLAIM_TIMEOUT),
+            ).rowcount
+        self._claimed(conn)
+        return claimed == 1
+
+    def _claimed(self, conn):
+        self._claims += 1
+        if self._claims % 500 == 0:
+            conn.execute("DELETE FROM payment_events WHERE created_at < ?", (time.time() - EVENT_RETENTION,))
+
+    def history(self, txn_id):
+        rows = self._conn().execute(
+            "SELECT * FROM payment_audit WHERE txn_id = ? ORDER BY id", (txn_id,)
+        )
+        return [dict(r) for r in rows]
@@ -0,0 +1,802 @@
+"""
+Payment storage backends.
+
+Both backends expose the same small interface used by app.py:
+
+    get(txn_id)                          -> record dict or None
+    get_many(txn_ids)                    -> {txn_id: record} for the ones that exist
+    add(user, txn_id, ss_path, ss_hash)  -> new record, or None if txn_id exists
+    set_status(txn_id, status, expected) -> updated record, or None if the
+                                            current status != expected
+    set_status_many(changes)             -> set_status for each (txn_id, status,
+                                            expected) in one transaction; list
+                                            of updated records / None
+    get_by_id(payment_id)                -> record dict or None
+    get_by_ids(payment_ids)              -> {id: record} for the ids that exist
+    page(status, user, since, until, before_id, limit)
+                                         -> newest-first records matching the
+                                            filters, with id < before_id
+    all()                                -> every record, oldest first
+    warm()                               -> pull indexes into memory ahead of
+                                            the first request
+    backfill_ss_hashes(hash_file)        -> fill in ss_hash for records saved
+                                            before it existed, once per store;
+                                            returns the screenshot files no
+                                            record points to any more
+
+Record ids are stable: they never change once assigned.
+
+Every successful write calls the functions in `store.listeners` with the
+new record, after the change is committed.
+
+"sqlite" (default) keeps payments in a WAL-mode database with a unique index
+on txn_id. "json" is the original payments.json file, now guarded by a file
+lock so concurrent workers don't overwrite each other. "log" keeps
+payments.json as a periodically compacted snapshot and appends each change
+to payments.log, so a write costs one small append instead of rewriting
+the whole history.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import cooperative
+import db
+import forksafe
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines
+    fcntl = None
+
+
+# Next to payments.json: the file backends' "backfill done" flag
+BACKFILL_MARKER = ".ss_hash_backfilled"
+
+
+def _normalize_path(path):
+    # Older records were written on Windows (payment_ss\123.png)
+    return path.replace("\\", "/") if path else path
+
+
+class _Store:
+    def __init__(self):
+        self.listeners = []
+
+    def _changed(self, record):
+        for listener in self.listeners:
+            listener(record)
+        return record
+
+    def warm(self):
+        pass
+
+    def backfill_ss_hashes(self, hash_file):
+        """hash_file(txn_id, ss_path) -> (sha256, stored_path), or None if the file is gone.
+
+        stored_path is where that image is kept; a record whose file is a
+        copy of an image stored elsewhere is pointed there, and its own file
+        is returned so the caller can delete it once nothing refers to it.
+        """
+        if self._backfill_done():
+            return []
+        hashes, replaced = {}, []
+        for entry in self.all():
+            if entry.get("ss_path") and not entry.get("ss_hash"):
+                ss_path = _normalize_path(entry["ss_path"])
+                found = hash_file(entry["txn_id"], ss_path)
+                if found:
+                    sha256, stored_path = found
+                    hashes[entry["id"]] = (sha256, stored_path)
+                    if stored_path != ss_path:
+                        replaced.append(ss_path)
+        if hashes:
+            self._set_ss_hashes(hashes)
+            print(f"Hashed {len(hashes)} older payment screenshots ({len(replaced)} duplicates)")
+        self._mark_backfill_done()
+        return replaced
+
+    def _backfill_done(self):
+        return os.path.exists(self.json_file + BACKFILL_MARKER)
+
+    def _mark_backfill_done(self):
+        with open(self.json_file + BACKFILL_MARKER, "w") as f:
+            f.write(str(time.time()))
+
+
+def _filter_page(entries, status, user, since, until, before_id, limit):
+    """page() for the file backends: entries come newest first."""
+    items = []
+    for entry in entries:
+        created_at = entry.get("created_at")
+        if before_id is not None and entry["id"] >= before_id:
+            continue
+        if status and entry["status"] != status:
+            continue
+        if user and (entry.get("user") or "").lower() != user.lower():
+            continue
+        if since is not None and (created_at is None or created_at < since):
+            continue
+        if until is not None and (created_at is None or created_at >= until):
+            continue
+        items.append(entry)
+        if len(items) >= limit:
+            break
+    return items
+
+
+# -------------------------------------------------
+# SQLITE BACKEND
+# -------------------------------------------------
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS payments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    txn_id TEXT NOT NULL,
+    user TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    ss_path TEXT,
+    ss_hash TEXT,
+    created_at REAL,
+    updated_at REAL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS payments_txn_id ON payments (txn_id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Columns added after the first release, for databases created before them
+ADDED_COLUMNS = {
+    "ss_hash": "TEXT",
+}
+
+# Secondary indexes for the admin listing (filters + id cursor)
+INDEXES = """
+CREATE INDEX IF NOT EXISTS payments_status_id ON payments (status, id);
+CREATE INDEX IF NOT EXISTS payments_user_id ON payments (user COLLATE NOCASE, id);
+CREATE INDEX IF NOT EXISTS payments_created_at ON payments (created_at);
+"""
+
+
+class SqlitePaymentStore(_Store):
+    def __init__(self, db_file=None, json_file=None):
+        super().__init__()
+        self.db_file = db_file
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        existing = {r["name"] for r in conn.execute("PRAGMA table_info(payments)")}
+        for column, kind in ADDED_COLUMNS.items():
+            if column not in existing:
+                conn.execute(f"ALTER TABLE payments ADD COLUMN {column} {kind}")
+        conn.executescript(INDEXES)
+        if json_file:
+            self.migrate_from_json(json_file)
+
+    # Once per database: rows added since the ss_hash column have one already
+    def _backfill_done(self):
+        return self._conn().execute("SELECT 1 FROM meta WHERE key = 'ss_hash_backfilled'").fetchone() is not None
+
+    def _mark_backfill_done(self):
+        self._conn().execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('ss_hash_backfilled', ?)",
+                             (str(time.time()),))
+
+    def _set_ss_hashes(self, hashes):
+        conn = self._conn()
+        with db.transaction(conn):
+            conn.executemany("UPDATE payments SET ss_hash = ?, ss_path = ? WHERE id = ? AND ss_hash IS NULL",
+                             [(sha256, ss_path, payment_id) for payment_id, (sha256, ss_path) in hashes.items()])
+
+    def _conn(self):
+        return db.get_connection(self.db_file)
+
+    @staticmethod
+    def _row(row):
+        return dict(row) if row is not None else None
+
+    def get(self, txn_id):
+        row = self._conn().execute(
+            "SELECT * FROM payments WHERE txn_id = ?", (txn_id,)
+        ).fetchone()
+        return self._row(row)
+
+    def get_many(self, txn_ids):
+        txn_ids = list(set(txn_ids))
+        found = {}
+        conn = self._conn()
+        # Stay well under SQLite's bound-parameter limit
+        for i in range(0, len(txn_ids), 500):
+            chunk = txn_ids[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            for row in conn.execute(f"SELECT * FROM payments WHERE txn_id IN ({marks})", chunk):
+                found[row["txn_id"]] = dict(row)
+        return found
+
+    def add(self, user, txn_id, ss_path, ss_hash=None):
+        now = time.time()
+        conn = self._conn()
+        with db.transaction(conn):
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO payments (txn_id, user, status, ss_path, ss_hash, created_at, updated_at) "
+                "VALUES (?, ?, 'pending', ?, ?, ?, ?)",
+                (txn_id, user, ss_path, ss_hash, now, now),
+            )
+            if cur.rowcount == 0:
+                return None
+            row = conn.execute("SELECT * FROM payments WHERE id = ?", (cur.lastrowid,)).fetchone()
+        return self._changed(self._row(row))
+
+    def set_status(self, txn_id, status, expected="pending", also=None):
+        """also(conn, record), if given, runs in the same transaction after the
+        compare-and-set (record is None if it didn't apply); raising rolls both back."""
+        # Single UPDATE ... WHERE status = expected is the compare-and-set
+        conn = self._conn()
+        row = None
+        with db.transaction(conn):
+            cur = conn.execute(
+                "UPDATE payments SET status = ?, updated_at = ? WHERE txn_id = ? AND status = ?",
+                (status, time.time(), txn_id, expected),
+            )
+            if cur.rowcount:
+                row = conn.execute("SELECT * FROM payments WHERE txn_id = ?", (txn_id,)).fetchone()
+            if also is not None:
+                also(conn, self._row(row))
+        return self._changed(self._row(row)) if row is not None else None
+
+    def set_status_many(self, changes, also=None):
+        """also(conn, records), if given, runs in the same transaction before it commits."""
+        conn = self._conn()
+        results = []
+        with db.transaction(conn):
+            now = time.time()
+            for txn_id, status, expected in changes:
+                cur = conn.execute(
+                    "UPDATE payments SET status = ?, updated_at = ? WHERE txn_id = ? AND status = ?",
+                    (status, now, txn_id, expected),
+                )
+                row = None
+                if cur.rowcount:
+                    row = conn.execute("SELECT * FROM payments WHERE txn_id = ?", (txn_id,)).fetchone()
+                results.append(self._row(row))
+            if also is not None:
+                also(conn, results)
+        # Listeners only hear about the batch once it is committed
+        return [self._changed(record) if record else None for record in results]
+
+    def get_by_id(self, payment_id):
+        row = self._conn().execute("SELECT * FROM payments WHERE id = ?", (payment_id,)).fetchone()
+        return self._row(row)
+
+    def warm(self):
+        # Reading each index once leaves its pages in the OS cache, which
+        # every worker shares
+        conn = self._conn()
+        for column, index in (("txn_id", "payments_txn_id"), ("status", "payments_status_id")):
+            conn.execute(f"SELECT COUNT({column}) FROM payments INDEXED BY {index}").fetchone()
+
+    def get_by_ids(self, payment_ids):
+        ids = list(payment_ids)
+        found = {}
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            rows = self._conn().execute(
+                f"SELECT * FROM payments WHERE id IN ({','.join('?' * len(chunk))})", chunk
+            )
+            found.update((r["id"], dict(r)) for r in rows)
+        return found
+
+    def page(self, status=None, user=None, since=None, until=None, before_id=None, limit=50):
+        where, args = [], []
+        if status:
+            where.append("status = ?")
+            args.append(status)
+        if user:
+            where.append("user = ? COLLATE NOCASE")
+            args.append(user)
+        if since is not None:
+            where.append("created_at >= ?")
+            args.append(since)
+        if until is not None:
+            where.append("created_at < ?")
+            args.append(until)
+        if before_id is not None:
+            where.append("id < ?")
+            args.append(before_id)
+        sql = "SELECT * FROM payments"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id DESC LIMIT ?"
+        rows = self._conn().execute(sql, (*args, limit)).fetchall()
+        return [dict(r) for r in rows]
+
+    def all(self):
+        rows = self._conn().execute("SELECT * FROM payments ORDER BY id").fetchall()
+        return [dict(r) for r in rows]
+
+    def migrate_from_json(self, json_file):
+        """One-time import of payments.json. Runs once per database."""
+        conn = self._conn()
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+            return
+        if not os.path.exists(json_file):
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('json_migrated', ?)", (str(time.time()),))
+            return
+
+        with open(json_file, "r") as f:
+            records = json.load(f)
+
+        imported = 0
+        with db.transaction(conn):
+            # Another worker may have finished the import while we waited for the lock
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+                return
+            for entry in records:
+                # Duplicate txn_ids exist in old files; the first one always won lookups
+                cur = conn.execute(
+                    "INSERT OR IGNORE INTO payments (txn_id, user, status, ss_path) VALUES (?, ?, ?, ?)",
+                    (entry["txn_id"], entry.get("user"), entry.get("status", "pending"),
+                     _normalize_path(entry.get("ss_path"))),
+                )
+                imported += cur.rowcount
+            conn.execute("INSERT INTO meta (key, value) VALUES ('json_migrated', ?)", (str(time.time()),))
+
+        print(f"Imported {imported} payments from {json_file}")
+
+
+# -------------------------------------------------
+# JSON BACKEND
+# -------------------------------------------------
+class JsonPaymentStore(_Store):
+    def __init__(self, json_file):
+        super().__init__()
+        self.json_file = json_file
+        self._flock = forksafe.FileLock(json_file + ".lock")
+        self._lock = threading.Lock()
+        if not os.path.exists(json_file):
+            with open(json_file, "w") as f:
+                json.dump([], f)
+
+    @contextmanager
+    def _locked(self):
+        with self._lock, self._flock.held():
+            yield
+
+    def _load(self):
+        with open(self.json_file, "r") as f:
+            data = json.load(f)
+        # The file is append-only, so the position is a stable id
+        for i, entry in enumerate(data, 1):
+            entry["id"] = i
+        return data
+
+    def _save(self, data):
+        with open(self.json_file, "w") as f:
+            json.dump(data, f, indent=4)
+
+    def get(self, txn_id):
+        for entry in self._load():
+            if entry["txn_id"] == txn_id:
+                return entry
+        return None
+
+    def get_many(self, txn_ids):
+        wanted = set(txn_ids)
+        found = {}
+        for entry in self._load():
+            if entry["txn_id"] in wanted:
+                found.setdefault(entry["txn_id"], entry)
+        return found
+
+    def add(self, user, txn_id, ss_path, ss_hash=None):
+        with self._locked():
+            data = self._load()
+            if any(entry["txn_id"] == txn_id for entry in data):
+                return None
+            record = {"user": user, "txn_id": txn_id, "status": "pending", "ss_path": ss_path,
+                      "ss_hash": ss_hash, "created_at": time.time()}
+            data.append(record)
+            record["id"] = len(data)
+            self._save(data)
+        return self._changed(record)
+
+    def set_status(self, txn_id, status, expected="pending"):
+        with self._locked():
+            data = self._load()
+            for entry in data:
+                if entry["txn_id"] == txn_id:
+                    if entry["status"] != expected:
+                        return None
+                    entry["status"] = status
+                    self._save(data)
+                    break
+            else:
+                return None
+        return self._changed(entry)
+
+    def set_status_many(self, changes):
+        with self._locked():
+            data = self._load()
+            by_txn = {}
+            for entry in data:
+                by_txn.setdefault(entry["txn_id"], entry)
+            results = []
+            for txn_id, status, expected in changes:
+                entry = by_txn.get(txn_id)
+                if entry is None or entry["status"] != expected:
+                    results.append(None)
+                    continue
+                entry["status"] = status
+                results.append(entry)
+            # One rewrite of the file for the whole batch
+            if any(results):
+                self._save(data)
+        return [self._changed(record) if record else None for record in results]
+
+    def _set_ss_hashes(self, hashes):
+        with self._locked():
+            data = self._load()
+            for payment_id, (sha256, ss_path) in hashes.items():
+                if payment_id <= len(data):
+                    data[payment_id - 1].update(ss_hash=sha256, ss_path=ss_path)
+            self._save(data)
+
+    def get_by_id(self, payment_id):
+        data = self._load()
+        if 1 <= payment_id <= len(data):
+            return data[payment_id - 1]
+        return None
+
+    def get_by_ids(self, payment_ids):
+        data = self._load()
+        return {i: data[i - 1] for i in payment_ids if 1 <= i <= len(data)}
+
+    def page(self, status=None, user=None, since=None, until=None, before_id=None, limit=50):
+        return _filter_page(reversed(self._load()), status, user, since, until, before_id, limit)
+
+    def all(self):
+        return self._load()
+
+
+# -------------------------------------------------
+# LOG BACKEND
+# -------------------------------------------------
+LOG_COMPACT_BYTES = 4 * 1024 * 1024
+LOG_COMPACT_INTERVAL = 30
+
+
+def _fsync_dir(path):
+    # Makes a rename durable; not possible (or needed) on Windows
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _replace_atomically(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _fsync_dir(path)
+
+
+def _write_snapshot(path, records):
+    _replace_atomically(path, json.dumps(records, indent=4).encode())
+
+
+class LogPaymentStore(_Store):
+    """payments.json as a snapshot, plus an append-only log of changes since.
+
+    Every write appends one JSON line to payments.log ("add" with the new
+    record, "status" with the new status, "ss_hash" from the backfill) and
+    is acknowledged once an fsync covers it; concurrent writers share fsyncs. A crash can at worst leave a
+    torn last line, which is ignored and cut off by the next writer.
+
+    Each process keeps every record in memory and, before serving a read,
+    applies whatever other workers appended since (one stat, usually no
+    read). A background thread folds the log into a new payments.json
+    (temp file + rename) once it passes `compact_bytes`, then starts a new
+    log generation holding only the lines written meanwhile. Replaying a
+    line twice gives the same state, so a crash between the two renames
+    is harmless.
+    """
+
+    def __init__(self, json_file, log_file=None, fsync=True,
+                 compact_bytes=LOG_COMPACT_BYTES, compact_interval=LOG_COMPACT_INTERVAL):
+        super().__init__()
+        self.json_file = json_file
+        self.log_file = log_file or os.path.splitext(json_file)[0] + ".log"
+        self.fsync = fsync
+        self.compact_bytes = compact_bytes
+        self.compact_interval = compact_interval
+
+        self._lock = threading.RLock()
+        self._flock = forksafe.FileLock(self.log_file + ".lock")
+        self._compactor = forksafe.PerProcess(self._start_compactor)
+        self._log = None
+        self._sync_cond = threading.Condition()
+        self._written = 0   # batches appended by this process
+        self._synced = 0
+        self._syncing = False
+
+        with self._lock, self._flocked():
+            if not os.path.exists(self.log_file):
+                self._write_log(1, b"")
+            self._reload()
+
+    # -------------------------------------------------
+    # FILES + LOCKING
+    # -------------------------------------------------
+    def _flocked(self, exclusive=True):
+        """Cross-process lock on <log>.lock; re-entrant within the holder."""
+        return self._flock.held(exclusive)
+
+    def _write_log(self, generation, tail):
+        header = json.dumps({"log": generation}).encode() + b"\n"
+        _replace_atomically(self.log_file, header + tail)
+
+    def _open_log(self):
+        fd = os.open(self.log_file, os.O_RDWR | os.O_APPEND)
+        if self._log is not None:
+            os.close(self._log)
+        self._log = fd
+        self._ino = os.fstat(fd).st_ino
+        first = os.pread(fd, 256, 0)
+        header_end = first.index(b"\n") + 1
+        self._gen = json.loads(first[:header_end])["log"]
+        self._offset = header_end
+
+    def _reload(self):
+        with self._flocked(exclusive=False):
+            try:
+                with open(self.json_file, "r") as f:
+                    records = json.load(f)
+            except FileNotFoundError:
+                records = []
+            self._records = records
+            self._by_txn = {}
+            for i, entry in enumerate(records, 1):
+                entry["id"] = i
+                self._by_txn.setdefault(entry["txn_id"], entry)
+            self._open_log()
+            self._read_tail()
+
+    # -------------------------------------------------
+    # REPLAY
+    # -------------------------------------------------
+    def _apply(self, event):
+        if event["op"] == "add":
+            record = dict(event["record"])
+            # Already in the snapshot when a line is replayed after compaction
+            if record["id"] == len(self._records) + 1:
+                self._records.append(record)
+                self._by_txn.setdefault(record["txn_id"], record)
+        elif event["op"] == "status":
+            record = self._records[event["id"] - 1]
+            record["status"] = event["status"]
+            record["updated_at"] = event["updated_at"]
+        elif event["op"] == "ss_hash":
+            record = self._records[event["id"] - 1]
+            record["ss_hash"] = event["ss_hash"]
+            record["ss_path"] = event.get("ss_path", record.get("ss_path"))
+
+    def _read_tail(self):
+        size = os.fstat(self._log).st_size
+        if size <= self._offset:
+            return
+        data = os.pread(self._log, size - self._offset, self._offset)
+        # Only whole lines; a line still being written is picked up next time
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            if line:
+                self._apply(json.loads(line))
+        self._offset += end
+
+    def _catch_up(self):
+        """Apply what other workers appended. Caller holds self._lock."""
+        if os.stat(self.log_file).st_ino == self._ino:
+            self._read_tail()
+            return
+        # Compacted: nothing more goes into the old file, so finish it, then
+        # replay the new generation (it repeats lines we have; that's harmless)
+        self._read_tail()
+        generation = self._gen
+        self._open_log()
+        if self._gen != generation + 1:
+            # Missed a whole generation; start over from the snapshot
+            self._reload()
+        else:
+            self._read_tail()
+
+    # -------------------------------------------------
+    # WRITES
+    # -------------------------------------------------
+    def _append(self, events):
+        """Append + apply events. Caller holds self._lock and the exclusive flock."""
+        size = os.fstat(self._log).st_size
+        if size > self._offset:
+            # Torn last line from a writer that crashed mid-write
+            os.ftruncate(self._log, self._offset)
+        data = b"".join(json.dumps(e, separators=(",", ":")).encode() + b"\n" for e in events)
+        os.write(self._log, data)
+        self._offset += len(data)
+        for event in events:
+            self._apply(event)
+        self._written += 1
+        return self._written, os.dup(self._log)
+
+    def _sync(self, ticket, fd):
+        """Group commit: wait until an fsync has covered this process's batch `ticket`."""
+        try:
+            with self._sync_cond:
+                while self.fsync and self._synced < ticket:
+                    if self._syncing:
+                        self._sync_cond.wait()
+                        continue
+                    self._syncing = True
+                    target = self._written
+                    self._sync_cond.release()
+                    try:
+                        cooperative.run_blocking(os.fsync, fd)
+                    finally:
+                        self._sync_cond.acquire()
+                        self._syncing = False
+                        self._sync_cond.notify_all()
+                    self._synced = max(self._synced, target)
+        finally:
+            os.close(fd)
+
+    def _set_statuses(self, changes):
+        now = time.time()
+        with self._lock, self._flocked():
+            self._catch_up()
+            events, ids, pending = [], [], {}
+            for txn_id, status, expected in changes:
+                record = self._by_txn.get(txn_id)
+                current = pending.get(txn_id, record["status"] if record else None)
+                if record is None or current != expected:
+                    ids.append(None)
+                    continue
+                pending[txn_id] = status
+                events.append({"op": "status", "id": record["id"], "status": status, "updated_at": now})
+                ids.append(record["id"])
+            if not events:
+                return ids
+            ticket, fd = self._append(events)
+            results = [dict(self._records[i - 1]) if i else None for i in ids]
+        self._sync(ticket, fd)
+        self._ensure_compactor()
+        return [self._changed(record) if record else None for record in results]
+
+    def add(self, user, txn_id, ss_path, ss_hash=None):
+        with self._lock, self._flocked():
+            self._catch_up()
+            if txn_id in self._by_txn:
+                return None
+            record = {"user": user, "txn_id": txn_id, "status": "pending", "ss_path": ss_path,
+                      "ss_hash": ss_hash, "created_at": time.time(), "id": len(self._records) + 1}
+            ticket, fd = self._append([{"op": "add", "record": record}])
+        self._sync(ticket, fd)
+        self._ensure_compactor()
+        return self._changed(dict(record))
+
+    def set_status(self, txn_id, status, expected="pending"):
+        return self._set_statuses([(txn_id, status, expected)])[0]
+
+    def _set_ss_hashes(self, hashes):
+        with self._lock, self._flocked():
+            self._catch_up()
+            events = [{"op": "ss_hash", "id": payment_id, "ss_hash": sha256, "ss_path": ss_path}
+                      for payment_id, (sha256, ss_path) in hashes.items() if payment_id <= len(self._records)]
+            ticket, fd = self._append(events)
+        self._sync(ticket, fd)
+
+    def set_status_many(self, changes):
+        return self._set_statuses(changes)
+
+    # -------------------------------------------------
+    # READS
+    # -------------------------------------------------
+    def get(self, txn_id):
+        with self._lock:
+            self._catch_up()
+            entry = self._by_txn.get(txn_id)
+            return dict(entry) if entry else None
+
+    def get_many(self, txn_ids):
+        with self._lock:
+            self._catch_up()
+            return {t: dict(self._by_txn[t]) for t in set(txn_ids) if t in self._by_txn}
+
+    def get_by_id(self, payment_id):
+        with self._lock:
+            self._catch_up()
+            if 1 <= payment_id <= len(self._records):
+                return dict(self._records[payment_id - 1])
+            return None
+
+    def get_by_ids(self, payment_ids):
+        with self._lock:
+            self._catch_up()
+            count = len(self._records)
+            return {i: dict(self._records[i - 1]) for i in payment_ids if 1 <= i <= count}
+
+    def page(self, status=None, user=None, since=None, until=None, before_id=None, limit=50):
+        with self._lock:
+            self._catch_up()
+            items = _filter_page(reversed(self._records), status, user, since, until, before_id, limit)
+            return [dict(entry) for entry in items]
+
+    def all(self):
+        with self._lock:
+            self._catch_up()
+            return [dict(entry) for entry in self._records]
+
+    # -------------------------------------------------
+    # COMPACTION
+    # -------------------------------------------------
+    def _ensure_compactor(self):
+        self._compactor.get()
+
+    def _start_compactor(self):
+        thread = threading.Thread(target=self._compact_loop, name="payment-log-compactor", daemon=True)
+        thread.start()
+        return thread
+
+    def _compact_loop(self):
+        while True:
+            time.sleep(self.compact_interval)
+            try:
+                if os.path.getsize(self.log_file) >= self.compact_bytes:
+                    self.compact()
+            except Exception as e:
+                print(f"Payment log compaction error: {e}")
+
+    def compact(self):
+        """Write a new payments.json snapshot and start a new, short log."""
+        with open(self.log_file + ".compact", "w") as election:
+            # One worker compacts; the others see the new generation on their next read
+            if fcntl:
+                try:
+                    fcntl.flock(election, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return False
+
+            with self._lock, self._flocked():
+                self._catch_up()
+                snapshot = [dict(entry) for entry in self._records]
+                offset, generation = self._offset, self._gen
+
+            # The slow part runs without the log lock, so writers keep going
+            started = time.monotonic()
+            cooperative.run_blocking(_write_snapshot, self.json_file, snapshot)
+
+            with self._lock, self._flocked():
+                self._catch_up()
+                if self._gen != generation:
+                    return False
+                tail = os.pread(self._log, self._offset - offset, offset)
+                self._write_log(generation + 1, tail)
+                self._open_log()
+                self._offset += len(tail)
+
+        print(f"Compacted payment log: {len(snapshot)} records in {time.monotonic() - started:.2f}s")
+        return True
+
+
+def open_store(kind="sqlite", db_file=None, json_file="payments.json"):
+    if kind == "json":
+        return JsonPaymentStore(json_file)
+    if kind == "log":
+        return LogPaymentStore(json_file)
+    if kind == "sqlite":
+        return SqlitePaymentStore(db_file, json_file=json_file)
+    raise ValueError(f"Unknown payment store: {kind}")
@@ -0,0 +1,113 @@
+"""
+Opt-in sampling profiler for slow requests.
+
+PROFILE_SLOW_MS=500 turns it on. While a request runs, a background thread
+samples its Python stack every PROFILE_INTERVAL_MS (default 5). When a
+request ends up slower than the threshold, its samples are written to
+PROFILE_DIR as folded stacks ("outer;inner;innermost count" per line),
+which flamegraph.pl and speedscope read directly.
+
+Under gevent the sampler is a real OS thread, so it keeps sampling while a
+request hogs the CPU, and a request parked on I/O shows the stack it is
+waiting in.
+"""
+import _thread
+import os
+import re
+import sys
+import time
+from collections import Counter
+
+import cooperative
+import forksafe
+
+try:
+    import greenlet
+except ImportError:
+    greenlet = None
+
+MAX_PROFILES = 200
+MAX_DEPTH = 128
+
+
+def _folded(frame):
+    stack = []
+    while frame is not None and len(stack) < MAX_DEPTH:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+class SlowRequestProfiler:
+    def __init__(self, folder, slow_ms, interval_ms=5):
+        self.folder = folder
+        self.slow_ms = slow_ms
+        self.interval = interval_ms / 1000
+        self._active = {}   # token -> (greenlet or None, thread ident, Counter)
+        self._sampler = forksafe.PerProcess(self._start_sampler)
+
+    @property
+    def enabled(self):
+        return self.slow_ms > 0
+
+    def _start_sampler(self):
+        self._active = {}
+        # The sampler must not be a greenlet, or it only runs when requests yield
+        return cooperative.original("_thread", "start_new_thread", _thread.start_new_thread)(self._sample_loop, ())
+
+    def _sample_loop(self):
+        sleep = cooperative.original("time", "sleep", time.sleep)
+        while True:
+            sleep(self.interval)
+            if not self._active:
+                continue
+            frames = sys._current_frames()
+            for glet, ident, samples in list(self._active.values()):
+                # A parked greenlet has its own frame; the running one is the thread's
+                frame = glet.gr_frame if glet is not None else None
+                if frame is None:
+                    frame = frames.get(ident)
+                if frame is not None:
+                    samples[_folded(frame)] += 1
+
+    def begin(self):
+        """Start sampling the current request. Returns a token for end()."""
+        if not self.enabled:
+            return None
+        self._sampler.get()
+        glet = None
+        if greenlet is not None and cooperative.patched():
+            glet = greenlet.getcurrent()
+        token = object()
+        # OS thread id, as used by sys._current_frames (gevent patches get_ident)
+        ident = cooperative.original("_thread", "get_ident", _thread.get_ident)()
+        self._active[token] = (glet, ident, Counter())
+        return token
+
+    def end(self, token, route, seconds):
+        if token is None:
+            return
+        entry = self._active.pop(token, None)
+        if entry is None or seconds * 1000 < self.slow_ms or not entry[2]:
+            return
+        try:
+            self._write(route, seconds, entry[2])
+        except OSError as e:
+            print(f"Profiler write error: {e}")
+
+    def _write(self, route, seconds, samples):
+        os.makedirs(self.folder, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{int(seconds * 1000)}ms-{slug}-{os.getpid()}.folded"
+        with open(os.path.join(self.folder, name), "w") as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+        # Keep the newest profiles only
+        files = sorted(n for n in os.listdir(self.folder) if n.endswith(".folded"))
+        for old in files[:-MAX_PROFILES]:
+            try:
+                os.remove(os.path.join(self.folder, old))
+            except FileNotFoundError:
+                pass
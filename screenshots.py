@@ -0,0 +1,215 @@
+"""
+Payment screenshot ingestion.
+
+Uploads are streamed to disk while being hashed, and stored once per
+SHA-256 under payment_ss/blobs/. A screenshot that was already submitted
+for another txn_id is detected by its hash, which is worth flagging to the
+admin. A small thread pool then writes a recompressed JPEG (what Telegram
+receives) and a WebP thumbnail (what the admin panel shows).
+
+Pillow is optional: without it the original blob is used everywhere.
+"""
+import hashlib
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cooperative
+import db
+import forksafe
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS screenshots (
+    sha256 TEXT PRIMARY KEY,
+    blob_path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    compact_path TEXT,
+    thumb_path TEXT,
+    created_at REAL
+);
+CREATE TABLE IF NOT EXISTS screenshot_refs (
+    txn_id TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS screenshot_refs_sha256 ON screenshot_refs (sha256);
+"""
+
+READ_SIZE = 256 * 1024
+COMPACT_MAX_SIDE = 1600
+COMPACT_QUALITY = 82
+THUMB_MAX_SIDE = 320
+
+
+def _sniff_ext(head):
+    if head.startswith(b"\x89PNG"):
+        return ".png"
+    if head.startswith(b"\xff\xd8"):
+        return ".jpg"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    return ".png"
+
+
+class ScreenshotStore:
+    def __init__(self, folder, db_file=None, workers=2):
+        self.folder = folder
+        self.blob_folder = os.path.join(folder, "blobs")
+        self.db_file = db_file
+        self.workers = workers
+        self._pool = forksafe.PerProcess(
+            lambda: ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="screenshot")
+        )
+        os.makedirs(self.blob_folder, exist_ok=True)
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        return db.get_connection(self.db_file)
+
+    def ingest(self, stream, txn_id):
+        """Store an uploaded screenshot. Returns (sha256, blob_path, other txn_ids with the same image).
+
+        The txn_id is not linked to the image until `link()` is called, once
+        the payment itself has been saved.
+        """
+        digest = hashlib.sha256()
+        # Never put request data in a path: the name is chosen by mkstemp
+        fd, tmp_path = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=self.blob_folder)
+        head = b""
+        size = 0
+        with os.fdopen(fd, "wb") as out:
+            for buf in iter(lambda: stream.read(READ_SIZE), b""):
+                if not head:
+                    head = buf[:16]
+                digest.update(buf)
+                out.write(buf)
+                size += len(buf)
+        sha256 = digest.hexdigest()
+
+        conn = self._conn()
+        row = conn.execute("SELECT blob_path FROM screenshots WHERE sha256 = ?", (sha256,)).fetchone()
+        if row and os.path.exists(row["blob_path"]):
+            os.remove(tmp_path)
+            blob_path = row["blob_path"]
+        else:
+            blob_path = os.path.join(self.blob_folder, sha256 + _sniff_ext(head))
+            os.replace(tmp_path, blob_path)
+            conn.execute(
+                "INSERT OR REPLACE INTO screenshots (sha256, blob_path, size, created_at) VALUES (?, ?, ?, ?)",
+                (sha256, blob_path, size, time.time()),
+            )
+
+        seen = [r["txn_id"] for r in conn.execute(
+            "SELECT txn_id FROM screenshot_refs WHERE sha256 = ? AND txn_id != ?", (sha256, txn_id)
+        )]
+        return sha256, blob_path, seen
+
+    def link(self, txn_id, sha256):
+        """Record that txn_id was submitted with this image (counted by use_counts)."""
+        self._conn().execute("INSERT OR REPLACE INTO screenshot_refs (txn_id, sha256) VALUES (?, ?)",
+                             (txn_id, sha256))
+
+    def adopt(self, txn_id, path):
+        """Hash and link a screenshot saved before blobs existed.
+
+        The file stays where it is and becomes the blob for its hash, unless
+        the same image is already stored. Returns (sha256, path of the stored
+        image), or None if the file is gone.
+        """
+        digest = hashlib.sha256()
+        try:
+            with open(path, "rb") as f:
+                for buf in iter(lambda: f.read(READ_SIZE), b""):
+                    digest.update(buf)
+                st = os.fstat(f.fileno())
+        except (FileNotFoundError, IsADirectoryError):
+            return None
+        sha256 = digest.hexdigest()
+
+        conn = self._conn()
+        row = conn.execute("SELECT blob_path FROM screenshots WHERE sha256 = ?", (sha256,)).fetchone()
+        if row and os.path.exists(row["blob_path"]):
+            blob_path = row["blob_path"]
+        else:
+            blob_path = path
+            conn.execute(
+                "INSERT OR REPLACE INTO screenshots (sha256, blob_path, size, created_at) VALUES (?, ?, ?, ?)",
+                (sha256, path, st.st_size, st.st_mtime),
+            )
+        self.link(txn_id, sha256)
+        return sha256, blob_path
+
+    def discard(self, paths):
+        """Delete duplicate screenshot files that no payment points to any more."""
+        conn = self._conn()
+        removed = 0
+        for path in set(paths):
+            if conn.execute("SELECT 1 FROM screenshots WHERE blob_path = ?", (path,)).fetchone():
+                continue
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def process_async(self, sha256, then=None):
+        """Build the compact and thumbnail versions in the pool, then call then(info)."""
+        def run():
+            try:
+                info = cooperative.run_blocking(self.process, sha256)
+            except Exception as e:
+                print(f"Screenshot processing error: {e}")
+                info = self.info(sha256)
+            if then:
+                then(info)
+
+        self._pool.get().submit(run)
+
+    def process(self, sha256):
+        info = self.info(sha256)
+        if Image is None or info is None or info["compact_path"]:
+            return info
+
+        base = os.path.join(self.blob_folder, sha256)
+        with Image.open(info["blob_path"]) as im:
+            im = ImageOps.exif_transpose(im).convert("RGB")
+            compact = im.copy()
+            compact.thumbnail((COMPACT_MAX_SIDE, COMPACT_MAX_SIDE))
+            compact.save(base + ".compact.jpg", "JPEG", quality=COMPACT_QUALITY, optimize=True, progressive=True)
+            im.thumbnail((THUMB_MAX_SIDE, THUMB_MAX_SIDE))
+            im.save(base + ".thumb.webp", "WEBP", quality=70, method=4)
+
+        self._conn().execute(
+            "UPDATE screenshots SET compact_path = ?, thumb_path = ? WHERE sha256 = ?",
+            (base + ".compact.jpg", base + ".thumb.webp", sha256),
+        )
+        return self.info(sha256)
+
+    def info(self, sha256):
+        row = self._conn().execute("SELECT * FROM screenshots WHERE sha256 = ?", (sha256,)).fetchone()
+        return dict(row) if row else None
+
+    def info_many(self, hashes):
+        hashes = [h for h in set(hashes) if h]
+        if not hashes:
+            return {}
+        marks = ",".join("?" * len(hashes))
+        rows = self._conn().execute(f"SELECT * FROM screenshots WHERE sha256 IN ({marks})", hashes)
+        return {r["sha256"]: dict(r) for r in rows}
+
+    def use_counts(self, hashes):
+        """How many txn_ids submitted each image."""
+        hashes = [h for h in set(hashes) if h]
+        if not hashes:
+            return {}
+        marks = ",".join("?" * len(hashes))
+        rows = self._conn().execute(
+            f"SELECT sha256, COUNT(*) AS n FROM screenshot_refs WHERE sha256 IN ({marks}) GROUP BY sha256", hashes
+        )
+        return {r["sha256"]: r["n"] for r in rows}
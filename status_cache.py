@@ -0,0 +1,91 @@
+"""
+Read-through txn_id -> status cache for the /check_approval polling path.
+
+Gunicorn workers share a generation counter kept in a small mmap'd file.
+Every payment write bumps it; a cached status is only trusted while the
+generation it was read under is still current. When nothing has changed a
+lookup is a dict hit plus one read from shared memory, with no disk I/O.
+"""
+import mmap
+import os
+import struct
+import threading
+
+import forksafe
+
+_COUNTER = struct.Struct("<Q")
+
+
+class Generation:
+    """Cross-process change counter backed by an 8-byte mmap'd file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < _COUNTER.size:
+                os.ftruncate(fd, _COUNTER.size)
+            self._map = mmap.mmap(fd, _COUNTER.size)
+        finally:
+            os.close(fd)
+        self._flock = forksafe.FileLock(path)
+
+    def value(self):
+        return _COUNTER.unpack_from(self._map, 0)[0]
+
+    def bump(self):
+        with self._lock, self._flock.held():
+            value = self.value() + 1
+            _COUNTER.pack_into(self._map, 0, value)
+        return value
+
+
+class StatusCache:
+    MAX_ENTRIES = 50000
+
+    def __init__(self, store, generation):
+        self.store = store
+        self.generation = generation
+        self._entries = {}
+        # Any committed write invalidates every worker's cache
+        store.listeners.append(self.invalidate)
+
+    def get_status(self, txn_id):
+        """Current status for txn_id, or None if there is no such payment."""
+        # Read the generation *before* the store so a write that lands in
+        # between leaves the entry stale instead of wrongly fresh
+        gen = self.generation.value()
+        hit = self._entries.get(txn_id)
+        if hit is not None and hit[0] == gen:
+            return hit[1]
+
+        entry = self.store.get(txn_id)
+        status = entry["status"] if entry else None
+        if len(self._entries) >= self.MAX_ENTRIES:
+            self._entries.clear()
+        self._entries[txn_id] = (gen, status)
+        return status
+
+    def get_statuses(self, txn_ids):
+        """{txn_id: status or None}; whatever isn't cached is read in one query."""
+        gen = self.generation.value()
+        result, missing = {}, []
+        for txn_id in txn_ids:
+            hit = self._entries.get(txn_id)
+            if hit is not None and hit[0] == gen:
+                result[txn_id] = hit[1]
+            else:
+                missing.append(txn_id)
+        if missing:
+            found = self.store.get_many(missing)
+            if len(self._entries) + len(missing) > self.MAX_ENTRIES:
+                self._entries.clear()
+            for txn_id in missing:
+                entry = found.get(txn_id)
+                result[txn_id] = entry["status"] if entry else None
+                self._entries[txn_id] = (gen, result[txn_id])
+        return result
+
+    def invalidate(self, record=None):
+        self.generation.bump()
@@ -0,0 +1,337 @@
+"""
+Background sender for outbound Telegram Bot API calls.
+
+HTTP handlers call `dispatcher.send(method, payload)`, which writes the call
+to an outbox table and returns. Worker threads drain a bounded in-memory
+queue over one keep-alive session, respect a per-chat and a global send
+rate, and retry 429/5xx/network failures with exponential backoff.
+Callback answers (the spinner on an admin's button) get their own queue and
+sender, so they never wait behind throttled messages. Given `buckets` (the
+admission file), the send rates are shared by all gunicorn workers.
+
+Rows stay in the outbox until Telegram accepts them, so queued messages
+survive a restart: a sweeper thread picks up rows whose lease has expired
+(left behind by a dead process, or skipped because the queue was full).
+A lease names its owner process. The owner renews the leases of rows it
+still holds in memory, and claims the row again (compare-and-set on owner
+and lease) right before sending, so a row another worker took over is
+skipped instead of sent twice.
+"""
+import heapq
+import json
+import queue
+import random
+import threading
+import time
+import uuid
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import admission
+import db
+import forksafe
+import metrics
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS telegram_outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    method TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    photo_path TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_until REAL NOT NULL,
+    last_error TEXT,
+    dead INTEGER NOT NULL DEFAULT 0,
+    created_at REAL
+);
+CREATE INDEX IF NOT EXISTS telegram_outbox_lease ON telegram_outbox (dead, lease_until);
+"""
+
+# Columns added after the first release, for outboxes created before them
+ADDED_COLUMNS = {
+    "owner": "TEXT",
+}
+
+LEASE_SECONDS = 120      # longer than one send incl. timeouts
+MAX_ATTEMPTS = 8
+MAX_BACKOFF = 300
+PER_CHAT_INTERVAL = 1.0  # Telegram allows about one message per second per chat
+GLOBAL_PER_SECOND = 25   # stay under the ~30/s bot-wide limit
+PRIORITY_METHODS = {"answerCallbackQuery"}
+
+
+class RateLimiter:
+    """Spaces out sends per chat and overall. Per process."""
+
+    def __init__(self, per_chat_interval, global_per_second):
+        self.per_chat_interval = per_chat_interval
+        self.global_interval = 1.0 / global_per_second
+        self._lock = threading.Lock()
+        self._next_chat = {}
+        self._next_global = 0.0
+
+    def wait(self, chat_id):
+        with self._lock:
+            now = time.monotonic()
+            at = max(now, self._next_global)
+            if chat_id is not None:
+                at = max(at, self._next_chat.get(chat_id, 0.0))
+                self._next_chat[chat_id] = at + self.per_chat_interval
+            self._next_global = at + self.global_interval
+        if at > now:
+            time.sleep(at - now)
+
+
+class SharedRateLimiter:
+    """Same limits as RateLimiter, in SharedBuckets, so they hold across workers."""
+
+    def __init__(self, buckets, per_chat_interval, global_per_second):
+        self.buckets = buckets
+        self.per_chat = admission.Limit(1.0 / per_chat_interval, 1)
+        self.overall = admission.Limit(global_per_second, global_per_second)
+
+    def _take(self, key, limit):
+        while True:
+            allowed, wait = self.buckets.take(key, limit)
+            if allowed:
+                return
+            time.sleep(wait)
+
+    def wait(self, chat_id):
+        if chat_id is not None:
+            self._take(f"telegram|chat|{chat_id}", self.per_chat)
+        self._take("telegram|global", self.overall)
+
+
+class TelegramDispatcher:
+    def __init__(self, bot_token, api_url="https://api.telegram.org", db_file=None,
+                 workers=2, max_queue=1000, buckets=None):
+        self.base_url = f"{api_url}/bot{bot_token}"
+        self._token = bot_token
+        self.db_file = db_file
+        self.workers = workers
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._urgent = queue.Queue(maxsize=max_queue)
+        self._delayed = []
+        self._delayed_lock = threading.Lock()
+        if buckets is not None:
+            self._limiter = SharedRateLimiter(buckets, PER_CHAT_INTERVAL, GLOBAL_PER_SECOND)
+        else:
+            self._limiter = RateLimiter(PER_CHAT_INTERVAL, GLOBAL_PER_SECOND)
+        self._held = {}   # row_id -> lease_until this process holds it under
+        self._held_lock = threading.Lock()
+        self._owner = forksafe.PerProcess(lambda: uuid.uuid4().hex)
+        self._senders = forksafe.PerProcess(self._start_senders)
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        existing = {r["name"] for r in conn.execute("PRAGMA table_info(telegram_outbox)")}
+        for column, kind in ADDED_COLUMNS.items():
+            if column not in existing:
+                conn.execute(f"ALTER TABLE telegram_outbox ADD COLUMN {column} {kind}")
+
+    def _conn(self):
+        return db.get_connection(self.db_file)
+
+    def _redact(self, error):
+        # requests puts the whole URL, bot token included, in its messages
+        return str(error).replace(f"bot{self._token}", "bot<token>") if self._token else str(error)
+
+    def _session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers + 1)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    # -------------------------------------------------
+    # PRODUCER SIDE
+    # -------------------------------------------------
+    def send(self, method, payload, photo_path=None):
+        """Queue a Bot API call. Never blocks on the network."""
+        now = time.time()
+        lease = now + LEASE_SECONDS
+        cur = self._conn().execute(
+            "INSERT INTO telegram_outbox (method, payload, photo_path, lease_until, owner, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (method, json.dumps(payload), photo_path, lease, self._owner.get(), now),
+        )
+        self.start()
+        self._enqueue(cur.lastrowid, method, lease)
+
+    def backlog(self):
+        """(queued, dead) row counts in the outbox."""
+        row = self._conn().execute(
+            "SELECT COALESCE(SUM(dead = 0), 0) AS queued, COALESCE(SUM(dead = 1), 0) AS dead FROM telegram_outbox"
+        ).fetchone()
+        return row["queued"], row["dead"]
+
+    def start(self):
+        self._senders.get()
+
+    def _start_senders(self):
+        self._queue = queue.Queue(maxsize=self._queue.maxsize)
+        self._urgent = queue.Queue(maxsize=self._urgent.maxsize)
+        self._delayed = []
+        self._held = {}
+        self.session = self._session()
+        threads = [threading.Thread(target=self._work, args=(self._queue,), name=f"telegram-{i}", daemon=True)
+                   for i in range(self.workers)]
+        threads.append(threading.Thread(target=self._work, args=(self._urgent,), name="telegram-urgent", daemon=True))
+        threads.append(threading.Thread(target=self._schedule, name="telegram-scheduler", daemon=True))
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def connect(self):
+        """Start the senders and open the keep-alive connection before the first message.
+
+        Call it in each worker after the fork: a socket shared by two
+        processes would interleave their requests.
+        """
+        self.start()
+        threading.Thread(target=self._preconnect, name="telegram-connect", daemon=True).start()
+
+    def _preconnect(self):
+        try:
+            with metrics.span("telegram", "getMe"):
+                self.session.get(f"{self.base_url}/getMe", timeout=(5, 10))
+        except (requests.RequestException, OSError) as e:
+            print(f"Telegram warm-up failed: {self._redact(e)}")
+
+    # -------------------------------------------------
+    # CONSUMER SIDE
+    # -------------------------------------------------
+    def _schedule(self):
+        last_sweep = 0.0
+        while True:
+            now = time.time()
+            with self._delayed_lock:
+                while self._delayed and self._delayed[0][0] <= now:
+                    _, row_id, method = heapq.heappop(self._delayed)
+                    self._enqueue(row_id, method)
+            if now - last_sweep >= 5:
+                last_sweep = now
+                self._renew(now)
+                self._sweep(now)
+            time.sleep(0.5)
+
+    def _lease(self, row_id, lease):
+        """Move our lease on row_id to `lease` (0 hands it back). False if it isn't ours any more."""
+        with self._held_lock:
+            held = self._held.pop(row_id, None)
+            if held is None:
+                return False
+            moved = self._conn().execute(
+                "UPDATE telegram_outbox SET lease_until = ? WHERE id = ? AND owner = ? AND lease_until = ?",
+                (lease, row_id, self._owner.get(), held),
+            ).rowcount
+            if moved and lease:
+                self._held[row_id] = lease
+        return bool(moved)
+
+    def _enqueue(self, row_id, method, lease=None):
+        with self._held_lock:
+            if lease is not None:
+                self._held[row_id] = lease
+            elif row_id not in self._held:
+                return
+        lane = self._urgent if method in PRIORITY_METHODS else self._queue
+        try:
+            lane.put_nowait(row_id)
+        except queue.Full:
+            # Hand it to the sweeper instead of blocking
+            self._lease(row_id, 0)
+
+    def _renew(self, now):
+        """Keep the leases of rows still waiting in our queues (or for a retry) from expiring."""
+        with self._held_lock:
+            expiring = [row_id for row_id, lease in self._held.items() if lease - now < LEASE_SECONDS / 2]
+        for row_id in expiring:
+            self._lease(row_id, now + LEASE_SECONDS)
+
+    def _sweep(self, now):
+        """Claim orphaned rows (expired lease) and queue them."""
+        conn = self._conn()
+        rows = conn.execute(
+            "SELECT id, method, lease_until FROM telegram_outbox WHERE dead = 0 AND lease_until < ? ORDER BY id LIMIT ?",
+            (now, max(1, self._queue.maxsize - self._queue.qsize())),
+        ).fetchall()
+        for row in rows:
+            lease = now + LEASE_SECONDS
+            claimed = conn.execute(
+                "UPDATE telegram_outbox SET lease_until = ?, owner = ? WHERE id = ? AND lease_until = ?",
+                (lease, self._owner.get(), row["id"], row["lease_until"]),
+            ).rowcount
+            if claimed:
+                self._enqueue(row["id"], row["method"], lease)
+
+    def _work(self, lane):
+        while True:
+            row_id = lane.get()
+            try:
+                self._deliver(row_id)
+            except Exception as e:
+                print(f"Telegram dispatch error: {self._redact(e)}")
+
+    def _deliver(self, row_id):
+        conn = self._conn()
+        row = conn.execute("SELECT * FROM telegram_outbox WHERE id = ?", (row_id,)).fetchone()
+        if row is None or row["dead"]:
+            with self._held_lock:
+                self._held.pop(row_id, None)
+            return
+
+        payload = json.loads(row["payload"])
+        self._limiter.wait(payload.get("chat_id"))
+        # The wait can outlast the lease; send only if the row is still ours
+        if not self._lease(row_id, time.time() + LEASE_SECONDS):
+            return
+
+        retry_after = None
+        try:
+            resp = self._post(row["method"], payload, row["photo_path"])
+            status = resp.status_code
+            if status == 429:
+                retry_after = resp.json().get("parameters", {}).get("retry_after")
+            error = None if status < 400 else f"HTTP {status}: {resp.text[:200]}"
+        except (requests.RequestException, OSError) as e:
+            status, error = None, self._redact(e)
+
+        if error is None:
+            conn.execute("DELETE FROM telegram_outbox WHERE id = ?", (row_id,))
+            with self._held_lock:
+                self._held.pop(row_id, None)
+            return
+
+        attempts = row["attempts"] + 1
+        retryable = status is None or status == 429 or status >= 500
+        if not retryable or attempts >= MAX_ATTEMPTS:
+            print(f"Telegram {row['method']} dropped after {attempts} attempt(s): {error}")
+            conn.execute(
+                "UPDATE telegram_outbox SET attempts = ?, last_error = ?, dead = 1 WHERE id = ?",
+                (attempts, error, row_id),
+            )
+            with self._held_lock:
+                self._held.pop(row_id, None)
+            return
+
+        delay = retry_after or min(MAX_BACKOFF, 2 ** attempts) * random.uniform(0.5, 1.0)
+        due = time.time() + delay
+        conn.execute(
+            "UPDATE telegram_outbox SET attempts = ?, last_error = ?, lease_until = ? WHERE id = ?",
+            (attempts, error, due + LEASE_SECONDS, row_id),
+        )
+        with self._held_lock:
+            self._held[row_id] = due + LEASE_SECONDS
+        with self._delayed_lock:
+            heapq.heappush(self._delayed, (due, row_id, row["method"]))
+
+    def _post(self, method, payload, photo_path):
+        url = f"{self.base_url}/{method}"
+        timeout = (5, 30)
+        with metrics.span("telegram", method):
+            if photo_path:
+                with open(photo_path, "rb") as photo_file:
+                    return self.session.post(url, data=payload, files={"photo": photo_file}, timeout=timeout)
+            return self.session.post(url, json=payload, timeout=timeout)
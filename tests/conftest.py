@@ -0,0 +1,24 @@
+import importlib
+import os
+
+import pytest
+
+
+@pytest.fixture(scope="session")
+def app_module(tmp_path_factory):
+    """app.py imported (and run) in a scratch working directory, with Telegram pointed nowhere."""
+    workdir = tmp_path_factory.mktemp("app")
+    cwd = os.getcwd()
+    os.environ.update({
+        "BOT_TOKEN": "test-token",
+        "TELEGRAM_API_URL": "http://127.0.0.1:9",
+        "SECRET_KEY": "test-secret",
+    })
+    # app.py's folders are relative to the working directory, so stay there
+    os.chdir(workdir)
+    try:
+        module = importlib.import_module("app")
+        module.app.config["TESTING"] = True
+        yield module
+    finally:
+        os.chdir(cwd)
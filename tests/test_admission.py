@@ -0,0 +1,157 @@
+"""
+Tests for admission control: the shared token buckets and open-connection caps.
+
+    python -m pytest -q tests
+"""
+import pytest
+from flask import Flask, Response, request
+
+import admission
+
+
+@pytest.fixture
+def buckets(tmp_path):
+    return admission.SharedBuckets(str(tmp_path / "admission.buckets"), slots=64)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_700_000_000.0]
+    monkeypatch.setattr(admission.time, "time", lambda: now[0])
+    return now
+
+
+def test_bucket_allows_burst_then_refills(buckets, clock):
+    limit = admission.Limit(rate=2, burst=3)
+    assert [buckets.take("k", limit)[0] for _ in range(3)] == [True] * 3
+    allowed, wait = buckets.take("k", limit)
+    assert not allowed and wait == pytest.approx(0.5)
+
+    clock[0] += 0.5
+    assert buckets.take("k", limit)[0]
+    assert not buckets.take("k", limit)[0]
+
+    # Refills up to the burst, not beyond
+    clock[0] += 3600
+    assert [buckets.take("k", limit)[0] for _ in range(4)] == [True, True, True, False]
+
+
+def test_buckets_are_per_key_and_shared_through_the_file(buckets, tmp_path, clock):
+    limit = admission.Limit(rate=1, burst=1)
+    assert buckets.take("a", limit)[0]
+    assert buckets.take("b", limit)[0]
+    assert not buckets.take("a", limit)[0]
+
+    # Another worker maps the same file and sees the same buckets
+    other = admission.SharedBuckets(str(tmp_path / "admission.buckets"), slots=64)
+    assert not other.take("a", limit)[0]
+    clock[0] += 1
+    assert other.take("a", limit)[0]
+    assert not buckets.take("a", limit)[0]
+
+
+def test_full_table_reuses_the_stalest_slot(tmp_path, clock):
+    buckets = admission.SharedBuckets(str(tmp_path / "small.buckets"), slots=admission.PROBES)
+    limit = admission.Limit(rate=0.001, burst=1)
+    for i in range(admission.PROBES):
+        clock[0] += 1
+        assert buckets.take(f"key{i}", limit)[0]
+    # key0 was evicted by the newcomer and starts over with a full bucket
+    assert buckets.take("newcomer", limit)[0]
+    assert buckets.take("key0", limit)[0]
+    assert not buckets.take("key5", limit)[0]
+
+
+@pytest.fixture
+def gated(buckets):
+    app = Flask(__name__)
+    gate = admission.AdmissionControl(buckets, proxy_hops=1)
+    gate.limit("stream", open_per_ip=2)
+    gate.limit("broken", open_per_ip=1)
+    gate.limit("upload", max_bytes=100, per_ip=admission.Limit(rate=0.001, burst=3),
+               per_txn=admission.Limit(rate=0.001, burst=1))
+
+    @app.before_request
+    def admit():
+        return gate.check(request)
+
+    @app.after_request
+    def admit_done(response):
+        return gate.hand_off(request, response)
+
+    @app.teardown_request
+    def admit_teardown(exc=None):
+        gate.teardown(request)
+
+    @app.route("/stream")
+    def stream():
+        return Response(iter([b"a", b"b"]))
+
+    @app.route("/broken")
+    def broken():
+        raise RuntimeError("view failed")
+
+    @app.route("/upload", methods=["POST"])
+    def upload():
+        return "ok"
+
+    return app, gate
+
+
+def test_open_connections_are_capped_and_released_on_close(gated):
+    app, gate = gated
+    client = app.test_client()
+    first = client.get("/stream", buffered=False)
+    second = client.get("/stream", buffered=False)
+    assert first.status_code == second.status_code == 200
+
+    refused = client.get("/stream")
+    assert refused.status_code == 429
+    assert refused.headers["Retry-After"] == "5"
+
+    first.close()
+    third = client.get("/stream", buffered=False)
+    assert third.status_code == 200
+    second.close()
+    third.close()
+    assert gate._open == {}
+
+
+def test_open_slot_is_released_when_the_view_raises(gated):
+    app, gate = gated
+    client = app.test_client()
+    # Handled: the 500 response takes the slot over and gives it back when closed
+    client.get("/broken").close()
+    resp = client.get("/broken")
+    assert resp.status_code == 500   # not 429
+    resp.close()
+    assert gate._open == {}
+
+    # Propagated: no response ever takes the slot, teardown gives it back
+    app.config["PROPAGATE_EXCEPTIONS"] = True
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            client.get("/broken")
+    assert gate._open == {}
+
+
+def test_open_connections_are_counted_per_ip(gated):
+    app, _gate = gated
+    client = app.test_client()
+    held = [client.get("/stream", buffered=False, headers={"X-Forwarded-For": "10.0.0.1"})
+            for _ in range(2)]
+    assert client.get("/stream", headers={"X-Forwarded-For": "10.0.0.1"}).status_code == 429
+    assert client.get("/stream", headers={"X-Forwarded-For": "10.0.0.2"}).status_code == 200
+    for resp in held:
+        resp.close()
+
+
+def test_size_ip_and_txn_limits(gated):
+    app, _gate = gated
+    client = app.test_client()
+    assert client.post("/upload", data="x" * 200).status_code == 413
+    assert client.post("/upload", data={"txn_id": "t1"}).status_code == 200
+    resp = client.post("/upload", data={"txn_id": "t1"})
+    assert resp.status_code == 429 and resp.get_json()["error"] == "rate_limited"
+    assert client.post("/upload", data={"txn_id": "t2"}).status_code == 200
+    assert client.post("/upload", data={"txn_id": "t3"}).status_code == 429   # per-IP burst spent
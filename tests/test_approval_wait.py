@@ -0,0 +1,45 @@
+"""
+/wait_approval: the long poll the payment page falls back to without EventSource.
+"""
+import threading
+import time
+import uuid
+
+
+def wait(client, txn_id, status, timeout=5):
+    return client.post("/wait_approval", data={"txn_id": txn_id, "status": status, "timeout": timeout})
+
+
+def test_answers_at_once_when_the_status_already_differs(app_module):
+    txn_id = uuid.uuid4().hex
+    app_module.store.add("alice", txn_id, None)
+    client = app_module.app.test_client()
+    started = time.monotonic()
+    assert wait(client, txn_id, "").get_json() == {"status": "pending"}
+    assert wait(client, uuid.uuid4().hex, "pending").get_json() == {"status": "not_found"}
+    assert time.monotonic() - started < 1
+
+
+def test_wakes_when_the_payment_is_approved(app_module):
+    txn_id = uuid.uuid4().hex
+    app_module.store.add("alice", txn_id, None)
+    timer = threading.Timer(0.3, app_module.payments.transition, (txn_id, "approved", "admin"))
+    timer.start()
+    started = time.monotonic()
+    assert wait(app_module.app.test_client(), txn_id, "pending").get_json() == {"status": "approved"}
+    assert 0.2 < time.monotonic() - started < 3
+    timer.join()
+
+
+def test_times_out_with_the_unchanged_status(app_module):
+    txn_id = uuid.uuid4().hex
+    app_module.store.add("alice", txn_id, None)
+    started = time.monotonic()
+    assert wait(app_module.app.test_client(), txn_id, "pending", timeout="0.3").get_json() == {"status": "pending"}
+    assert time.monotonic() - started < 2
+
+
+def test_payment_page_falls_back_to_the_long_poll(app_module):
+    html = app_module.app.test_client().get("/").get_data(as_text=True)
+    assert "/wait_approval" in html
+    assert "/check_approval" not in html
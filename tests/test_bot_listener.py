@@ -0,0 +1,68 @@
+"""
+The listener commits a Telegram offset only past updates the app applied.
+"""
+import asyncio
+
+import pytest
+import requests
+
+import bot_listener
+
+
+def callback_update(update_id):
+    return {"update_id": update_id, "callback_query": {
+        "id": f"cb{update_id}", "data": "approve_t1",
+        "message": {"message_id": 1, "chat": {"id": 1}},
+    }}
+
+
+@pytest.fixture
+def forwarder(tmp_path, monkeypatch, app_module):
+    monkeypatch.setattr(bot_listener, "OFFSET_FILE", str(tmp_path / "offset.json"))
+    monkeypatch.setattr(bot_listener, "FORWARD_MODE", "http")
+
+    async def no_sleep(delay):
+        pass
+
+    monkeypatch.setattr(bot_listener.asyncio, "sleep", no_sleep)
+    forwarder = bot_listener.Forwarder()
+    client = app_module.app.test_client()
+
+    def post(url, json, timeout):
+        # The webhook, through the Flask test client
+        served = client.post("/telegram-update", json=json)
+        response = requests.Response()
+        response.status_code = served.status_code
+        response.url = url
+        return response
+
+    forwarder.session.post = post
+    return forwarder
+
+
+def test_failed_update_does_not_advance_the_offset(forwarder, app_module, monkeypatch):
+    offsets, calls = [], []
+
+    def handle(update):
+        offsets.append(forwarder.offset)
+        calls.append(update["update_id"])
+        if len(calls) < 3:
+            raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(app_module, "handle_telegram_update", handle)
+    forwarder.pending.add(41)
+    asyncio.run(forwarder.forward(callback_update(41)))
+
+    assert calls == [41, 41, 41]
+    assert offsets == [None, None, None]
+    assert forwarder.offset == 42
+    assert bot_listener.load_offset() == 42
+
+
+def test_webhook_reports_failure(app_module, monkeypatch):
+    def handle(update):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(app_module, "handle_telegram_update", handle)
+    response = app_module.app.test_client().post("/telegram-update", json=callback_update(1))
+    assert response.status_code == 500
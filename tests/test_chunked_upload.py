@@ -0,0 +1,154 @@
+"""
+Chunked uploads: finalize never checksums a file a chunk is still writing to.
+"""
+import hashlib
+import io
+import os
+import threading
+import time
+
+import pytest
+
+import chunked_upload
+from chunked_upload import READ_SIZE, UploadError
+
+
+@pytest.fixture
+def uploads(tmp_path):
+    (tmp_path / "dest").mkdir()
+    return chunked_upload.ChunkedUploads(str(tmp_path / "tmp"), str(tmp_path / "dest"))
+
+
+class SlowBody(io.RawIOBase):
+    """A request body that stalls on its first read, before any byte arrives, until released."""
+
+    def __init__(self, data):
+        self.data, self.pos = data, 0
+        self.reading = threading.Event()
+        self.release = threading.Event()
+
+    def read(self, n):
+        self.reading.set()
+        self.release.wait(5)
+        buf = self.data[self.pos:self.pos + n]
+        self.pos += len(buf)
+        return buf
+
+
+def start(uploads, data):
+    return uploads.init("clip.bin", len(data), sha256=hashlib.sha256(data).hexdigest(),
+                        chunk_size=READ_SIZE)["upload_id"]
+
+
+def put_all(uploads, upload_id, data):
+    for offset in range(0, len(data), READ_SIZE):
+        chunk = data[offset:offset + READ_SIZE]
+        uploads.put_chunk(upload_id, offset, io.BytesIO(chunk), len(chunk))
+
+
+def put_slowly(uploads, upload_id, chunk, errors):
+    body = SlowBody(chunk)
+
+    def run():
+        try:
+            uploads.put_chunk(upload_id, 0, body, len(chunk))
+        except UploadError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    body.reading.wait(5)
+    return body, thread
+
+
+def test_finalize_waits_for_a_chunk_in_progress(uploads):
+    data = os.urandom(READ_SIZE * 2)
+    upload_id = start(uploads, data)
+    put_all(uploads, upload_id, data)
+
+    # The client re-sends chunk 0 and calls finalize before it has finished
+    errors = []
+    body, thread = put_slowly(uploads, upload_id, data[:READ_SIZE], errors)
+    with pytest.raises(UploadError) as refused:
+        uploads.finalize(upload_id)
+    assert refused.value.status == 409
+    assert uploads.status(upload_id)["missing"] == []
+
+    body.release.set()
+    thread.join(5)
+    assert errors == []
+    assert uploads.finalize(upload_id)["sha256"] == hashlib.sha256(data).hexdigest()
+
+
+def test_stalled_writer_cannot_write_after_finalize(uploads):
+    data = os.urandom(READ_SIZE * 2)
+    upload_id = start(uploads, data)
+    put_all(uploads, upload_id, data)
+
+    errors = []
+    body, thread = put_slowly(uploads, upload_id, os.urandom(READ_SIZE), errors)
+    writing = os.path.join(uploads.tmp_folder, upload_id, "writing")
+    old = time.time() - chunked_upload.WRITE_STALL_SECONDS - 1
+    for name in os.listdir(writing):
+        os.utime(os.path.join(writing, name), (old, old))
+
+    result = uploads.finalize(upload_id)
+    body.release.set()
+    thread.join(5)
+
+    assert [e.status for e in errors] == [409]
+    with open(os.path.join(uploads.dest_folder, result["filename"]), "rb") as f:
+        assert hashlib.sha256(f.read()).hexdigest() == result["sha256"] == hashlib.sha256(data).hexdigest()
+
+
+def test_concurrent_finalize_gets_a_conflict(uploads):
+    data = os.urandom(READ_SIZE * 3)
+    upload_id = start(uploads, data)
+    put_all(uploads, upload_id, data)
+
+    outcomes = []
+
+    def finalize():
+        try:
+            outcomes.append(uploads.finalize(upload_id)["size"])
+        except UploadError as e:
+            outcomes.append(e.status)
+
+    threads = [threading.Thread(target=finalize) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # The losers see the claim (409), or the upload already gone (404); never a 500
+    assert outcomes.count(len(data)) == 1
+    assert set(outcomes) - {len(data)} <= {404, 409}
+
+
+@pytest.mark.parametrize("size, chunk_size", [("abc", READ_SIZE), (None, READ_SIZE), (True, READ_SIZE),
+                                              (10, "x"), (10, [1]), (0, READ_SIZE)])
+def test_bad_sizes_are_client_errors(uploads, size, chunk_size):
+    with pytest.raises(UploadError) as error:
+        uploads.init("clip.bin", size, chunk_size=chunk_size)
+    assert error.value.status == 400
+
+
+def test_cleanup_keeps_uploads_still_receiving_chunks(uploads):
+    data = os.urandom(READ_SIZE * 2)
+    upload_id = start(uploads, data)
+    path = os.path.join(uploads.tmp_folder, upload_id)
+    old = time.time() - chunked_upload.STALE_SECONDS - 1
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            os.utime(os.path.join(root, name), (old, old))
+    os.utime(path, (old, old))
+
+    put_all(uploads, upload_id, data[:READ_SIZE])
+    os.utime(os.path.join(path, "data"), (old, old))
+    os.utime(path, (old, old))
+    uploads.cleanup_stale()
+    assert os.path.isdir(path)
+
+    for name in os.listdir(os.path.join(path, "chunks")):
+        os.utime(os.path.join(path, "chunks", name), (old, old))
+    uploads.cleanup_stale()
+    assert not os.path.isdir(path)
@@ -0,0 +1,136 @@
+"""
+Tests for media serving: byte ranges and conditional requests.
+
+    python -m pytest -q tests
+"""
+import os
+
+import pytest
+from flask import Flask, request
+from werkzeug.http import http_date
+
+import media
+
+DATA = bytes(range(256)) * 4   # 1024 bytes
+
+
+@pytest.fixture
+def client(tmp_path):
+    folder = tmp_path / "media"
+    folder.mkdir()
+    (folder / "clip.mp4").write_bytes(DATA)
+    os.utime(folder / "clip.mp4", (1_700_000_000, 1_700_000_000))
+    files = media.MediaFiles(str(folder), db_file=str(tmp_path / "app.db"))
+    files.record_hash("clip.mp4")
+
+    app = Flask(__name__)
+
+    @app.route("/media/<name>")
+    def serve(name):
+        return files.response(name, request)
+
+    return app.test_client()
+
+
+def get(client, **headers):
+    return client.get("/media/clip.mp4", headers=headers)
+
+
+def test_full_body(client):
+    resp = get(client)
+    assert resp.status_code == 200
+    assert resp.data == DATA
+    assert resp.headers["Accept-Ranges"] == "bytes"
+    assert resp.headers["Content-Type"] == "video/mp4"
+
+
+@pytest.mark.parametrize("header,start,stop", [
+    ("bytes=0-99", 0, 100),
+    ("bytes=1000-", 1000, 1024),
+    ("bytes=-24", 1000, 1024),
+    ("bytes=1000-5000", 1000, 1024),   # clamped to the end of the file
+    ("bytes=-5000", 0, 1024),
+])
+def test_single_range(client, header, start, stop):
+    resp = get(client, Range=header)
+    assert resp.status_code == 206
+    assert resp.data == DATA[start:stop]
+    assert resp.headers["Content-Range"] == f"bytes {start}-{stop - 1}/1024"
+    assert resp.content_length == stop - start
+
+
+def test_multiple_ranges(client):
+    resp = get(client, Range="bytes=0-9,500-509,-5")
+    assert resp.status_code == 206
+    assert resp.mimetype == "multipart/byteranges"
+    boundary = resp.mimetype_params["boundary"].encode()
+    assert len(resp.data) == resp.content_length
+
+    parts = resp.data.split(b"--" + boundary)
+    assert parts[0] == b"\r\n" and parts[-1] == b"--\r\n"
+    bodies = []
+    for part in parts[1:-1]:
+        head, body = part.split(b"\r\n\r\n", 1)
+        assert b"Content-Type: video/mp4" in head
+        bodies.append((head, body[:-2]))   # the CRLF before the next boundary
+    assert [b for _h, b in bodies] == [DATA[0:10], DATA[500:510], DATA[1019:1024]]
+    assert b"Content-Range: bytes 500-509/1024" in bodies[1][0]
+
+
+def test_adjacent_ranges_are_merged(client):
+    resp = get(client, Range="bytes=0-99,100-149,150-199")
+    assert resp.status_code == 206
+    assert resp.headers["Content-Range"] == "bytes 0-199/1024"
+    assert resp.data == DATA[:200]
+
+
+def test_unsatisfiable_range(client):
+    resp = get(client, Range="bytes=2000-3000")
+    assert resp.status_code == 416
+    assert resp.headers["Content-Range"] == "bytes */1024"
+
+
+@pytest.mark.parametrize("header", ["bytes=abc", "items=0-10", "bytes=10-5", "bytes 0-10",
+                                    "bytes=0-99,50-149"])   # overlapping
+def test_invalid_range_serves_the_whole_file(client, header):
+    resp = get(client, Range=header)
+    assert resp.status_code == 200
+    assert resp.data == DATA
+
+
+def test_if_none_match_and_if_modified_since(client):
+    etag = get(client).headers["ETag"]
+    assert get(client, **{"If-None-Match": etag}).status_code == 304
+    assert get(client, **{"If-None-Match": '"other"'}).status_code == 200
+    assert get(client, **{"If-Modified-Since": http_date(1_700_000_000)}).status_code == 304
+    assert get(client, **{"If-Modified-Since": http_date(1_600_000_000)}).status_code == 200
+    # If-None-Match wins over If-Modified-Since
+    assert get(client, **{"If-None-Match": '"other"',
+                          "If-Modified-Since": http_date(1_700_000_000)}).status_code == 200
+
+
+def test_if_match_and_if_unmodified_since(client):
+    etag = get(client).headers["ETag"]
+    assert get(client, **{"If-Match": etag}).status_code == 200
+    assert get(client, **{"If-Match": "*"}).status_code == 200
+    assert get(client, **{"If-Match": '"other"'}).status_code == 412
+    assert get(client, **{"If-Match": f"W/{etag}"}).status_code == 412
+    assert get(client, **{"If-Unmodified-Since": http_date(1_700_000_000)}).status_code == 200
+    assert get(client, **{"If-Unmodified-Since": http_date(1_600_000_000)}).status_code == 412
+
+
+def test_if_range(client):
+    etag = get(client).headers["ETag"]
+    resp = get(client, Range="bytes=0-9", **{"If-Range": etag})
+    assert resp.status_code == 206 and resp.data == DATA[:10]
+    resp = get(client, Range="bytes=0-9", **{"If-Range": http_date(1_700_000_000)})
+    assert resp.status_code == 206
+    # The client's copy is stale: send the whole current file instead
+    resp = get(client, Range="bytes=0-9", **{"If-Range": '"other"'})
+    assert resp.status_code == 200 and resp.data == DATA
+
+
+def test_missing_and_directory(client, tmp_path):
+    (tmp_path / "media" / "dir").mkdir()
+    assert client.get("/media/none.mp4").status_code == 404
+    assert client.get("/media/dir").status_code == 404
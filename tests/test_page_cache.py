@@ -0,0 +1,64 @@
+"""
+Tests for the page cache: the gzip stream spliced together by SlottedPage.fill.
+
+    python -m pytest -q tests
+"""
+import gzip
+import zlib
+
+import pytest
+from flask import Flask, request
+
+import page_cache
+
+# The template marker, as the plain text a rendered template contains
+SLOT = str(page_cache.SLOT)
+
+
+def strict_gunzip(data):
+    """Decompress exactly one gzip member; fail on a bad CRC/length or trailing bytes."""
+    d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    body = d.decompress(data) + d.flush()
+    assert d.eof, "gzip stream is truncated"
+    assert d.unused_data == b"", "bytes after the gzip trailer"
+    return body
+
+
+@pytest.mark.parametrize("value", ["", "x", "🙂 <b>&amp;</b>", "v" * 100_000])
+def test_filled_gzip_is_a_valid_stream_of_the_body(value):
+    html = "<html><body>" + "head " * 500 + SLOT + " tail" * 500 + "</body></html>"
+    filled = page_cache.SlottedPage(html).fill(value)
+
+    assert filled.body == html.replace(SLOT, value).encode()
+    assert strict_gunzip(filled.gzip) == filled.body
+    assert gzip.decompress(filled.gzip) == filled.body
+
+
+def test_slot_at_either_end():
+    for html in (SLOT + "tail", "head" + SLOT):
+        filled = page_cache.SlottedPage(html).fill("42")
+        assert strict_gunzip(filled.gzip) == html.replace(SLOT, "42").encode()
+
+
+def test_each_value_gets_its_own_etag():
+    page = page_cache.SlottedPage("<p>" + SLOT + "</p>")
+    assert page.fill("1").etag != page.fill("2").etag
+    assert page.fill("1").etag == page.fill("1").etag
+
+
+def test_respond_serves_gzip_and_304():
+    app = Flask(__name__)
+    page = page_cache.SlottedPage("<p>" + SLOT + "</p>")
+
+    @app.route("/")
+    def index():
+        return page_cache.respond(page.fill("7"), request)
+
+    client = app.test_client()
+    resp = client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert resp.headers["Content-Encoding"] == "gzip"
+    assert strict_gunzip(resp.data) == b"<p>7</p>"
+
+    again = client.get("/", headers={"Accept-Encoding": "gzip", "If-None-Match": resp.headers["ETag"]})
+    assert again.status_code == 304
+    assert client.get("/").data == b"<p>7</p>"
@@ -0,0 +1,91 @@
+"""
+PaymentStateMachine: event dedup, audit rows, and what survives a crash.
+"""
+import time
+
+import pytest
+
+import db
+import payment_states
+import payment_store
+from payment_states import APPLIED, DUPLICATE, STALE
+
+
+@pytest.fixture(params=["sqlite", "json"])
+def machine(request, tmp_path):
+    db_file = str(tmp_path / "app.db")
+    store = payment_store.open_store(request.param, db_file=db_file, json_file=str(tmp_path / "payments.json"))
+    machine = payment_states.PaymentStateMachine(store, db_file=db_file)
+    assert machine._same_db == (request.param == "sqlite")
+    store.add("alice", "t1", None)
+    store.add("bob", "t2", None)
+    return machine
+
+
+def test_redelivered_callback_is_a_duplicate(machine):
+    assert machine.transition("t1", "approved", "telegram", event_id="cb1").outcome == APPLIED
+    result = machine.transition("t1", "approved", "telegram", event_id="cb1")
+    assert result.outcome == DUPLICATE
+    assert result.record["status"] == "approved"
+    assert [(h["to_status"], h["event_id"]) for h in machine.history("t1")] == [("approved", "cb1")]
+
+
+def test_stale_callback_is_remembered(machine):
+    machine.transition("t1", "rejected", "admin")
+    assert machine.transition("t1", "approved", "telegram", event_id="cb1").outcome == STALE
+    assert machine.transition("t1", "approved", "telegram", event_id="cb1").outcome == DUPLICATE
+    assert machine.store.get("t1")["status"] == "rejected"
+
+
+def test_batch_writes_one_audit_row_per_applied_change(machine):
+    results = machine.transition_many([("t1", "approved", "pending"), ("t1", "rejected", "pending"),
+                                       ("t2", "rejected", "pending")], "admin")
+    assert [r.outcome for r in results] == [APPLIED, STALE, APPLIED]
+    assert len(machine.history("t1")) == len(machine.history("t2")) == 1
+
+
+def block_audit(machine):
+    db.get_connection(machine.db_file).execute(
+        "CREATE TRIGGER fail_audit BEFORE INSERT ON payment_audit BEGIN SELECT RAISE(ABORT, 'disk full'); END"
+    )
+
+
+def unblock_audit(machine):
+    db.get_connection(machine.db_file).execute("DROP TRIGGER fail_audit")
+
+
+def test_sqlite_failure_rolls_back_status_audit_and_claim(tmp_path):
+    db_file = str(tmp_path / "app.db")
+    store = payment_store.open_store("sqlite", db_file=db_file, json_file=None)
+    machine = payment_states.PaymentStateMachine(store, db_file=db_file)
+    store.add("alice", "t1", None)
+    store.add("bob", "t2", None)
+    block_audit(machine)
+    with pytest.raises(Exception):
+        machine.transition("t1", "approved", "telegram", event_id="cb1")
+    with pytest.raises(Exception):
+        machine.transition_many([("t2", "approved", "pending")], "admin")
+    assert store.get("t1")["status"] == store.get("t2")["status"] == "pending"
+    conn = db.get_connection(db_file)
+    assert conn.execute("SELECT COUNT(*) FROM payment_events").fetchone()[0] == 0
+
+    # Nothing was claimed, so Telegram's retry applies the decision
+    unblock_audit(machine)
+    assert machine.transition("t1", "approved", "telegram", event_id="cb1").outcome == APPLIED
+    assert len(machine.history("t1")) == 1
+
+
+def test_claim_left_by_a_dead_process_expires(tmp_path):
+    # JSON store: the claim can't share the status change's transaction
+    db_file = str(tmp_path / "app.db")
+    store = payment_store.open_store("json", db_file=db_file, json_file=str(tmp_path / "payments.json"))
+    machine = payment_states.PaymentStateMachine(store, db_file=db_file)
+    store.add("alice", "t1", None)
+    conn = db.get_connection(db_file)
+    # Claimed, then killed before set_status ran
+    conn.execute("INSERT INTO payment_events (event_id, txn_id, created_at) VALUES ('cb1', 't1', ?)", (time.time(),))
+    assert machine.transition("t1", "approved", "telegram", event_id="cb1").outcome == DUPLICATE
+
+    conn.execute("UPDATE payment_events SET created_at = ?", (time.time() - payment_states.CLAIM_TIMEOUT - 1,))
+    assert machine.transition("t1", "approved", "telegram", event_id="cb1").outcome == APPLIED
+    assert machine.transition("t1", "approved", "telegram", event_id="cb1").outcome == DUPLICATE
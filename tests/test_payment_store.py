@@ -0,0 +1,220 @@
+"""
+Tests for the payment store backends, mostly the log store's recovery paths.
+
+    python -m pytest -q tests
+"""
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import payment_store
+
+
+def log_store(tmp_path, **kwargs):
+    kwargs.setdefault("compact_interval", 3600)
+    return payment_store.LogPaymentStore(str(tmp_path / "payments.json"), **kwargs)
+
+
+def log_lines(tmp_path):
+    return (tmp_path / "payments.log").read_bytes().split(b"\n")
+
+
+# -------------------------------------------------
+# COMPARE-AND-SET (every backend)
+# -------------------------------------------------
+@pytest.fixture(params=["sqlite", "json", "log"])
+def store(request, tmp_path):
+    if request.param == "log":
+        return log_store(tmp_path)
+    return payment_store.open_store(request.param, db_file=str(tmp_path / "app.db"),
+                                    json_file=str(tmp_path / "payments.json"))
+
+
+def test_set_status_is_compare_and_set(store):
+    store.add("alice", "t1", None)
+    assert store.set_status("t1", "approved")["status"] == "approved"
+    assert store.set_status("t1", "rejected") is None
+    assert store.set_status("t1", "rejected", expected="approved")["status"] == "rejected"
+    assert store.set_status("missing", "approved") is None
+    assert store.get("t1")["status"] == "rejected"
+
+
+def test_set_status_many_sees_earlier_changes_in_the_batch(store):
+    store.add("alice", "t1", None)
+    store.add("bob", "t2", None)
+    results = store.set_status_many([
+        ("t1", "approved", "pending"),
+        ("t1", "rejected", "pending"),
+        ("t2", "rejected", "pending"),
+        ("t3", "approved", "pending"),
+    ])
+    assert [r and r["status"] for r in results] == ["approved", None, "rejected", None]
+    assert {t: r["status"] for t, r in store.get_many(["t1", "t2", "t3"]).items()} == \
+        {"t1": "approved", "t2": "rejected"}
+
+
+def test_add_rejects_duplicate_txn_id(store):
+    first = store.add("alice", "t1", None)
+    assert store.add("bob", "t1", None) is None
+    assert store.get("t1")["id"] == first["id"]
+
+
+# -------------------------------------------------
+# LOG STORE RECOVERY
+# -------------------------------------------------
+def test_torn_last_line_is_ignored_and_truncated(tmp_path):
+    store = log_store(tmp_path)
+    store.add("alice", "t1", None)
+    with open(tmp_path / "payments.log", "ab") as f:
+        f.write(b'{"op":"add","record":{"txn_id":"torn"')   # crashed mid-write
+
+    reopened = log_store(tmp_path)
+    assert [r["txn_id"] for r in reopened.all()] == ["t1"]
+
+    reopened.add("bob", "t2", None)
+    for line in log_lines(tmp_path):
+        if line:
+            json.loads(line)
+    assert [r["txn_id"] for r in log_store(tmp_path).all()] == ["t1", "t2"]
+
+
+def test_replay_after_compaction(tmp_path):
+    writer, reader = log_store(tmp_path), log_store(tmp_path)
+    for i in range(5):
+        writer.add("alice", f"t{i}", None)
+    writer.set_status("t0", "approved")
+    assert reader.get("t4") is not None
+
+    assert writer.compact()
+    assert len(log_lines(tmp_path)) == 2   # header + trailing newline
+    writer.add("bob", "t5", None)
+    writer.set_status("t1", "rejected")
+
+    # The reader crosses into the new generation and applies what follows
+    assert reader.get("t5")["id"] == 6
+    assert reader.get("t1")["status"] == "rejected"
+    fresh = log_store(tmp_path)
+    assert [r["id"] for r in fresh.all()] == [1, 2, 3, 4, 5, 6]
+    assert fresh.get("t0")["status"] == "approved"
+
+
+def test_replaying_lines_already_in_the_snapshot_is_harmless(tmp_path):
+    store = log_store(tmp_path)
+    store.add("alice", "t1", None)
+    store.add("bob", "t2", None)
+    store.set_status("t2", "approved")
+    # Crash between writing the snapshot and starting the new log generation
+    payment_store._write_snapshot(store.json_file, store.all())
+
+    fresh = log_store(tmp_path)
+    assert [(r["id"], r["txn_id"], r["status"]) for r in fresh.all()] == \
+        [(1, "t1", "pending"), (2, "t2", "approved")]
+
+
+def test_reader_that_missed_a_generation_reloads(tmp_path):
+    writer, reader = log_store(tmp_path), log_store(tmp_path)
+    writer.add("alice", "t1", None)
+    assert reader.get("t1") is not None
+
+    writer.compact()
+    writer.add("bob", "t2", None)
+    writer.compact()
+    writer.set_status("t1", "approved")
+
+    assert reader.get("t2")["id"] == 2
+    assert reader.get("t1")["status"] == "approved"
+    assert reader._gen == writer._gen
+
+
+def test_concurrent_writers_share_fsyncs(tmp_path, monkeypatch):
+    store = log_store(tmp_path)
+    real_fsync, calls = os.fsync, []
+
+    def slow_fsync(fd):
+        calls.append(fd)
+        time.sleep(0.05)
+        real_fsync(fd)
+
+    monkeypatch.setattr(os, "fsync", slow_fsync)
+    threads = [threading.Thread(target=store.add, args=("u", f"t{i}", None)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(store.all()) == 20
+    assert store._synced == store._written == 20
+    assert len(calls) < 20
+
+
+def _write_payments(json_file, worker, count, compact_bytes):
+    store = payment_store.LogPaymentStore(json_file, compact_bytes=compact_bytes, compact_interval=0.01)
+    for i in range(count):
+        txn_id = f"w{worker}-{i}"
+        store.add(f"user{worker}", txn_id, None)
+        if i % 3 == 0:
+            store.set_status(txn_id, "approved")
+
+
+def test_writers_in_several_processes(tmp_path):
+    json_file = str(tmp_path / "payments.json")
+    payment_store.LogPaymentStore(json_file)
+    ctx = multiprocessing.get_context("fork")
+    # A small compaction threshold, so generations turn over under the writers
+    procs = [ctx.Process(target=_write_payments, args=(json_file, w, 40, 2000)) for w in range(4)]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join(60)
+        assert proc.exitcode == 0
+
+    records = payment_store.LogPaymentStore(json_file).all()
+    assert [r["id"] for r in records] == list(range(1, 161))
+    assert len({r["txn_id"] for r in records}) == 160
+    for r in records:
+        approved = int(r["txn_id"].split("-")[1]) % 3 == 0
+        assert r["status"] == ("approved" if approved else "pending")
+
+
+# -------------------------------------------------
+# SQLITE MIGRATION
+# -------------------------------------------------
+def test_sqlite_upgrades_old_schema_and_imports_json_once(tmp_path):
+    db_file, json_file = str(tmp_path / "app.db"), tmp_path / "payments.json"
+    conn = sqlite3.connect(db_file)
+    conn.executescript("""
+        CREATE TABLE payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            txn_id TEXT NOT NULL,
+            user TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            ss_path TEXT,
+            created_at REAL,
+            updated_at REAL
+        );
+        CREATE UNIQUE INDEX payments_txn_id ON payments (txn_id);
+    """)
+    conn.close()
+    json_file.write_text(json.dumps([
+        {"user": "alice", "txn_id": "t1", "status": "approved", "ss_path": "payment_ss\\t1.png"},
+        {"user": "bob", "txn_id": "t2", "status": "pending", "ss_path": None},
+        {"user": "eve", "txn_id": "t1", "status": "pending", "ss_path": None},
+    ]))
+
+    store = payment_store.SqlitePaymentStore(db_file, json_file=str(json_file))
+    assert [(r["txn_id"], r["user"], r["status"], r["ss_path"], r["ss_hash"]) for r in store.all()] == [
+        ("t1", "alice", "approved", "payment_ss/t1.png", None),
+        ("t2", "bob", "pending", None, None),
+    ]
+
+    # Records added later never come back from the JSON file
+    store.set_status("t2", "rejected")
+    json_file.write_text(json.dumps([{"user": "mallory", "txn_id": "t3"}]))
+    again = payment_store.SqlitePaymentStore(db_file, json_file=str(json_file))
+    assert [r["txn_id"] for r in again.all()] == ["t1", "t2"]
+    assert again.get("t2")["status"] == "rejected"
@@ -0,0 +1,70 @@
+"""
+Tests for deduplicated payment screenshots and the one-time hash backfill.
+
+    python -m pytest -q tests
+"""
+import pytest
+
+import payment_store
+import screenshots
+
+
+@pytest.fixture(params=["sqlite", "json", "log"])
+def store(request, tmp_path):
+    return payment_store.open_store(request.param, db_file=str(tmp_path / "app.db"),
+                                    json_file=str(tmp_path / "payments.json"))
+
+
+@pytest.fixture
+def shots(tmp_path):
+    return screenshots.ScreenshotStore(str(tmp_path / "ss"), db_file=str(tmp_path / "app.db"))
+
+
+def old_screenshot(tmp_path, name, data):
+    path = tmp_path / "ss" / name
+    path.parent.mkdir(exist_ok=True)
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_backfill_keeps_one_copy_of_identical_screenshots(store, shots, tmp_path):
+    first = old_screenshot(tmp_path, "a.png", b"same image")
+    second = old_screenshot(tmp_path, "b.png", b"same image")
+    other = old_screenshot(tmp_path, "c.png", b"another image")
+    for txn_id, path in (("t1", first), ("t2", second), ("t3", other)):
+        store.add("alice", txn_id, path)
+
+    shots.discard(store.backfill_ss_hashes(shots.adopt))
+
+    records = {r["txn_id"]: r for r in store.all()}
+    assert records["t1"]["ss_path"] == records["t2"]["ss_path"]
+    assert records["t1"]["ss_hash"] == records["t2"]["ss_hash"]
+    kept = records["t1"]["ss_path"]
+    assert (tmp_path / "ss" / kept.rsplit("/", 1)[-1]).read_bytes() == b"same image"
+    assert sorted(p.name for p in (tmp_path / "ss").glob("*.png")) == sorted(
+        [kept.rsplit("/", 1)[-1], "c.png"])
+    assert shots.use_counts([records["t1"]["ss_hash"]])[records["t1"]["ss_hash"]] == 2
+
+
+def test_backfill_runs_once_per_store(store, shots, tmp_path):
+    store.add("alice", "t1", old_screenshot(tmp_path, "a.png", b"image"))
+    calls = []
+
+    def adopt(txn_id, path):
+        calls.append(txn_id)
+        return shots.adopt(txn_id, path)
+
+    store.backfill_ss_hashes(adopt)
+    assert calls == ["t1"]
+
+    # A record without a hash (e.g. written by an older worker) is not picked up again
+    store.add("bob", "t2", old_screenshot(tmp_path, "b.png", b"image 2"))
+    assert store.backfill_ss_hashes(adopt) == []
+    assert calls == ["t1"]
+
+
+def test_discard_keeps_registered_blobs(shots, tmp_path):
+    path = old_screenshot(tmp_path, "a.png", b"image")
+    shots.adopt("t1", path)
+    assert shots.discard([path, str(tmp_path / "ss" / "gone.png")]) == 0
+    assert (tmp_path / "ss" / "a.png").exists()
@@ -0,0 +1,67 @@
+"""
+Tests for signed media URLs: expiry, tampering and prefix signatures.
+
+    python -m pytest -q tests
+"""
+from urllib.parse import parse_qs, urlsplit
+
+from signed_urls import UrlSigner
+
+NOW = 1_700_000_000
+
+
+def parts(url):
+    split = urlsplit(url)
+    query = parse_qs(split.query)
+    return split.path, query["exp"][0], query["sig"][0]
+
+
+def test_signed_url_verifies_until_it_expires():
+    signer = UrlSigner("secret", ttl=600, step=60)
+    path, exp, sig = parts(signer.sign("/media/intro.mp4", exp=NOW + 600))
+
+    assert path == "/media/intro.mp4"
+    assert signer.verify(path, exp, sig, now=NOW) == 600
+    assert signer.verify(path, exp, sig, now=NOW + 599) == 1
+    assert signer.verify(path, exp, sig, now=NOW + 600) == 0
+    assert signer.verify(path, exp, sig, now=NOW + 3600) == 0
+
+
+def test_tampered_urls_are_refused():
+    signer = UrlSigner("secret")
+    path, exp, sig = parts(signer.sign("/media/intro.mp4", exp=NOW + 600))
+
+    assert signer.verify("/media/other.mp4", exp, sig, now=NOW) == 0
+    assert signer.verify(path, str(NOW + 6000), sig, now=NOW) == 0
+    assert signer.verify(path, exp, sig[:-1] + ("A" if sig[-1] != "A" else "B"), now=NOW) == 0
+    assert signer.verify(path, exp, "", now=NOW) == 0
+    assert signer.verify(path, "", sig, now=NOW) == 0
+    assert signer.verify(path, "-1", sig, now=NOW) == 0
+    assert signer.verify(path, "9" * 13, sig, now=NOW) == 0
+    # Another secret, or the same secret under another salt, signs differently
+    assert UrlSigner("other").verify(path, exp, sig, now=NOW) == 0
+    assert UrlSigner("secret", salt="payment-ss").verify(path, exp, sig, now=NOW) == 0
+
+
+def test_expiry_is_rounded_up_to_a_step():
+    signer = UrlSigner("secret", ttl=3600, step=600)
+    exp = signer.expiry(now=NOW)
+    assert exp % 600 == 0 and NOW + 3600 < exp <= NOW + 3600 + 600
+    assert signer.sign("/media/a.mp4", exp) == signer.sign("/media/a.mp4", signer.expiry(now=NOW + 1))
+
+
+def test_quoted_paths_are_signed_unquoted():
+    signer = UrlSigner("secret")
+    url = signer.sign("/media/my video.mp4", exp=NOW + 600)
+    assert url.startswith("/media/my%20video.mp4?")
+    _path, exp, sig = parts(url)
+    assert signer.verify("/media/my video.mp4", exp, sig, now=NOW)
+
+
+def test_prefix_signature_only_covers_its_prefix():
+    signer = UrlSigner("secret")
+    exp, sig = signer.sign_prefix("/hls/intro.mp4/", exp=NOW + 600)
+
+    assert signer.verify("/hls/intro.mp4/", exp, sig, now=NOW) == 600
+    assert signer.verify("/hls/other.mp4/", exp, sig, now=NOW) == 0
+    assert signer.verify("/hls/intro.mp4/v0/index.m3u8", exp, sig, now=NOW) == 0
@@ -0,0 +1,100 @@
+"""
+Tests for the Telegram outbox: leases, sweeping and claiming before a send.
+
+Two dispatchers on one database stand in for two gunicorn workers; their
+sender threads are not started, the tests drive the consumer side directly.
+"""
+import time
+import uuid
+
+import pytest
+
+import forksafe
+import telegram_dispatch
+from telegram_dispatch import LEASE_SECONDS
+
+
+class Response:
+    status_code = 200
+    text = ""
+
+
+def worker(db_file, sent):
+    dispatcher = telegram_dispatch.TelegramDispatcher("token", db_file=db_file)
+    dispatcher._owner = forksafe.PerProcess(lambda: uuid.uuid4().hex)   # a process of its own
+    dispatcher._senders = forksafe.PerProcess(lambda: None)
+
+    def post(method, payload, photo_path):
+        sent.append((dispatcher, payload["text"]))
+        return Response()
+
+    dispatcher._post = post
+    return dispatcher
+
+
+@pytest.fixture
+def sent():
+    return []
+
+
+@pytest.fixture
+def workers(tmp_path, sent):
+    db_file = str(tmp_path / "app.db")
+    return worker(db_file, sent), worker(db_file, sent)
+
+
+def queued(dispatcher):
+    return [dispatcher._queue.get_nowait() for _ in range(dispatcher._queue.qsize())]
+
+
+def test_row_taken_over_by_another_worker_is_sent_once(workers, sent):
+    a, b = workers
+    a.send("sendMessage", {"chat_id": 1, "text": "hi"})
+    row_id, = queued(a)
+
+    # A's queue was slower than the lease: B's sweeper takes the row over
+    later = time.time() + LEASE_SECONDS + 1
+    b._sweep(later)
+    assert queued(b) == [row_id]
+
+    a._deliver(row_id)
+    b._deliver(row_id)
+    assert sent == [(b, "hi")]
+    assert a.backlog() == (0, 0)
+
+
+def test_queued_rows_keep_their_lease(workers, sent):
+    a, b = workers
+    a.send("sendMessage", {"chat_id": 1, "text": "hi"})
+    row_id, = queued(a)
+
+    now = time.time()
+    for step in range(1, 6):
+        a._renew(now + step * LEASE_SECONDS * 0.6)
+        b._sweep(now + step * LEASE_SECONDS * 0.6 + 1)
+    assert queued(b) == []
+
+    a._deliver(row_id)
+    assert sent == [(a, "hi")]
+
+
+def test_full_queue_hands_the_row_to_the_sweeper(workers, sent):
+    a, b = workers
+    a._queue.maxsize = 1
+    a.send("sendMessage", {"chat_id": 1, "text": "first"})
+    a.send("sendMessage", {"chat_id": 1, "text": "second"})
+    first, = queued(a)
+
+    b._sweep(time.time())
+    second, = queued(b)
+    a._deliver(first)
+    b._deliver(second)
+    assert sorted(text for _, text in sent) == ["first", "second"]
+
+
+def test_callback_answers_skip_the_message_queue(workers):
+    a, _ = workers
+    a.send("sendMessage", {"chat_id": 1, "text": "hi"})
+    a.send("answerCallbackQuery", {"callback_query_id": "c1", "text": "ok"})
+    assert a._queue.qsize() == 1
+    assert a._urgent.qsize() == 1
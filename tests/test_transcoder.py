@@ -0,0 +1,57 @@
+"""
+Transcode slots bound ffmpeg runs across every process that shares them.
+"""
+import multiprocessing
+import threading
+import time
+
+import pytest
+
+import transcoder
+
+
+@pytest.fixture
+def slots(tmp_path):
+    return [str(tmp_path / f"slot-{i}") for i in range(2)]
+
+
+def test_third_job_waits_for_a_free_slot(slots):
+    first, second = transcoder.take_slot(slots), transcoder.take_slot(slots)
+    taken = []
+    waiter = threading.Thread(target=lambda: taken.append(transcoder.take_slot(slots, poll_interval=0.05)))
+    waiter.start()
+    time.sleep(0.3)
+    assert taken == []
+
+    second.close()
+    waiter.join(2)
+    assert len(taken) == 1
+    first.close()
+    taken[0].close()
+
+
+def _hold_slot(slots, running, peak, lock):
+    slot = transcoder.take_slot(slots, poll_interval=0.01)
+    with lock:
+        running.value += 1
+        peak.value = max(peak.value, running.value)
+    time.sleep(0.2)
+    with lock:
+        running.value -= 1
+    slot.close()
+
+
+def test_slots_are_shared_between_processes(slots):
+    ctx = multiprocessing.get_context("fork")
+    running, peak, lock = ctx.Value("i", 0), ctx.Value("i", 0), ctx.Lock()
+    procs = [ctx.Process(target=_hold_slot, args=(slots, running, peak, lock)) for _ in range(5)]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join(10)
+        assert proc.exitcode == 0
+    assert peak.value == 2
+
+
+def test_each_source_file_gets_its_own_renditions():
+    assert transcoder.hls_dir_name("intro.mp4") != transcoder.hls_dir_name("intro.mov")
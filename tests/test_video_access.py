@@ -0,0 +1,69 @@
+"""
+A viewer holding only a signed link can play the adaptive stream.
+"""
+import os
+import re
+import time
+from urllib.parse import urljoin
+
+import pytest
+
+import db
+
+
+@pytest.fixture
+def video(app_module):
+    name = "lesson one.mp4"
+    os.makedirs(app_module.UPLOAD_FOLDER, exist_ok=True)
+    src = os.path.join(app_module.UPLOAD_FOLDER, name)
+    with open(src, "wb") as f:
+        f.write(b"\0" * 64)
+    out = os.path.join(app_module.HLS_FOLDER, name, "v0")
+    os.makedirs(out, exist_ok=True)
+    with open(os.path.join(app_module.HLS_FOLDER, name, "master.m3u8"), "w") as f:
+        f.write("#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=800000\nv0/index.m3u8\n")
+    with open(os.path.join(out, "index.m3u8"), "w") as f:
+        f.write("#EXTM3U\n#EXTINF:6.0,\nseg_00000.ts\n#EXT-X-ENDLIST\n")
+    with open(os.path.join(out, "seg_00000.ts"), "wb") as f:
+        f.write(b"G" * 188)
+    db.get_connection(app_module.DB_FILE).execute(
+        "INSERT OR REPLACE INTO transcode_jobs (name, status, progress, source_mtime_ns, updated_at) "
+        "VALUES (?, 'done', 1, ?, ?)",
+        (name, os.stat(src).st_mtime_ns, time.time()),
+    )
+    return name
+
+
+def hls_url(app_module, client, name):
+    page = client.get(app_module.media_urls.sign(f"/view_video/{name}"))
+    assert page.status_code == 200
+    return page.get_data(as_text=True).split("const hlsUrl = ", 1)[1].split(";", 1)[0].strip('"')
+
+
+def test_signed_viewer_gets_playlists_and_segments(app_module, video):
+    client = app_module.app.test_client()
+    master = hls_url(app_module, client, video)
+
+    response = client.get(master)
+    assert response.status_code == 200
+    assert response.mimetype == "application/vnd.apple.mpegurl"
+    assert response.headers["Cache-Control"].startswith("public, max-age=")
+
+    # Relative links in the playlists keep the signature
+    variant = urljoin(master, "v0/index.m3u8")
+    assert client.get(variant).status_code == 200
+    segment = client.get(urljoin(variant, "seg_00000.ts"))
+    assert segment.status_code == 200
+    assert segment.mimetype == "video/mp2t"
+    assert segment.data == b"G" * 188
+
+
+def test_hls_signature_is_checked(app_module, video):
+    client = app_module.app.test_client()
+    master = hls_url(app_module, client, video)
+    tampered = re.sub(r"/hls/(\d+)/", lambda m: f"/hls/{int(m.group(1)) + 3600}/", master)
+    assert client.get(tampered).status_code == 403
+    # Another video's signature doesn't open this one
+    assert client.get(master.replace("lesson%20one.mp4", "other.mp4", 1)).status_code == 403
+    traversal = master.replace("master.m3u8", "..%2F..%2F..%2Fstockboy.db")
+    assert client.get(traversal).status_code == 404
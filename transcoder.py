@@ -0,0 +1,210 @@
+"""
+Background HLS transcoding for uploaded course videos.
+
+Each upload of a video queues a job. Jobs run in a small process pool; each
+one waits for one of `workers` slots (flock'd files shared by every gunicorn
+worker, so the bound holds for the whole instance), then drives a local
+ffmpeg that writes 360p and 720p HLS renditions plus a master playlist to
+static/hls/<video>/, which app.py serves under signed /hls/ URLs. Job state
+and progress live in SQLite, so any worker can report them and view_video
+can switch to the adaptive stream once the job is done.
+
+Without ffmpeg on the PATH nothing is queued and videos play as uploaded.
+"""
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import db
+import forksafe
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines
+    fcntl = None
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transcode_jobs (
+    name TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    error TEXT,
+    source_mtime_ns INTEGER,
+    updated_at REAL
+);
+"""
+
+VIDEO_EXTENSIONS = {"mp4", "mkv", "webm", "avi", "mov"}
+
+# (height, video bitrate, max rate, buffer)
+RENDITIONS = [
+    (360, "800k", "856k", "1200k"),
+    (720, "2800k", "2996k", "4200k"),
+]
+SEGMENT_SECONDS = 6
+
+
+def hls_dir_name(name):
+    # The whole filename: intro.mp4 and intro.mov get their own renditions
+    return name
+
+
+def _set_job(db_file, name, **fields):
+    fields["updated_at"] = time.time()
+    columns = ", ".join(f"{k} = ?" for k in fields)
+    db.get_connection(db_file).execute(
+        f"UPDATE transcode_jobs SET {columns} WHERE name = ?", (*fields.values(), name)
+    )
+
+
+def _probe(src):
+    out = subprocess.run(
+        ["ffprobe", "-v", "error", "-show_entries", "format=duration:stream=codec_type",
+         "-of", "json", src],
+        capture_output=True, text=True, check=True,
+    ).stdout
+    info = json.loads(out)
+    duration = float(info.get("format", {}).get("duration") or 0)
+    has_audio = any(s.get("codec_type") == "audio" for s in info.get("streams", []))
+    return duration, has_audio
+
+
+def _ffmpeg_command(src, out_dir, has_audio):
+    n = len(RENDITIONS)
+    split = f"[0:v]split={n}" + "".join(f"[v{i}]" for i in range(n))
+    scales = ";".join(f"[v{i}]scale=w=-2:h={h}[v{i}out]" for i, (h, *_rest) in enumerate(RENDITIONS))
+    cmd = ["ffmpeg", "-y", "-loglevel", "error", "-nostats", "-progress", "pipe:1", "-i", src,
+           "-filter_complex", f"{split};{scales}"]
+
+    for i, (_h, rate, maxrate, bufsize) in enumerate(RENDITIONS):
+        cmd += ["-map", f"[v{i}out]", f"-c:v:{i}", "libx264", f"-b:v:{i}", rate,
+                f"-maxrate:v:{i}", maxrate, f"-bufsize:v:{i}", bufsize]
+        if has_audio:
+            cmd += ["-map", "0:a:0"]
+    if has_audio:
+        cmd += ["-c:a", "aac", "-b:a", "128k", "-ac", "2"]
+
+    # Fixed GOP so every segment starts on a keyframe in every rendition
+    cmd += ["-preset", "veryfast", "-g", "48", "-keyint_min", "48", "-sc_threshold", "0",
+            "-f", "hls", "-hls_time", str(SEGMENT_SECONDS), "-hls_playlist_type", "vod",
+            "-hls_flags", "independent_segments",
+            "-hls_segment_filename", os.path.join(out_dir, "v%v", "seg_%05d.ts"),
+            "-master_pl_name", "master.m3u8",
+            "-var_stream_map", " ".join(f"v:{i},a:{i}" if has_audio else f"v:{i}" for i in range(n)),
+            os.path.join(out_dir, "v%v", "index.m3u8")]
+    return cmd
+
+
+def take_slot(slot_paths, poll_interval=1.0):
+    """Block until one of the slot files can be locked; returns it (close to release)."""
+    if not fcntl:
+        return None
+    while True:
+        for path in slot_paths:
+            slot = open(path, "a+b")
+            try:
+                fcntl.flock(slot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return slot
+            except BlockingIOError:
+                slot.close()
+        time.sleep(poll_interval)
+
+
+def run_job(src, out_dir, db_file, name, slot_paths):
+    """Runs in a pool process: transcode one video, reporting progress to SQLite."""
+    # Stays 'queued' while other workers' jobs hold every slot
+    slot = take_slot(slot_paths)
+    try:
+        _transcode(src, out_dir, db_file, name)
+    finally:
+        if slot is not None:
+            slot.close()
+
+
+def _transcode(src, out_dir, db_file, name):
+    _set_job(db_file, name, status="running")
+    tmp_dir = out_dir + ".tmp"
+    try:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        duration, has_audio = _probe(src)
+        proc = subprocess.Popen(_ffmpeg_command(src, tmp_dir, has_audio),
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        last_report = 0.0
+        for line in proc.stdout:
+            key, _, value = line.strip().partition("=")
+            if key == "out_time_us" and value.isdigit() and duration:
+                now = time.monotonic()
+                if now - last_report >= 1:
+                    last_report = now
+                    _set_job(db_file, name, progress=min(0.99, int(value) / 1e6 / duration))
+        stderr = proc.stderr.read()
+        if proc.wait() != 0:
+            raise RuntimeError(stderr.strip().splitlines()[-1] if stderr.strip() else "ffmpeg failed")
+
+        # Swap the finished renditions in atomically
+        shutil.rmtree(out_dir, ignore_errors=True)
+        os.replace(tmp_dir, out_dir)
+        _set_job(db_file, name, status="done", progress=1.0, error=None)
+    except Exception as e:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        _set_job(db_file, name, status="failed", error=str(e)[:500])
+
+
+class Transcoder:
+    def __init__(self, src_folder, hls_folder, db_file=None, workers=1):
+        self.src_folder = src_folder
+        self.hls_folder = hls_folder
+        self.db_file = db_file
+        self.workers = workers
+        self.available = shutil.which("ffmpeg") is not None and shutil.which("ffprobe") is not None
+        # `workers` ffmpegs at most across all processes, however many pools there are
+        self.slot_paths = [os.path.join(hls_folder, f".transcode-slot-{i}.lock") for i in range(workers)]
+        # Spawned, so the ffmpeg workers don't inherit gevent or our threads
+        self._pool = forksafe.PerProcess(lambda: ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+        ))
+        db.get_connection(db_file).executescript(SCHEMA)
+
+    def submit(self, name):
+        """Queue an HLS job for a freshly uploaded file. No-op for non-videos."""
+        if not self.available or name.lower().rsplit(".", 1)[-1] not in VIDEO_EXTENSIONS:
+            return False
+        src = os.path.join(self.src_folder, name)
+        mtime_ns = os.stat(src).st_mtime_ns
+        db.get_connection(self.db_file).execute(
+            "INSERT OR REPLACE INTO transcode_jobs (name, status, progress, source_mtime_ns, updated_at) "
+            "VALUES (?, 'queued', 0, ?, ?)",
+            (name, mtime_ns, time.time()),
+        )
+        out_dir = os.path.join(self.hls_folder, hls_dir_name(name))
+        os.makedirs(self.hls_folder, exist_ok=True)
+        self._pool.get().submit(run_job, src, out_dir, self.db_file, name, self.slot_paths)
+        return True
+
+    def job(self, name):
+        row = db.get_connection(self.db_file).execute(
+            "SELECT * FROM transcode_jobs WHERE name = ?", (name,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def hls_playlist(self, name):
+        """Master playlist path under hls_folder, if the renditions are ready and match the current source."""
+        job = self.job(name)
+        if not job or job["status"] != "done":
+            return None
+        try:
+            if os.stat(os.path.join(self.src_folder, name)).st_mtime_ns != job["source_mtime_ns"]:
+                return None
+        except FileNotFoundError:
+            return None
+        master = os.path.join(self.hls_folder, hls_dir_name(name), "master.m3u8")
+        if not os.path.isfile(master):
+            # Renditions from before the directory was named after the whole filename
+            self.submit(name)
+            return None
+        return f"{hls_dir_name(name)}/master.m3u8"